@@ -0,0 +1,104 @@
+# Copyright 2016 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Aggregate machines by dimension for the report."""
+
+import array
+from collections import Counter
+
+from .export import get_field
+
+
+# Dimensions the machines are aggregated by, mapped to their API field.
+DIMENSIONS = {
+    "status": "status_name",
+    "zone": "zone",
+    "pool": "pool",
+    "architecture": "architecture",
+    "power_state": "power_state",
+}
+
+# Label used when a machine has no value for a dimension.
+UNKNOWN = "Unknown"
+
+
+class MachineColumns:
+    """Machines stored as a column of interned codes per dimension.
+
+    Each distinct value of a dimension is stored once and every machine only
+    adds an integer code to each column, so aggregating a dimension is a
+    single counting pass over a compact array instead of a loop over the
+    machine objects.
+    """
+
+    def __init__(self, dimensions=None):
+        """Initialize the columns.
+
+        :param dimensions: Mapping of dimension to the API field it's read
+            from. Defaults to `DIMENSIONS`.
+        """
+        self.dimensions = DIMENSIONS if dimensions is None else dimensions
+        self.values = {dimension: [] for dimension in self.dimensions}
+        self.columns = {
+            dimension: array.array("I") for dimension in self.dimensions
+        }
+        self._codes = {dimension: {} for dimension in self.dimensions}
+        self.count = 0
+
+    def _intern(self, dimension, value):
+        """Return the code for `value` in `dimension`."""
+        codes = self._codes[dimension]
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(self.values[dimension])
+            self.values[dimension].append(value)
+        return code
+
+    def append(self, data):
+        """Add the machine with the API `data` to the columns."""
+        for dimension, field in self.dimensions.items():
+            value = get_field(data, field)
+            self.columns[dimension].append(self._intern(
+                dimension, UNKNOWN if value is None else str(value)))
+        self.count += 1
+
+    def counts(self, dimension):
+        """Return the number of machines for each value of `dimension`."""
+        values = self.values[dimension]
+        return {
+            values[code]: count
+            for code, count in Counter(self.columns[dimension]).items()
+        }
+
+    def aggregate(self):
+        """Return the chart data of every dimension."""
+        return {
+            dimension: to_chart(self.counts(dimension))
+            for dimension in self.dimensions
+        }
+
+
+def to_chart(counts):
+    """Return `counts` as chart data with sorted labels."""
+    labels = sorted(counts)
+    return {
+        "data": [counts[label] for label in labels],
+        "labels": labels,
+    }
+
+
+def from_chart(chart):
+    """Return the counts from the chart data of `to_chart`."""
+    return dict(zip(chart["labels"], chart["data"]))
+
+
+def merge_aggregates(aggregates):
+    """Merge the chart data of every dimension in each of `aggregates`."""
+    totals = {}
+    for aggregate in aggregates:
+        for dimension, chart in aggregate.items():
+            totals.setdefault(dimension, Counter()).update(from_chart(chart))
+    return {
+        dimension: to_chart(counts)
+        for dimension, counts in totals.items()
+    }
@@ -0,0 +1,146 @@
+# Copyright 2016 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Fingerprint and precompress the static assets of the HTML report."""
+
+import gzip
+import hashlib
+import io
+import os
+import posixpath
+import re
+
+from .state import write_atomically
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Number of characters of the content hash added to each asset's name.
+FINGERPRINT_LENGTH = 12
+
+# Entry points of the report that keep their name.
+ENTRY_POINTS = frozenset(["index.html"])
+
+# Assets whose references to other assets are rewritten.
+REWRITTEN_EXTENSIONS = (".css", ".html")
+
+# Assets that are already compressed and gain nothing from precompressing.
+COMPRESSED_EXTENSIONS = (
+    ".gif", ".gz", ".jpeg", ".jpg", ".png", ".woff", ".woff2")
+
+# References in stylesheets and in HTML.
+CSS_REFERENCE = re.compile(r"""(url\(\s*['"]?)([^'")]+)(['"]?\s*\))""")
+HTML_REFERENCE = re.compile(r"""(\b(?:src|href)=["'])([^"']+)(["'])""")
+
+
+def get_fingerprinted_name(path, content):
+    """Return `path` with the hash of `content` before its extension."""
+    base, ext = posixpath.splitext(path)
+    digest = hashlib.sha256(content).hexdigest()[:FINGERPRINT_LENGTH]
+    return "%s.%s%s" % (base, digest, ext)
+
+
+def resolve_reference(reference, path, manifest):
+    """Return `reference` from the asset `path` using the names in `manifest`.
+
+    References that are absolute, external or to assets that are not in the
+    manifest are returned unchanged.
+    """
+    if reference.startswith(("/", "#", "data:")) or "://" in reference:
+        return reference
+    match = re.match(r"([^?#]*)(.*)", reference)
+    target, suffix = match.group(1), match.group(2)
+    directory = posixpath.dirname(path)
+    resolved = posixpath.normpath(posixpath.join(directory, target))
+    if resolved not in manifest:
+        return reference
+    return posixpath.relpath(manifest[resolved], directory or ".") + suffix
+
+
+def rewrite_references(content, path, manifest):
+    """Rewrite the references in the asset `path` to fingerprinted names."""
+    pattern = CSS_REFERENCE if path.endswith(".css") else HTML_REFERENCE
+
+    def replace(match):
+        """Replace the reference in `match`."""
+        return "%s%s%s" % (
+            match.group(1),
+            resolve_reference(match.group(2), path, manifest),
+            match.group(3))
+
+    return pattern.sub(replace, content)
+
+
+def gzip_compress(content):
+    """Return `content` compressed with gzip, the same on every run.
+
+    The header's mtime is zeroed; `gzip.compress` only takes it from
+    Python 3.8.
+    """
+    compressed = io.BytesIO()
+    with gzip.GzipFile(
+            fileobj=compressed, mode="wb", compresslevel=9,
+            mtime=0) as stream:
+        stream.write(content)
+    return compressed.getvalue()
+
+
+def write_asset(path, content):
+    """Write the asset `content` to `path` with its precompressed siblings.
+
+    `.gz` is always written and `.br` when brotli is installed, unless the
+    asset is already compressed. The asset itself is written last so it only
+    exists once its siblings are complete.
+    """
+    if not path.endswith(COMPRESSED_EXTENSIONS):
+        with open(path + ".gz", "wb") as stream:
+            stream.write(gzip_compress(content))
+        if brotli is not None:
+            with open(path + ".br", "wb") as stream:
+                stream.write(brotli.compress(content))
+    with write_atomically(path, "wb") as stream:
+        stream.write(content)
+
+
+def iter_assets(src):
+    """Yield the path of every asset in `src`, relative to `src`."""
+    for directory, _, filenames in os.walk(src):
+        for filename in filenames:
+            relpath = os.path.relpath(os.path.join(directory, filename), src)
+            yield relpath.replace(os.sep, "/")
+
+
+def build_assets(src, dst):
+    """Copy the assets in `src` to `dst` with fingerprinted names.
+
+    The references in stylesheets and HTML are rewritten to the new names,
+    so every asset except the entry points can be cached forever. Each
+    asset is also precompressed. Returns the mapping of each asset's path to
+    its fingerprinted path.
+    """
+    manifest = {}
+    # Assets that reference other assets are built once the names of the
+    # assets they reference are known, and the entry points last of all.
+    assets = sorted(
+        iter_assets(src),
+        key=lambda path: (
+            path in ENTRY_POINTS, path.endswith(REWRITTEN_EXTENSIONS), path))
+    for path in assets:
+        with open(os.path.join(src, path), "rb") as stream:
+            content = stream.read()
+        if path.endswith(REWRITTEN_EXTENSIONS):
+            content = rewrite_references(
+                content.decode("utf-8"), path, manifest).encode("utf-8")
+        if path in ENTRY_POINTS:
+            target = path
+        else:
+            target = manifest[path] = get_fingerprinted_name(path, content)
+        target_path = os.path.join(dst, *target.split("/"))
+        # Fingerprinted assets never change so they are only written once.
+        if path in ENTRY_POINTS or not os.path.exists(target_path):
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            write_asset(target_path, content)
+    return manifest
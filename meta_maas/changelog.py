@@ -0,0 +1,125 @@
+# Copyright 2016 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Users added to a directory, read from a changelog since a watermark."""
+
+import json
+import os
+from collections import namedtuple
+
+from .journal import get_digest
+from .schema import ValidationError, compile_schema
+from .state import write_atomically
+from .users import RECORD_SCHEMA
+
+
+# Schema of a record in the changelog. `seq` increases with each record.
+CHANGE_SCHEMA = dict(
+    RECORD_SCHEMA,
+    properties=dict(RECORD_SCHEMA["properties"], seq={"type": "integer"}),
+    required=["seq"] + RECORD_SCHEMA["required"])
+
+# Position in the changelog up to which a region has its changes applied.
+# `offset` is the byte offset after the record with `seq`.
+Watermark = namedtuple("Watermark", ["seq", "offset"])
+
+# Watermark of a region that has none of the changes applied.
+START = Watermark(0, 0)
+
+# A user added to the directory and the watermark once it's applied.
+Change = namedtuple("Change", ["watermark", "username", "data"])
+
+
+class ChangelogError(Exception):
+    """Raised when the changelog cannot be read."""
+
+
+class Changelog:
+    """NDJSON file that a directory export appends the users it adds to.
+
+    Each record is a user with the `seq` of the change. The watermark of
+    each region is kept in `directory`, so a run only reads the records
+    appended since the last run that synced the region.
+    """
+
+    def __init__(self, path, directory):
+        """Initialize the changelog.
+
+        :param directory: Directory the watermarks are kept in.
+        """
+        self.path = path
+        self.directory = directory
+        self.validate = compile_schema(CHANGE_SCHEMA)
+
+    def get_watermark_path(self, region_name):
+        """Return the path of the watermark of `region_name`."""
+        return os.path.join(
+            self.directory, "%s.json" % get_digest(
+                [os.path.abspath(self.path), region_name])[:16])
+
+    def get_watermark(self, region_name):
+        """Return the `Watermark` of `region_name`."""
+        try:
+            with open(self.get_watermark_path(region_name), "r") as stream:
+                data = json.load(stream)
+            return Watermark(data["seq"], data["offset"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return START
+
+    def set_watermark(self, region_name, watermark):
+        """Keep `watermark` as the watermark of `region_name`."""
+        path = self.get_watermark_path(region_name)
+        with write_atomically(path) as stream:
+            json.dump(watermark._asdict(), stream)
+
+    def _seek(self, stream, watermark):
+        """Move `stream` to the offset of `watermark`.
+
+        The changelog is read from the start when it's shorter than the
+        offset or the offset isn't at the end of a record, as it was
+        rotated or rewritten. The records up to the watermark's `seq` are
+        then skipped.
+        """
+        size = os.fstat(stream.fileno()).st_size
+        if 0 < watermark.offset <= size:
+            stream.seek(watermark.offset - 1)
+            if stream.read(1) == b"\n":
+                return
+        stream.seek(0)
+
+    def iter_changes(self, watermark):
+        """Yield each `Change` after `watermark`.
+
+        A last line without a newline is still being written so it's left
+        for the next run.
+        """
+        try:
+            stream = open(self.path, "rb")
+        except OSError as exc:
+            raise ChangelogError(
+                "Unable to read changelog %s: %s" % (self.path, exc)) from exc
+        with stream:
+            self._seek(stream, watermark)
+            seq = watermark.seq
+            while True:
+                line = stream.readline()
+                if not line.endswith(b"\n"):
+                    return
+                if not line.strip():
+                    continue
+                try:
+                    record = self.validate(json.loads(line.decode("utf-8")))
+                except (ValueError, ValidationError) as exc:
+                    raise ChangelogError(
+                        "Invalid change in %s at byte %d: %s" % (
+                            self.path, stream.tell() - len(line),
+                            exc)) from exc
+                if record["seq"] <= seq:
+                    # Already applied before the changelog was rewritten.
+                    continue
+                seq = record["seq"]
+                data = dict(record)
+                del data["seq"]
+                yield Change(
+                    Watermark(seq, stream.tell()), data.pop("username"),
+                    data)
@@ -0,0 +1,200 @@
+# Copyright 2016 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Check the regions for drift from the configuration without changing them."""
+
+from collections import namedtuple
+
+from .parallel import run_parallel
+from .users import iter_users
+
+
+# Nagios plugin exit codes.
+OK = 0
+WARNING = 1
+CRITICAL = 2
+UNKNOWN = 3
+
+# Number of the missing users named in the drift of a region.
+MISSING_USERS_SHOWN = 5
+
+STATUS_NAMES = {
+    OK: "OK",
+    WARNING: "WARNING",
+    CRITICAL: "CRITICAL",
+    UNKNOWN: "UNKNOWN",
+}
+
+# Result of checking a region. `error` is set when the region could not be
+# checked.
+RegionCheck = namedtuple("RegionCheck", ["region", "drift", "error"])
+
+
+def diff_users(users, region_users):
+    """Return the drift between the configured `users` and the region's.
+
+    Only the first `MISSING_USERS_SHOWN` missing users are named, followed
+    by the count of the others.
+    """
+    usernames = {user.username for user in region_users}
+    missing = sorted(
+        username for username, _ in iter_users(users)
+        if username not in usernames)
+    if not missing:
+        return []
+    shown = ", ".join(missing[:MISSING_USERS_SHOWN])
+    if len(missing) > MISSING_USERS_SHOWN:
+        shown += " and %d more" % (len(missing) - MISSING_USERS_SHOWN)
+    return ["missing users: %s" % shown]
+
+
+def find_source(source, region_sources):
+    """Return the tuple `(matching_source, drift)` for the `source`."""
+    drift = []
+    matching_source = None
+    for remote_source in region_sources:
+        if remote_source.url != source['url']:
+            drift.append("unexpected source '%s'" % remote_source.url)
+        else:
+            matching_source = remote_source
+    if matching_source is None:
+        drift.append("missing source '%s'" % source['url'])
+    elif matching_source.keyring_filename != source['keyring_filename']:
+        drift.append(
+            "source keyring differs: '%s'" % (
+                matching_source.keyring_filename))
+    return matching_source, drift
+
+
+def diff_selections(selections, region_selections):
+    """Return the drift between the `selections` and the region's."""
+    expected = {
+        (os_name, release): set(info['arches'])
+        for os_name, info in selections.items()
+        for release in info['releases']
+    }
+    drift = []
+    found = set()
+    for remote_selection in region_selections:
+        key = (remote_selection.os, remote_selection.release)
+        arches = expected.get(key)
+        if arches is None:
+            drift.append("unexpected selection %s/%s" % key)
+            continue
+        found.add(key)
+        if set(remote_selection.arches) != arches:
+            drift.append("selection %s/%s arches differ: %s" % (
+                key + (", ".join(sorted(remote_selection.arches)),)))
+    for key in sorted(set(expected) - found):
+        drift.append("missing selection %s/%s" % key)
+    return drift
+
+
+def diff_custom(custom_images, region_resources):
+    """Return the drift between the `custom_images` and the region's.
+
+    Only the name and architecture are compared; the content of an image is
+    only compared when it's synced.
+    """
+    resources = {resource.name: resource for resource in region_resources}
+    drift = []
+    for name, info in sorted(custom_images.items()):
+        resource = resources.get("custom/%s" % name)
+        if resource is None:
+            drift.append("missing custom/%s" % name)
+        elif resource.architecture != info['architecture']:
+            drift.append("custom/%s architecture differs: %s" % (
+                name, resource.architecture))
+    return drift
+
+
+def check_source(region, source):
+    """Return the drift of the boot `source` and its selections on `region`."""
+    matching_source, drift = find_source(source, region.read_boot_sources())
+    if matching_source is not None:
+        drift.extend(diff_selections(
+            source['selections'], region.read_selections(matching_source)))
+    return drift
+
+
+def check_region(region, users, images):
+    """Return the `RegionCheck` of `region`.
+
+    The users, the boot source and the custom images are read at the same
+    time. The region's users are only read when there are `users` to
+    compare. Nothing is written to the region.
+    """
+    images = images or {}
+    checks = []
+    if users:
+        checks.append(lambda: diff_users(users, region.read_users()))
+    if images.get('source') is not None:
+        checks.append(lambda: check_source(region, images['source']))
+    if images.get('custom'):
+        checks.append(lambda: diff_custom(
+            images['custom'], region.read_boot_resources()))
+    try:
+        region.connect()
+        results = run_parallel(
+            lambda check: check(), checks, jobs=len(checks))
+    except Exception as exc:  # pylint: disable=broad-except
+        return RegionCheck(region.name, [], str(exc) or repr(exc))
+    return RegionCheck(
+        region.name, [drift for result in results for drift in result], None)
+
+
+def check_regions(regions, users, images, *, jobs=16):
+    """Check every region, `jobs` at the same time.
+
+    Returns the `RegionCheck` of each region.
+    """
+    return run_parallel(
+        lambda region: check_region(region, users, images), regions,
+        jobs=jobs)
+
+
+def get_status(checks):
+    """Return the Nagios exit code for `checks`.
+
+    Drift is critical. A region that could not be checked is unknown unless
+    another region has drifted.
+    """
+    if any(check.drift for check in checks):
+        return CRITICAL
+    if any(check.error is not None for check in checks):
+        return UNKNOWN
+    return OK
+
+
+def format_error(exc):
+    """Return the Nagios output when the regions could not be checked.
+
+    The output is a single line with the error and what caused it.
+    """
+    message = str(exc)
+    if exc.__cause__ is not None:
+        message = "%s: %s" % (message, exc.__cause__)
+    return "META-MAAS %s - %s" % (
+        STATUS_NAMES[UNKNOWN], " ".join(message.split()))
+
+
+def format_summary(checks):
+    """Return the Nagios output for `checks`.
+
+    The first line is the status and performance data, followed by a line
+    for each region that drifted or could not be checked.
+    """
+    drifted = sum(1 for check in checks if check.drift)
+    unknown = sum(1 for check in checks if check.error is not None)
+    lines = [
+        "META-MAAS %s - %d of %d regions drifted, %d unknown | "
+        "regions=%d drifted=%d unknown=%d" % (
+            STATUS_NAMES[get_status(checks)], drifted, len(checks), unknown,
+            len(checks), drifted, unknown),
+    ]
+    for check in sorted(checks, key=lambda check: check.region):
+        if check.error is not None:
+            lines.append("%s: UNKNOWN %s" % (check.region, check.error))
+        elif check.drift:
+            lines.append("%s: %s" % (check.region, "; ".join(check.drift)))
+    return "\n".join(lines)
@@ -4,20 +4,51 @@
 """Main entry point for meta-MAAS."""
 
 import argparse
+import os
 import sys
 from textwrap import dedent
 
 import colorclass
 
+from .changelog import Changelog
+from .check import (
+    UNKNOWN,
+    check_regions,
+    format_error,
+    format_summary,
+    get_status
+)
+from .compress import prepare_images
 from .config import SAMPLE_CONFIG, load_config
+from .events import EventBus, Renderer
+from .export import DEFAULT_FIELDS, export_machines
+from .fingerprint import DEFAULT_TTL, Fingerprints, get_desired_fingerprint
+from .history import History
+from .imports import ImportPoller, ImportScheduler
+from .journal import Journal, get_journal_name
+from .metrics import write_metrics
+from .mirror import Mirror, MirrorError, apply_mirror, make_server
+from .parallel import run_parallel
+from .profiling import Profiler
 from .region import Region
-from .report import write_html
+from .report import collect_data, merge_data, write_data, write_html
+from .resilience import AdaptiveLimiter, CircuitBreaker, RegionCalls
+from .shard import ShardError, parse_shard, select_shard
+from .state import get_cache_dir
 
 
 # Used for mocking out in tests.
 print = print  # pylint: disable=invalid-name,redefined-builtin
 
 
+def shard_type(value):
+    """Argument type for --shard."""
+    try:
+        return parse_shard(value)
+    except ShardError as exc:
+        raise argparse.ArgumentTypeError(str(exc))
+
+
 def parse_args(args):
     """Parse the command line arguments."""
     parser = argparse.ArgumentParser(
@@ -26,6 +57,10 @@ def parse_args(args):
             If --config is not passed the tool will first search the current
             directory for a meta-maas.yaml. If not found it will search the
             executing users home directory for meta-maas.yaml.
+
+            Run 'meta-maas mirror --help' to manage the local image mirror,
+            'meta-maas export --help' to export the inventory and
+            'meta-maas check --help' to check the regions for drift.
             """))
     parser.add_argument(
         '-c', '--config', metavar='PATH',
@@ -33,6 +68,96 @@ def parse_args(args):
     parser.add_argument(
         '-r', '--report', metavar='DIR',
         help='output HTML report')
+    parser.add_argument(
+        '--report-data', metavar='FILE',
+        help='output report data as JSON; used to merge shard reports')
+    parser.add_argument(
+        '--merge-report', metavar='FILE', nargs='+',
+        help=(
+            'merge report data from shards into the HTML report given by '
+            '--report; no regions are synced'))
+    parser.add_argument(
+        '--report-timeout', metavar='SECONDS', type=float, default=60,
+        help=(
+            'seconds to wait for each region when collecting the report; '
+            'regions that take longer are reported from their last cached '
+            'data (default: 60)'))
+    parser.add_argument(
+        '--shard', metavar='i/N', type=shard_type,
+        help=(
+            'only manage the regions that belong to shard i of N; regions '
+            'are partitioned with consistent hashing on their names'))
+    parser.add_argument(
+        '-j', '--jobs', metavar='N', type=int, default=1,
+        help='number of regions to sync at the same time (default: 1)')
+    parser.add_argument(
+        '--import-concurrency', metavar='N', type=int,
+        help=(
+            'number of regions that import boot resources at the same time; '
+            'by default every region starts importing once synced'))
+    parser.add_argument(
+        '--import-window', metavar='SECONDS', type=int,
+        help=(
+            'seconds a region can import before the next region is started; '
+            'requires --import-concurrency'))
+    parser.add_argument(
+        '--import-poll', metavar='SECONDS', type=int, default=10,
+        help='seconds between checking import progress (default: 10)')
+    parser.add_argument(
+        '--wait-for-import', action="store_true",
+        help=(
+            'wait for every region to finish importing boot resources and '
+            'syncing them to the rack controllers'))
+    parser.add_argument(
+        '--import-timeout', metavar='SECONDS', type=int,
+        help='fail when waiting for the import takes longer than SECONDS')
+    parser.add_argument(
+        '--resume', action="store_true",
+        help=(
+            'resume an interrupted run, skipping the work it completed on '
+            'each region'))
+    parser.add_argument(
+        '--converged-ttl', metavar='SECONDS', type=float,
+        default=DEFAULT_TTL,
+        help=(
+            'skip a region whose configuration is unchanged and whose image '
+            'source and selections are as the last sync left them, for up '
+            'to SECONDS after that sync (default: %d)' % DEFAULT_TTL))
+    parser.add_argument(
+        '--force', action="store_true",
+        help='sync every region, even those that have converged')
+    parser.add_argument(
+        '--breaker-failures', metavar='N', type=int, default=5,
+        help=(
+            'stop calling a region after N failed or slow calls within '
+            '--breaker-window (default: 5)'))
+    parser.add_argument(
+        '--breaker-window', metavar='SECONDS', type=float, default=60,
+        help='seconds a failed or slow call is counted for (default: 60)')
+    parser.add_argument(
+        '--slow-call', metavar='SECONDS', type=float,
+        help='count calls slower than SECONDS as failures')
+    parser.add_argument(
+        '--region-calls', metavar='N', type=int, default=8,
+        help=(
+            'most API calls in flight to a region at the same time; the '
+            'limit adapts to how fast the region answers (default: 8)'))
+    parser.add_argument(
+        '--metrics', metavar='FILE',
+        help=(
+            'output the metrics of the calls to each region as JSON, '
+            'including the current concurrency limit'))
+    parser.add_argument(
+        '--hedge-after', metavar='SECONDS', type=float,
+        help=(
+            'send reads again when they take longer than SECONDS; '
+            'the first response is used'))
+    parser.add_argument(
+        '--profile', metavar='DIR',
+        help=(
+            'write cProfile data for each phase and region, sampled stacks '
+            'for flamegraph tools and the top memory allocations of the '
+            'report to DIR'))
     parser.add_argument(
         '-q', '--quiet', action="store_true",
         help='run in quiet mode; produce no output')
@@ -42,13 +167,20 @@ def parse_args(args):
     parser.add_argument(
         '--no-color', action="store_true",
         help='disable colored output')
-    return parser.parse_args(args)
+    args = parser.parse_args(args)
+    if args.merge_report is not None and args.report is None:
+        parser.error("--merge-report requires --report")
+    if args.import_window is not None and args.import_concurrency is None:
+        parser.error("--import-window requires --import-concurrency")
+    return args
 
 
 def main(args=None):
     """Main entry point."""
     if args is None:
         args = sys.argv[1:]
+    if args and args[0] in COMMANDS:
+        return COMMANDS[args[0]](args[1:])
     args = parse_args(args)
 
     # Disable color by argument or when not in a terminal.
@@ -58,25 +190,322 @@ def main(args=None):
     # Output sample config.
     if args.sample:
         print(SAMPLE_CONFIG, end="")
-        return
+        return None
 
-    # Load regions from config.
-    config_data = load_config(args.config)
+    # Merge the report data from the shards; nothing else to do.
+    if args.merge_report is not None:
+        write_html(args.report, [], data=merge_data(args.merge_report))
+        return None
+
+    # Render the events from the regions unless running quietly. Nothing
+    # would read the events of a quiet run, so they aren't published.
+    events, renderer = None, None
+    if not args.quiet:
+        events = EventBus()
+        renderer = Renderer(events, sys.stdout)
+        renderer.start()
+    profiler = Profiler(args.profile)
+    try:
+        with profiler.sampling():
+            sync(args, events, profiler)
+    finally:
+        if renderer is not None:
+            renderer.stop()
+    return None
+
+
+def make_regions(config_data, shard, *, events=None, make_calls=RegionCalls):
+    """Return the regions from the config in `shard`.
+
+    :param make_calls: Returns the `RegionCalls` of each region.
+    """
+    # Load regions from config, keeping only those in this shard.
     regions = []
-    for name in sorted(config_data['regions'].keys()):
+    names = select_shard(config_data['regions'].keys(), shard)
+    for name in sorted(names):
         info = config_data['regions'][name]
-        regions.append(
-            Region(name, info['url'], info['apikey'], quiet=args.quiet))
+        regions.append(Region(
+            name, info['url'], info['apikey'], events=events,
+            calls=make_calls()))
+    return regions
+
+
+def connect_regions(config_data, shard, **options):
+    """Return the connected regions from the config in `shard`.
+
+    :param options: Passed to `make_regions`.
+    """
+    regions = make_regions(config_data, shard, **options)
     # Test that connecting to all the regions is working correctly before
-    # actually performing the sync. This will raise an exception if there
+    # actually performing any work. This will raise an exception if there
     # is an issue connecting to the region.
     for region in regions:
         region.connect()
+    return regions
+
+
+def open_journal(config_data, shard, *, resume=False):
+    """Return the journal of the run on the regions in `shard`.
+
+    :param resume: Load the work completed by the interrupted run.
+    """
+    return Journal(
+        os.path.join(get_cache_dir("journal"), get_journal_name(
+            select_shard(config_data['regions'].keys(), shard))),
+        resume=resume)
+
+
+def sync(args, events, profiler):
+    """Sync the regions from the configuration and write the report.
+
+    :param profiler: `Profiler` each phase of the run is profiled with.
+    """
+    with profiler.phase("load_config"):
+        config_data = load_config(args.config)
+    # The journal records the work completed on each region so an
+    # interrupted run can be resumed. It's removed once the run completes.
+    journal = open_journal(config_data, args.shard, resume=args.resume)
+    regions = []
+    try:
+        with profiler.phase("connect"):
+            regions = connect_regions(
+                config_data, args.shard, events=events,
+                make_calls=lambda: RegionCalls(
+                    breaker=CircuitBreaker(
+                        failure_threshold=args.breaker_failures,
+                        window=args.breaker_window,
+                        slow_call=args.slow_call),
+                    limiter=AdaptiveLimiter(max_limit=args.region_calls),
+                    hedge_after=args.hedge_after))
+
+        # Now perform the actual syncing. With a limited import concurrency
+        # the imports are started by the scheduler once every region is
+        # synced.
+        scheduler = None
+        if args.import_concurrency is not None:
+            scheduler = ImportScheduler(
+                concurrency=args.import_concurrency,
+                window=args.import_window, poll_interval=args.import_poll)
+        # Raw custom images are compressed once before syncing any region.
+        with profiler.phase("prepare_images"):
+            images = prepare_images(apply_mirror(
+                config_data.get('images'), config_data.get('mirror')))
+        # Only the users added to the changelog since each region's
+        # watermark are created.
+        changelog = None
+        if config_data.get('users_changelog') is not None:
+            changelog = Changelog(
+                config_data['users_changelog'], get_cache_dir("watermarks"))
+        history = History(get_cache_dir("history"))
+        fingerprints = Fingerprints(
+            get_cache_dir("fingerprints"), ttl=args.converged_ttl)
+
+        def sync_region(region):
+            """Sync `region` unless converged and record how long it took."""
+            desired = get_desired_fingerprint(
+                region, config_data.get('users'), images, changelog)
+            if not args.force and fingerprints.is_converged(region, desired):
+                region.skip("converged since last sync")
+                return
+            # Until the sync completes the region isn't known to converge.
+            fingerprints.forget(region)
+            with profiler.phase("sync-%s" % region.name):
+                region.sync(
+                    config_data.get('users'), images,
+                    start_import=scheduler is None, changelog=changelog,
+                    journal=journal)
+            history.record(region)
+            fingerprints.record(region, desired)
+
+        # The most expensive regions are started first so the run takes
+        # about as long as the slowest region.
+        run_parallel(
+            sync_region, history.order_regions(regions, images),
+            jobs=args.jobs)
+        if scheduler is not None:
+            scheduler.run(regions)
+        if args.wait_for_import:
+            ImportPoller(regions, deadline=args.import_timeout).wait()
+    except BaseException:
+        journal.close()
+        raise
+    finally:
+        # The metrics are most useful when a region failed the run.
+        if args.metrics is not None:
+            write_metrics(args.metrics, regions)
+    journal.remove()
+
+    # Check if HTML or report data should be written. The data is only
+    # collected once when both are requested.
+    if args.report is not None or args.report_data is not None:
+        with profiler.phase("collect_report", memory=True):
+            data = collect_data(
+                regions, timeout=args.report_timeout,
+                cache_dir=get_cache_dir("report"))
+        with profiler.phase("write_report", memory=True):
+            if args.report_data is not None:
+                write_data(args.report_data, data)
+            if args.report is not None:
+                write_html(args.report, regions, data=data)
+
+
+def parse_mirror_args(args):
+    """Parse the command line arguments for the mirror command."""
+    parser = argparse.ArgumentParser(
+        prog="meta-maas mirror",
+        description=(
+            "Mirror the selected boot images into a local simplestreams "
+            "tree and serve it to the regions."),
+        epilog=dedent("""\
+            The mirror section of the configuration sets the local path of
+            the tree and the URL the regions use to reach it. When it is
+            configured, the regions' image source points at the mirror.
+            """))
+    parser.add_argument(
+        'action', choices=['sync', 'serve'],
+        help='sync the images from upstream or serve the local tree')
+    parser.add_argument(
+        '-c', '--config', metavar='PATH',
+        help='configuration to load')
+    parser.add_argument(
+        '--listen', metavar='HOST:PORT',
+        help='address to serve on (default: listen from config or :8000)')
+    parser.add_argument(
+        '-q', '--quiet', action="store_true",
+        help='run in quiet mode; produce no output')
+    return parser.parse_args(args)
+
+
+def mirror(args):
+    """Entry point for the mirror command."""
+    args = parse_mirror_args(args)
+    config_data = load_config(args.config)
+    mirror_info = config_data.get('mirror')
+    source = config_data.get('images', {}).get('source')
+    if mirror_info is None or source is None:
+        raise MirrorError(
+            "Configuration requires mirror and images.source sections.")
+    if args.action == 'sync':
+        local = Mirror(
+            mirror_info['path'], source['url'], source['selections'])
+        downloaded, skipped = local.sync(
+            progress_callback=None if args.quiet else (
+                lambda path: print("Mirror: downloading %s" % path)))
+        if not args.quiet:
+            print("Mirror: %d downloaded, %d already in sync" % (
+                downloaded, skipped))
+    else:
+        listen = args.listen or mirror_info.get('listen', ':8000')
+        server = make_server(mirror_info['path'], listen)
+        if not args.quiet:
+            print("Mirror: serving %s on %s" % (mirror_info['path'], listen))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+
+def parse_export_args(args):
+    """Parse the command line arguments for the export command."""
+    parser = argparse.ArgumentParser(
+        prog="meta-maas export",
+        description="Export the inventory of every region.")
+    parser.add_argument(
+        'collection', choices=['machines'],
+        help='collection to export')
+    parser.add_argument(
+        '-c', '--config', metavar='PATH',
+        help='configuration to load')
+    parser.add_argument(
+        '-o', '--output', metavar='FILE',
+        help='file to write to (default: stdout)')
+    parser.add_argument(
+        '-f', '--format', choices=['ndjson', 'csv'], default='ndjson',
+        help='output format (default: ndjson)')
+    parser.add_argument(
+        '--fields', metavar='FIELD,...',
+        type=lambda value: [
+            field.strip() for field in value.split(',') if field.strip()],
+        default=DEFAULT_FIELDS,
+        help='comma separated fields to export (default: %s)' % (
+            ','.join(DEFAULT_FIELDS)))
+    parser.add_argument(
+        '-j', '--jobs', metavar='N', type=int, default=4,
+        help='number of regions to read at the same time (default: 4)')
+    parser.add_argument(
+        '--shard', metavar='i/N', type=shard_type,
+        help='only export the regions that belong to shard i of N')
+    return parser.parse_args(args)
+
+
+def export(args):
+    """Entry point for the export command."""
+    args = parse_export_args(args)
+    config_data = load_config(args.config)
+    regions = connect_regions(config_data, args.shard)
+    if args.output is None:
+        export_machines(
+            regions, sys.stdout, fields=args.fields, fmt=args.format,
+            jobs=args.jobs)
+    else:
+        with open(args.output, "w", newline="") as stream:
+            export_machines(
+                regions, stream, fields=args.fields, fmt=args.format,
+                jobs=args.jobs)
+
+
+def parse_check_args(args):
+    """Parse the command line arguments for the check command."""
+    parser = argparse.ArgumentParser(
+        prog="meta-maas check",
+        description=(
+            "Check the regions for drift from the configuration without "
+            "changing them. Exits with a Nagios plugin status: 0 when in "
+            "sync, 2 when a region drifted and 3 when a region could not be "
+            "checked."))
+    parser.add_argument(
+        '-c', '--config', metavar='PATH',
+        help='configuration to load')
+    parser.add_argument(
+        '-j', '--jobs', metavar='N', type=int, default=16,
+        help='number of regions to check at the same time (default: 16)')
+    parser.add_argument(
+        '--shard', metavar='i/N', type=shard_type,
+        help='only check the regions that belong to shard i of N')
+    return parser.parse_args(args)
+
+
+def check(args):
+    """Entry point for the check command.
+
+    Returns the Nagios plugin status.
+    """
+    args = parse_check_args(args)
+    try:
+        config_data = load_config(args.config)
+        regions = make_regions(config_data, args.shard)
+        images = apply_mirror(
+            config_data.get('images'), config_data.get('mirror'))
+    except Exception as exc:  # pylint: disable=broad-except
+        # Any failure before the regions are checked is unknown to Nagios,
+        # not a warning.
+        print(format_error(exc))
+        return UNKNOWN
+    # The users of a changelog are applied as changes, there are no users
+    # to compare with the regions.
+    users = None
+    if config_data.get('users_changelog') is None:
+        users = config_data.get('users')
+    checks = check_regions(regions, users, images, jobs=args.jobs)
+    print(format_summary(checks))
+    return get_status(checks)
 
-    # Now perform the actual syncing.
-    for region in regions:
-        region.sync(config_data.get('users'), config_data.get('images'))
 
-    # Check if HTML should be written and path is correct.
-    if args.report is not None:
-        write_html(args.report, regions)
+# Commands that are selected by the first argument.
+COMMANDS = {
+    'check': check,
+    'export': export,
+    'mirror': mirror,
+}
@@ -0,0 +1,117 @@
+# Copyright 2016 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Compress raw disk images into cached ddtgz artifacts."""
+
+import collections
+import hashlib
+import os
+import tarfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from .state import get_cache_dir
+
+
+# Size of the blocks that are compressed independently.
+BLOCK_SIZE = 1 << 22
+
+# Size of the chunks read when calculating the checksum of the source.
+CHUNK_SIZE = 1 << 20
+
+
+def gzip_member(data, level=6):
+    """Return `data` compressed as a single gzip member."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def sha256_file(path):
+    """Return the sha256 of the file at `path`."""
+    checksum = hashlib.sha256()
+    with open(path, "rb") as stream:
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+def iter_tar_blocks(path, block_size):
+    """Yield the blocks of a tar archive holding only the file at `path`.
+
+    The archive is generated as it's read so the raw image is never loaded
+    in full.
+    """
+    info = tarfile.TarInfo(os.path.basename(path))
+    info.size = os.path.getsize(path)
+    info.mode = 0o644
+    header = info.tobuf(format=tarfile.GNU_FORMAT)
+    yield header
+    with open(path, "rb") as stream:
+        yield from iter(lambda: stream.read(block_size), b"")
+    # Pad the file to a whole block, add the two end of archive blocks and
+    # pad the archive to a whole record like tarfile does.
+    end = -info.size % tarfile.BLOCKSIZE + 2 * tarfile.BLOCKSIZE
+    end += -(len(header) + info.size + end) % tarfile.RECORDSIZE
+    yield bytes(end)
+
+
+def compress_raw_image(
+        src_path, dst_path, *, jobs=None, block_size=BLOCK_SIZE, level=6):
+    """Compress the raw disk image at `src_path` into a ddtgz at `dst_path`.
+
+    Each block of the tar stream is compressed in parallel into its own gzip
+    member; concatenated members are a valid gzip file. Blocks that are all
+    zeros are not compressed again, the member for a zero block is reused.
+    """
+    zero_block = bytes(block_size)
+    zero_member = gzip_member(zero_block, level)
+
+    def compress(block):
+        """Compress `block`, skipping the work for zero blocks."""
+        if len(block) == block_size and block == zero_block:
+            return zero_member
+        return gzip_member(block, level)
+
+    jobs = jobs or os.cpu_count() or 1
+    pending = collections.deque()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        with open(dst_path, "wb") as stream:
+            for block in iter_tar_blocks(src_path, block_size):
+                pending.append(executor.submit(compress, block))
+                # Bound the number of blocks held in memory.
+                while len(pending) > jobs * 2:
+                    stream.write(pending.popleft().result())
+            while pending:
+                stream.write(pending.popleft().result())
+
+
+def prepare_custom_image(image_info, *, cache_dir=None, jobs=None):
+    """Return `image_info` ready to be uploaded to the regions.
+
+    Raw disk images are compressed into a ddtgz that is cached by the
+    checksum of the raw image, so it's only compressed once and every region
+    uploads the compressed artifact.
+    """
+    if image_info.get('filetype') != 'raw':
+        return image_info
+    if cache_dir is None:
+        cache_dir = get_cache_dir("images")
+    artifact_path = os.path.join(
+        cache_dir, "%s.ddtgz" % sha256_file(image_info['path']))
+    if not os.path.exists(artifact_path):
+        partial_path = artifact_path + ".part"
+        compress_raw_image(image_info['path'], partial_path, jobs=jobs)
+        os.rename(partial_path, artifact_path)
+    return dict(image_info, path=artifact_path, filetype='ddtgz')
+
+
+def prepare_images(images, *, cache_dir=None, jobs=None):
+    """Return `images` with every custom image prepared for upload."""
+    if not images or not images.get('custom'):
+        return images
+    images = dict(images)
+    images['custom'] = {
+        name: prepare_custom_image(info, cache_dir=cache_dir, jobs=jobs)
+        for name, info in images['custom'].items()
+    }
+    return images
@@ -3,10 +3,13 @@
 
 """Utilities to load and validate the YAML configuration."""
 
+import functools
 import os
 
 import yaml
-from jsonschema import validate
+
+from .schema import compile_schema
+from .users import USER_SCHEMA, USERNAME_PATTERN, iter_users
 
 
 SCHEMA = {
@@ -32,24 +35,10 @@ SCHEMA = {
             "additionalProperties": False,
         },
         "users": {
-            "type": "object",
+            # The users, or the path of a CSV or NDJSON file of users.
+            "type": ["object", "string"],
             "patternProperties": {
-                r"^\w+$": {
-                    "type": "object",
-                    "properties": {
-                        "email": {
-                            "type": "string",
-                        },
-                        "password": {
-                            "type": "string",
-                        },
-                        "is_admin": {
-                            "type": "boolean",
-                        },
-                    },
-                    "additionalProperties": False,
-                    "required": ["email", "password"],
-                },
+                USERNAME_PATTERN: USER_SCHEMA,
             },
             "additionalProperties": False,
         },
@@ -111,7 +100,7 @@ SCHEMA = {
                                     "type": "string",
                                 },
                                 "filetype": {
-                                    "enum": ["tgz", "ddtgz"],
+                                    "enum": ["tgz", "ddtgz", "raw"],
                                 },
                             },
                             "additionalProperties": False,
@@ -123,6 +112,26 @@ SCHEMA = {
             },
             "additionalProperties": False,
         },
+        "users_changelog": {
+            # NDJSON file a directory export appends the users it adds to.
+            "type": "string",
+        },
+        "mirror": {
+            "type": "object",
+            "properties": {
+                "path": {
+                    "type": "string",
+                },
+                "url": {
+                    "type": "string",
+                },
+                "listen": {
+                    "type": "string",
+                },
+            },
+            "additionalProperties": False,
+            "required": ["path", "url"],
+        },
     },
     "additionalProperties": False,
     "required": ["regions"],
@@ -167,6 +176,10 @@ images:
       architecture: amd64/generic
       path: /path/to/image/file.dd.tgz
       filetype: ddtgz
+    custom-raw:
+      architecture: amd64/generic
+      path: /path/to/image/file.img
+      filetype: raw
 """
 
 
@@ -174,6 +187,15 @@ class ConfigError(Exception):
     """Raised when finding, loading, or validating configuration fails."""
 
 
+@functools.lru_cache()
+def get_validator():
+    """Return the function that validates the configuration with `SCHEMA`.
+
+    The schema is only compiled the first time.
+    """
+    return compile_schema(SCHEMA)
+
+
 def find_config(config_path=None):
     """Find the location of the configuration file.
 
@@ -213,8 +235,13 @@ def load_config(config_path=None):
     else:
         try:
             with open(found_path, "r") as stream:
-                config_data = yaml.load(stream)
-            validate(config_data, SCHEMA)
+                config_data = yaml.safe_load(stream)
+            get_validator()(config_data)
+            if isinstance(config_data.get('users'), str):
+                # Read the users file once so an invalid user is found
+                # before any region is synced.
+                for _ in iter_users(config_data['users']):
+                    pass
         except Exception as exc:
             raise ConfigError("Unable to load config: %s" % found_path) from exc
         return config_data
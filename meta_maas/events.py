@@ -0,0 +1,245 @@
+# Copyright 2016 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Structured events published by regions and rendered to the terminal."""
+
+import enum
+import json
+import queue
+import shutil
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from colorclass import Color
+
+
+class MessageLevel(enum.Enum):
+    """Level of message to print."""
+
+    PROGRESS = 0
+    SUCCESS = 1
+    WARN = 2
+
+
+# A message about something that happened on a region.
+Message = namedtuple("Message", ["region", "level", "text"])
+
+# Progress of a long running task on a region, `progress` is from 0 to 1.
+Progress = namedtuple("Progress", ["region", "task", "progress"])
+
+# Progress of importing boot resources on a region and syncing them to its
+# rack controllers.
+ImportProgress = namedtuple("ImportProgress", [
+    "region", "bytes_done", "bytes_total", "racks_synced", "racks_total"])
+
+# The region has finished all of its work.
+Finished = namedtuple("Finished", ["region"])
+
+# Events where only the latest event of each region and task is kept.
+COALESCED_EVENTS = (Progress, ImportProgress)
+
+# Published by `Renderer.stop` so the renderer stops once it has rendered
+# every event published before it.
+_STOP = object()
+
+
+def event_to_dict(event):
+    """Return `event` as a dictionary that can be dumped to JSON."""
+    data = OrderedDict(event=type(event).__name__.lower())
+    for key, value in event._asdict().items():
+        if isinstance(value, enum.Enum):
+            value = value.name.lower()
+        data[key] = value
+    return data
+
+
+class EventBus:
+    """Passes events from the regions to the renderer.
+
+    Publishing never blocks the caller. `Progress` and `ImportProgress`
+    events are coalesced so only the latest progress of each task is kept
+    until it is consumed, no matter how often it is reported.
+    """
+
+    def __init__(self):
+        """Initialize the bus."""
+        self._queue = queue.Queue()
+        self._progress = OrderedDict()
+        self._lock = threading.Lock()
+
+    def publish(self, event):
+        """Publish `event`."""
+        if isinstance(event, COALESCED_EVENTS):
+            key = type(event), event.region, getattr(event, "task", None)
+            with self._lock:
+                self._progress[key] = event
+        else:
+            self._queue.put_nowait(event)
+
+    def consume(self, timeout=0):
+        """Return all pending events, waiting up to `timeout` for one.
+
+        Coalesced progress events are returned before the other events that
+        are pending.
+        """
+        events = []
+        try:
+            events.append(self._queue.get(timeout=timeout))
+        except queue.Empty:
+            pass
+        while True:
+            try:
+                events.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        with self._lock:
+            progress, self._progress = self._progress, OrderedDict()
+        return list(progress.values()) + events
+
+
+def format_message(region, text, level=None):
+    """Format `text` from `region` with the color for `level`."""
+    if level is None or level == MessageLevel.PROGRESS:
+        start_color = ""
+        end_color = ""
+    elif level == MessageLevel.SUCCESS:
+        start_color = "{autogreen}"
+        end_color = "{/autogreen}"
+    elif level == MessageLevel.WARN:
+        start_color = "{autoyellow}"
+        end_color = "{/autoyellow}"
+    else:
+        raise ValueError("unknown level: %s" % level)
+    return Color('%sRegion %s: %s%s' % (start_color, region, text, end_color))
+
+
+def format_progress(progress, width=30):
+    """Format `progress` as a bar followed by the percentage."""
+    filled = int(round(progress.progress * width))
+    return "%s [%s%s] %3d%%" % (
+        progress.task, "=" * filled, " " * (width - filled),
+        int(progress.progress * 100))
+
+
+def format_size(size):
+    """Format `size` in bytes for humans."""
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if size < 1024:
+            break
+        size /= 1024
+    else:
+        unit = "TiB"
+    return "%.1f %s" % (size, unit) if unit != "B" else "%d B" % size
+
+
+def format_import_progress(progress):
+    """Format `progress` of an import with the bytes and rack sync."""
+    fraction = (
+        progress.bytes_done / progress.bytes_total
+        if progress.bytes_total else 1)
+    return "%s (%s of %s); %d/%d racks synced" % (
+        format_progress(Progress(progress.region, "importing", fraction)),
+        format_size(progress.bytes_done), format_size(progress.bytes_total),
+        progress.racks_synced, progress.racks_total)
+
+
+class Renderer(threading.Thread):
+    """Renders events from an `EventBus` in a background thread.
+
+    On a TTY one line is kept for every region that is still working and the
+    lines are redrawn at most `rate` times per second; messages scroll above
+    those lines. When not on a TTY every message is written as a JSON line
+    and progress is written at most `rate` times per second.
+    """
+
+    def __init__(self, bus, stream, *, tty=None, rate=10):
+        """Initialize the renderer."""
+        super().__init__(name="meta-maas-renderer", daemon=True)
+        self.bus, self.stream = bus, stream
+        self.tty = stream.isatty() if tty is None else tty
+        self.interval = 1.0 / rate
+        self._lines = OrderedDict()
+        self._log = []
+        self._drawn = 0
+
+    def run(self):
+        """Render events until stopped."""
+        last_draw = 0
+        stopped = False
+        while not stopped:
+            events = self.bus.consume(timeout=self.interval)
+            stopped = _STOP in events
+            self.handle(event for event in events if event is not _STOP)
+            now = time.monotonic()
+            if not stopped and now - last_draw >= self.interval:
+                self.draw()
+                last_draw = now
+        self.draw(final=True)
+
+    def stop(self):
+        """Render the remaining events and stop the renderer."""
+        self.bus.publish(_STOP)
+        self.join()
+
+    def handle(self, events):
+        """Update the rendered state with `events`."""
+        for event in events:
+            if not self.tty:
+                if isinstance(event, COALESCED_EVENTS):
+                    self._lines[
+                        type(event), event.region,
+                        getattr(event, "task", None)] = event
+                else:
+                    self._log.append(json.dumps(event_to_dict(event)))
+            elif isinstance(event, Message):
+                line = format_message(event.region, event.text, event.level)
+                self._lines[event.region] = line
+                if event.level != MessageLevel.PROGRESS:
+                    self._log.append(line)
+            elif isinstance(event, Progress):
+                self._lines[event.region] = format_message(
+                    event.region, format_progress(event))
+            elif isinstance(event, ImportProgress):
+                self._lines[event.region] = format_message(
+                    event.region, format_import_progress(event))
+            elif isinstance(event, Finished):
+                self._lines.pop(event.region, None)
+
+    def draw(self, *, final=False):
+        """Write the rendered state to the stream."""
+        if self.tty:
+            self._draw_tty(final)
+        else:
+            self._draw_json()
+        self.stream.flush()
+
+    def _draw_json(self):
+        """Write the pending JSON lines."""
+        lines = self._log + [
+            json.dumps(event_to_dict(event))
+            for event in self._lines.values()
+        ]
+        self._log, self._lines = [], OrderedDict()
+        for line in lines:
+            self.stream.write(line + "\n")
+
+    def _draw_tty(self, final):
+        """Redraw the scrolled messages and the line for every region."""
+        width = shutil.get_terminal_size().columns
+        lines = [] if final else list(self._lines.values())
+        if not self._log and not lines and not self._drawn:
+            return
+        output = []
+        if self._drawn:
+            output.append("\x1b[%dA" % self._drawn)
+        for line in self._log + lines:
+            # Truncate so a wrapped line doesn't break moving the cursor.
+            if len(line) > width - 1:
+                line = "%s\x1b[0m" % str(line)[:width - 1]
+            output.append("\x1b[2K%s\n" % line)
+        for _ in range(self._drawn - len(self._log) - len(lines)):
+            output.append("\x1b[2K\n")
+        self.stream.write("".join(output))
+        self._drawn = max(len(lines), self._drawn - len(self._log))
+        self._log = []
@@ -0,0 +1,143 @@
+# Copyright 2016 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Stream the machine inventory of every region."""
+
+import csv
+import json
+import queue
+import threading
+
+from .parallel import ensure_event_loop
+
+
+# Fields exported when none are selected.
+DEFAULT_FIELDS = [
+    "hostname",
+    "system_id",
+    "status_name",
+    "zone",
+    "pool",
+    "architecture",
+    "power_state",
+    "cpu_count",
+    "memory",
+]
+
+# Maximum number of rows waiting to be written. Bounds the memory used when
+# the regions are read faster than the rows are written.
+QUEUE_SIZE = 1000
+
+
+class ExportError(Exception):
+    """Raised when exporting from a region fails."""
+
+
+# Marks that a region has no more rows.
+_DONE = object()
+
+
+def get_field(data, field):
+    """Return `field` from the machine's API `data`.
+
+    Fields can be a dotted path into nested objects. Nested objects that
+    have a name, like the zone, are exported as their name.
+    """
+    value = data
+    for part in field.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    if isinstance(value, dict) and "name" in value:
+        value = value["name"]
+    return value
+
+
+def iter_region_rows(region, fields):
+    """Yield a row for each machine in `region`."""
+    # Use the API data so the rows don't depend on viscera's fields.
+    # pylint: disable=protected-access
+    for machine in region.read_machines():
+        row = {"region": region.name}
+        for field in fields:
+            row[field] = get_field(machine._data, field)
+        yield row
+
+
+def iter_machines(regions, fields, *, jobs=4):
+    """Yield a row for every machine, reading the regions concurrently.
+
+    At most `jobs` regions are read at the same time and at most
+    `QUEUE_SIZE` rows are held before they are consumed, so memory stays flat
+    no matter how many machines a region has.
+    """
+    rows = queue.Queue(maxsize=QUEUE_SIZE)
+    pending = list(regions)
+    lock = threading.Lock()
+
+    def produce():
+        """Read the pending regions into the queue."""
+        with ensure_event_loop():
+            while True:
+                with lock:
+                    if not pending:
+                        return
+                    region = pending.pop(0)
+                try:
+                    for row in iter_region_rows(region, fields):
+                        rows.put(row)
+                except Exception as exc:  # pylint: disable=broad-except
+                    rows.put(ExportError(
+                        "Failed to export machines from region: %s" % (
+                            region.name)))
+                    rows.put(exc)
+                rows.put(_DONE)
+
+    workers = [
+        threading.Thread(target=produce, daemon=True)
+        for _ in range(max(1, min(jobs, len(pending))))
+    ]
+    remaining = len(pending)
+    for worker in workers:
+        worker.start()
+    while remaining:
+        row = rows.get()
+        if row is _DONE:
+            remaining -= 1
+        elif isinstance(row, ExportError):
+            raise row from rows.get()
+        else:
+            yield row
+
+
+def write_ndjson(rows, stream):
+    """Write each of `rows` as a JSON line. Returns the number written."""
+    count = 0
+    for row in rows:
+        stream.write(json.dumps(row, sort_keys=True) + "\n")
+        count += 1
+    return count
+
+
+def write_csv(rows, stream, fields):
+    """Write `rows` as CSV with a header. Returns the number written."""
+    writer = csv.DictWriter(stream, ["region"] + list(fields))
+    writer.writeheader()
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+def export_machines(regions, stream, *, fields=None, fmt="ndjson", jobs=4):
+    """Export the machines of `regions` to `stream` in `fmt`.
+
+    Returns the number of machines written.
+    """
+    if fields is None:
+        fields = DEFAULT_FIELDS
+    rows = iter_machines(regions, fields, jobs=jobs)
+    if fmt == "csv":
+        return write_csv(rows, stream, fields)
+    return write_ndjson(rows, stream)
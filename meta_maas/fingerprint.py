@@ -0,0 +1,109 @@
+# Copyright 2016 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Fingerprints of the state of each region, to skip converged regions."""
+
+import json
+import os
+import time
+
+from .history import get_image_identity
+from .journal import get_digest
+from .state import write_atomically
+from .users import describe_users
+
+
+# Seconds a converged region is skipped for before it's synced again.
+DEFAULT_TTL = 3600
+
+
+def get_desired_fingerprint(region, users, images, changelog=None):
+    """Return the fingerprint of the state `region` is synced to.
+
+    A users file is fingerprinted by its checksum, and the custom images
+    and the changelog by their size and modification time so they don't
+    have to be read.
+    """
+    changelog_identity = None
+    if changelog is not None:
+        try:
+            stat = os.stat(changelog.path)
+        except OSError:
+            pass
+        else:
+            changelog_identity = [changelog.path, stat.st_size, stat.st_mtime]
+    custom_identities = {
+        name: get_image_identity(info)
+        for name, info in ((images or {}).get('custom') or {}).items()
+    }
+    return get_digest([
+        region.url, describe_users(users), images, custom_identities,
+        changelog_identity])
+
+
+def get_observed_fingerprint(region):
+    """Return the fingerprint of the image source and selections on `region`.
+
+    Only a few small collections are read. The reads are memoized so a
+    sync that follows doesn't read them again.
+    """
+    observed = []
+    for source in region.read_boot_sources():
+        observed.append([
+            source.url, source.keyring_filename, sorted(
+                [selection.os, selection.release, sorted(selection.arches)]
+                for selection in region.read_selections(source))])
+    return get_digest(sorted(observed))
+
+
+class Fingerprints:
+    """Desired and observed fingerprints of each region's last sync.
+
+    A region is converged when the state it's synced to hasn't changed, it
+    was synced less than `ttl` seconds ago and its observed fingerprint is
+    the same. Every region is synced again once the TTL expires, which
+    catches the changes the observed fingerprint doesn't cover.
+    """
+
+    def __init__(self, directory, *, ttl=DEFAULT_TTL):
+        self.directory = directory
+        self.ttl = ttl
+
+    def get_path(self, region):
+        """Return the path of the fingerprints of `region`."""
+        return os.path.join(
+            self.directory, "%s.json" % get_digest(region.name)[:16])
+
+    def is_converged(self, region, desired):
+        """Return True when `region` doesn't need to be synced."""
+        try:
+            with open(self.get_path(region), "r") as stream:
+                entry = json.load(stream)
+        except (OSError, ValueError):
+            return False
+        if (entry.get("desired") != desired or
+                time.time() - entry.get("synced_at", 0) >= self.ttl):
+            return False
+        try:
+            observed = get_observed_fingerprint(region)
+        except Exception:  # pylint: disable=broad-except
+            # The sync reports why the region cannot be read.
+            return False
+        return observed == entry.get("observed")
+
+    def record(self, region, desired):
+        """Record that `region` has been synced to `desired`."""
+        entry = {
+            "desired": desired,
+            "observed": get_observed_fingerprint(region),
+            "synced_at": time.time(),
+        }
+        with write_atomically(self.get_path(region)) as stream:
+            json.dump(entry, stream, sort_keys=True)
+
+    def forget(self, region):
+        """Forget the fingerprints of `region` so it's synced next run."""
+        try:
+            os.remove(self.get_path(region))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,122 @@
+# Copyright 2016 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""History of past runs, used to sync the most expensive regions first."""
+
+import json
+import os
+
+from .journal import get_digest
+from .state import write_atomically
+
+
+# Weight of the latest run in the averages kept for each region.
+SMOOTHING = 0.5
+
+# Bytes per second assumed for uploads to a region that never uploaded.
+DEFAULT_THROUGHPUT = 10 * 1024 * 1024
+
+
+def get_image_identity(info):
+    """Return what identifies the content of the custom image `info`.
+
+    The size and modification time are used instead of a checksum so the
+    image doesn't have to be read to plan the run.
+    """
+    try:
+        stat = os.stat(info['path'])
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime]
+
+
+def smooth(previous, latest):
+    """Return the average of `previous` weighted with `latest`."""
+    if previous is None:
+        return latest
+    return (1 - SMOOTHING) * previous + SMOOTHING * latest
+
+
+class History:
+    """Phase durations and uploads of each region from past runs.
+
+    Each region is kept in its own file in `directory`, so shards running
+    at the same time don't overwrite each other.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.entries = {}
+
+    def get_path(self, name):
+        """Return the path of the history of region `name`."""
+        return os.path.join(
+            self.directory, "%s.json" % get_digest(name)[:16])
+
+    def get(self, name):
+        """Return the history of region `name`, None when it has none."""
+        if name not in self.entries:
+            try:
+                with open(self.get_path(name), "r") as stream:
+                    self.entries[name] = json.load(stream)
+            except (OSError, ValueError):
+                self.entries[name] = None
+        return self.entries[name]
+
+    def record(self, region):
+        """Record the phases and uploads of the synced `region`."""
+        entry = self.get(region.name) or {
+            "phases": {}, "throughput": None, "images": {}}
+        phases = dict(entry["phases"])
+        for phase, duration in region.timings.items():
+            phases[phase] = smooth(phases.get(phase), duration)
+        throughput = entry["throughput"]
+        upload_time = region.timings.get("custom")
+        if region.bytes_uploaded and upload_time:
+            throughput = smooth(
+                throughput, region.bytes_uploaded / upload_time)
+        entry = {
+            "phases": phases,
+            "throughput": throughput,
+            "images": dict(entry["images"], **region.custom_images),
+        }
+        self.entries[region.name] = entry
+        with write_atomically(self.get_path(region.name)) as stream:
+            json.dump(entry, stream, sort_keys=True)
+
+    def estimate_cost(self, name, images):
+        """Return the seconds syncing region `name` is expected to take.
+
+        The phases of past runs are added to the time to upload the custom
+        `images` that changed since they were last synced to the region, at
+        the region's past throughput. Returns None when the region has no
+        history.
+        """
+        entry = self.get(name)
+        if entry is None:
+            return None
+        cost = sum(
+            duration for phase, duration in entry["phases"].items()
+            if phase != "custom")
+        planned_bytes = 0
+        for image, info in ((images or {}).get('custom') or {}).items():
+            identity = get_image_identity(info)
+            if identity is not None and entry["images"].get(image) != identity:
+                planned_bytes += identity[0]
+        throughput = entry["throughput"] or DEFAULT_THROUGHPUT
+        cost += planned_bytes / throughput
+        return cost
+
+    def order_regions(self, regions, images):
+        """Return `regions` with the most expensive first.
+
+        Regions without history are put first as their cost is unknown.
+        """
+        costs = {
+            region.name: self.estimate_cost(region.name, images)
+            for region in regions
+        }
+        return sorted(
+            regions, key=lambda region: (
+                costs[region.name] is not None,
+                -(costs[region.name] or 0), region.name))
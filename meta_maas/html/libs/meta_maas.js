@@ -6,8 +6,122 @@
 
   var app = angular.module('meta-maas', ['chart.js'])
 
+  // Loads the data file of each region from the index. The data files call
+  // `metaMaasRegion` when loaded, so they work when opened from disk.
+  app.service('regionLoader', function($q, $rootScope) {
+      var pending = {};
+
+      window.metaMaasRegion = function(name, details) {
+          if (pending[name]) {
+              $rootScope.$apply(function() {
+                  pending[name].resolve(details);
+              });
+          }
+      };
+
+      this.load = function(name, file) {
+          if (!pending[name]) {
+              var deferred = $q.defer();
+              var script = document.createElement('script');
+              pending[name] = deferred;
+              script.src = file;
+              script.onerror = function() {
+                  $rootScope.$apply(function() {
+                      delete pending[name];
+                      deferred.reject();
+                  });
+              };
+              document.body.appendChild(script);
+          }
+          return pending[name].promise;
+      };
+  });
+
+  // Loads a region's data once its card is scrolled into view, so only the
+  // visible regions are fetched and drawn.
+  app.directive('lazyRegion', function(regionLoader) {
+      return {
+          link: function(scope, element) {
+              var region = scope.region;
+              var load = function() {
+                  regionLoader.load(region.name, region.info.file).then(
+                      function(details) {
+                          region.details = details;
+                      });
+              };
+              if (region.details) {
+                  return;
+              }
+              if (!('IntersectionObserver' in window)) {
+                  load();
+                  return;
+              }
+              var observer = new IntersectionObserver(function(entries) {
+                  for (var i = 0; i < entries.length; i++) {
+                      if (entries[i].isIntersecting) {
+                          observer.disconnect();
+                          load();
+                          return;
+                      }
+                  }
+              }, { rootMargin: '200px' });
+              observer.observe(element[0]);
+              scope.$on('$destroy', function() {
+                  observer.disconnect();
+              });
+          }
+      };
+  });
+
   app.controller('IndexCtrl', function($scope, metaData) {
-      $scope.regions = metaData.regions;
+      $scope.regions = Object.keys(metaData.regions).sort().map(
+          function(name) {
+              return { name: name, info: metaData.regions[name] };
+          });
+      $scope.fleet = metaData.fleet;
+      $scope.search = { text: '', staleOnly: false };
+
+      // Only the regions matching the search are listed.
+      $scope.matches = function(region) {
+          var text = $scope.search.text.toLowerCase();
+          if ($scope.search.staleOnly && !region.info.stale) {
+              return false;
+          }
+          return (
+              region.name.toLowerCase().indexOf(text) !== -1 ||
+              (region.info.url || '').toLowerCase().indexOf(text) !== -1);
+      };
+      $scope.dimensions = [
+          { key: 'status', label: 'Status' },
+          { key: 'zone', label: 'Zone' },
+          { key: 'pool', label: 'Pool' },
+          { key: 'architecture', label: 'Architecture' },
+          { key: 'power_state', label: 'Power state' }
+      ];
+      $scope.selected = { dimension: 'status' };
+      var empty = { data: [], labels: [] };
+
+      // Chart data of the selected dimension. Report data from older shards
+      // only has the statuses.
+      $scope.chartFor = function(info) {
+          var dimension = $scope.selected.dimension;
+          if (info.aggregates) {
+              return info.aggregates[dimension] || empty;
+          }
+          return dimension === 'status' && info.statuses || empty;
+      };
+
+      // Age of stale region data for display.
+      $scope.formatAge = function(seconds) {
+          if (seconds < 60) {
+              return seconds + ' seconds';
+          } else if (seconds < 3600) {
+              return Math.floor(seconds / 60) + ' minutes';
+          } else if (seconds < 86400) {
+              return Math.floor(seconds / 3600) + ' hours';
+          }
+          return Math.floor(seconds / 86400) + ' days';
+      };
       $scope.options = {
           legend: {
               display: true,
@@ -0,0 +1,309 @@
+# Copyright 2016 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Coordinate importing boot resources on the regions."""
+
+import asyncio
+import inspect
+import time
+
+from maas.client.bones import CallError
+
+from .events import Finished, ImportProgress, MessageLevel, format_size
+
+
+def call_handler(origin, name):
+    """Call the operation `name` on the boot resources handler.
+
+    Returns None when the region's API doesn't provide the operation. Any
+    other error of the call is raised.
+    """
+    # Allow access to the handler for operations viscera doesn't wrap.
+    # pylint: disable=protected-access
+    handler = getattr(origin.BootResources, "_handler", None)
+    operation = getattr(handler, name, None)
+    if operation is None:
+        return None
+    try:
+        result = operation()
+        if inspect.isawaitable(result):
+            result = asyncio.get_event_loop().run_until_complete(result)
+    except CallError as exc:
+        # The region answers 404 Not Found or 405 Method Not Allowed for an
+        # operation its API doesn't have.
+        if exc.status in (404, 405):
+            return None
+        raise
+    return result
+
+
+def call_directly(func, *args, invalidates=(), **kwargs):
+    """Call `func`, the default for the calls of an `ImportCoordinator`."""
+    # `invalidates` is only used by `Region._call`.
+    del invalidates
+    return func(*args, **kwargs)
+
+
+class ImportCoordinator:
+    """Collects every reason a region needs to import boot resources.
+
+    Instead of starting an import as soon as something changes, each change
+    is recorded with `request` and a single import is started by `flush` at
+    the end of the run. An import that's already running on the region
+    covers the changes, as the region doesn't start another one until it
+    has finished, so no import is started then.
+    """
+
+    def __init__(self, origin, *, call=call_directly):
+        """Initialize the coordinator for the region's `origin`.
+
+        :param call: Makes every call to the region, `Region._call` so the
+            calls go through the region's limiter and circuit breaker.
+        """
+        self.origin = origin
+        self.call = call
+        self.reasons = []
+
+    def request(self, reason):
+        """Record that an import is required because of `reason`."""
+        self.reasons.append(reason)
+
+    def is_importing(self):
+        """Return True when the region is importing boot resources.
+
+        Returns None when the region cannot report it.
+        """
+        importing = self.call(call_handler, self.origin, "is_importing")
+        return None if importing is None else bool(importing)
+
+    def refresh_cache(self, wait):
+        """Refresh the boot source cache by starting and stopping an import.
+
+        `wait` is called while the import runs. Nothing is done when an
+        import is already running, as it refreshes the cache, so an import
+        this run didn't start is never stopped. A region that cannot report
+        whether it's importing is taken as not importing.
+
+        Returns True when the cache was refreshed.
+        """
+        if self.is_importing():
+            return False
+        self.call(
+            self.origin.BootResources.start_import,
+            invalidates=["BootResources"])
+        wait()
+        self.call(
+            self.origin.BootResources.stop_import,
+            invalidates=["BootResources"])
+        return True
+
+    def flush(self):
+        """Start a single import for all of the recorded reasons.
+
+        Returns the reasons an import was started for, or an empty list when
+        no import was started.
+        """
+        reasons, self.reasons = self.reasons, []
+        if not reasons or self.is_importing():
+            return []
+        self.call(
+            self.origin.BootResources.start_import,
+            invalidates=["BootResources"])
+        return reasons
+
+
+class ImportScheduler:
+    """Limits how many regions import boot resources at the same time.
+
+    The scheduler holds `concurrency` tokens. A region waiting to import
+    takes a token, starts its import and gives the token back once it reports
+    the import has finished, or once it has held the token for `window`
+    seconds, so the next region can start.
+    """
+
+    def __init__(self, *, concurrency=1, window=None, poll_interval=10):
+        """Initialize the scheduler.
+
+        :param concurrency: Number of regions that import at the same time.
+        :param window: Seconds a region holds its token before the next
+            region is released even if its import is still running. Without
+            a window the token is held until the import finishes.
+        :param poll_interval: Seconds between checking the regions' import
+            progress.
+        """
+        self.concurrency = max(1, concurrency)
+        self.window = window
+        self.poll_interval = poll_interval
+
+    def is_released(self, region, started_at):
+        """Return True when `region` should give back its token."""
+        if (self.window is not None and
+                time.monotonic() - started_at >= self.window):
+            region.message("import window elapsed; releasing next region")
+            return True
+        importing = region.imports.is_importing()
+        if importing is None:
+            # Region cannot report its progress so it can only be released
+            # by the window.
+            return self.window is None
+        if not importing:
+            region.message("import finished", level=MessageLevel.SUCCESS)
+        return not importing
+
+    def run(self, regions):
+        """Start the pending import on each of `regions`, staggered."""
+        pending = [region for region in regions if region.imports.reasons]
+        active = {}
+        while pending or active:
+            while pending and len(active) < self.concurrency:
+                region = pending.pop(0)
+                if region.start_import():
+                    active[region] = time.monotonic()
+            if not active:
+                continue
+            time.sleep(self.poll_interval)
+            for region, started_at in list(active.items()):
+                if self.is_released(region, started_at):
+                    del active[region]
+
+
+class ImportTimeoutError(Exception):
+    """Raised when the regions didn't finish importing before the deadline."""
+
+
+def list_boot_images(rack):
+    """Return the boot images of the `rack` controller.
+
+    Returns None when the region's API doesn't provide the operation.
+    """
+    # Allow access to the handler for operations viscera doesn't wrap.
+    # pylint: disable=protected-access
+    operation = getattr(rack._handler, "list_boot_images", None)
+    if operation is None:
+        return None
+    result = operation(system_id=rack.system_id)
+    if inspect.isawaitable(result):
+        result = asyncio.get_event_loop().run_until_complete(result)
+    return result
+
+
+def read_rack_status(origin, *, call=call_directly):
+    """Return the tuple `(synced, total)` of rack controllers.
+
+    A rack controller is synced when it has every boot image the region has.
+
+    :param call: Makes every call to the region.
+    """
+    synced, total = 0, 0
+    for rack in call(origin.RackControllers.read):
+        total += 1
+        try:
+            result = call(list_boot_images, rack)
+        except CallError:
+            continue
+        if result is not None and result.get("status") == "synced":
+            synced += 1
+    return synced, total
+
+
+def read_import_progress(region):
+    """Return the `ImportProgress` of `region`.
+
+    The progress of each synced boot resource comes from its latest set; the
+    set's `progress` from the API gives the bytes of an incomplete set. The
+    calls go through the region's limiter and circuit breaker, and aren't
+    memoized as the progress changes between polls.
+    """
+    # Allow access to the raw data for fields viscera doesn't wrap, and to
+    # the region's calls.
+    # pylint: disable=protected-access
+    call = region._call
+    done, total = 0, 0
+    for resource in call(region.origin.BootResources.read):
+        resource = call(region.origin.BootResource.read, resource.id)
+        if not resource.sets:
+            continue
+        latest = resource.sets[max(resource.sets)]
+        total += latest.size
+        if latest.complete:
+            done += latest.size
+        else:
+            done += int(
+                latest.size * latest._data.get("progress", 0) / 100)
+    racks_synced, racks_total = read_rack_status(region.origin, call=call)
+    return ImportProgress(
+        region.name, done, total, racks_synced, racks_total)
+
+
+class ImportPoller:
+    """Waits for every region to finish importing boot resources.
+
+    A single loop polls all of the regions. A region that made no progress
+    since the last poll is polled half as often, up to `max_interval`, and
+    once it makes progress it's polled every `min_interval` again.
+    """
+
+    def __init__(
+            self, regions, *, deadline=None, min_interval=5,
+            max_interval=60):
+        """Initialize the poller.
+
+        :param deadline: Seconds to wait for the regions before failing.
+        """
+        self.regions = list(regions)
+        self.deadline = deadline
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+
+    def is_done(self, region, progress):
+        """Return True when `region` has finished importing and syncing."""
+        return (
+            region.imports.is_importing() is not True and
+            progress.bytes_done >= progress.bytes_total and
+            progress.racks_synced >= progress.racks_total)
+
+    def wait(self):
+        """Wait for every region to finish.
+
+        Returns the last `ImportProgress` of each region. Raises
+        `ImportTimeoutError` when the deadline passes first.
+        """
+        started = time.monotonic()
+        now = started
+        due = {region: now for region in self.regions}
+        intervals = {region: self.min_interval for region in self.regions}
+        latest = {}
+        while due:
+            for region in [
+                    region for region, at in due.items() if at <= now]:
+                progress = read_import_progress(region)
+                region.publish(progress)
+                if self.is_done(region, progress):
+                    region.message(
+                        "import finished; %s" % format_size(
+                            progress.bytes_total),
+                        level=MessageLevel.SUCCESS)
+                    region.publish(Finished(region.name))
+                    del due[region]
+                else:
+                    if progress == latest.get(region):
+                        intervals[region] = min(
+                            intervals[region] * 2, self.max_interval)
+                    else:
+                        intervals[region] = self.min_interval
+                    due[region] = now + intervals[region]
+                latest[region] = progress
+            if not due:
+                break
+            wake = min(due.values())
+            if self.deadline is not None:
+                if wake - started > self.deadline:
+                    wake = started + self.deadline
+                if now - started >= self.deadline:
+                    raise ImportTimeoutError(
+                        "Timed out waiting for import on regions: %s" % (
+                            ", ".join(sorted(
+                                region.name for region in due))))
+            time.sleep(max(0, wake - now))
+            now = time.monotonic()
+        return {region.name: progress for region, progress in latest.items()}
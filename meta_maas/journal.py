@@ -0,0 +1,119 @@
+# Copyright 2016 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Journal of the work completed on each region during a run."""
+
+import functools
+import hashlib
+import json
+import os
+import threading
+
+from .compress import sha256_file
+
+
+class JournalError(Exception):
+    """Raised when the journal cannot be written."""
+
+
+def get_digest(value):
+    """Return a digest of the configuration `value`."""
+    return hashlib.sha256(json.dumps(
+        value, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+# The `mtime` and `size` are only passed so a changed file misses the cache.
+@functools.lru_cache()
+def _get_file_checksum(path, mtime, size):  # pylint: disable=unused-argument
+    """Return the sha256 of the file at `path` with `mtime` and `size`."""
+    return sha256_file(path)
+
+
+def get_file_checksum(path):
+    """Return the sha256 of the file at `path`.
+
+    The checksum is only calculated once for every region that uploads the
+    same file, unless the file changes.
+    """
+    stat = os.stat(path)
+    return _get_file_checksum(path, stat.st_mtime, stat.st_size)
+
+
+def get_journal_name(names):
+    """Return the journal filename for a run on the regions `names`."""
+    return "%s.jsonl" % get_digest(sorted(names))[:16]
+
+
+class Journal:
+    """Records each operation completed on a region.
+
+    Every entry is appended to the file as a JSON line as soon as the
+    operation completes, so a run that is killed leaves a journal of what it
+    finished. An entry records the digest of the configuration it applied;
+    a resumed run only skips an operation when that configuration hasn't
+    changed.
+    """
+
+    def __init__(self, path, *, resume=False):
+        """Open the journal at `path`.
+
+        :param resume: Load the entries of the previous run instead of
+            starting a new journal.
+        """
+        self.path = path
+        self.resume = resume
+        self.entries = {}
+        self.lock = threading.Lock()
+        if resume:
+            self._load()
+        try:
+            # The journal is written to until the run finishes, `close` or
+            # `remove` closes it.
+            # pylint: disable=consider-using-with
+            self.stream = open(path, "a" if resume else "w")
+        except OSError as exc:
+            raise JournalError(
+                "Failed to open journal: %s" % path) from exc
+
+    def _load(self):
+        """Load the entries of the previous run."""
+        try:
+            with open(self.path, "r") as stream:
+                for line in stream:
+                    try:
+                        entry = json.loads(line)
+                        key = (entry["region"], entry["op"], entry["key"])
+                    except (ValueError, KeyError, TypeError):
+                        # The last line is partial when the run was killed
+                        # while writing it.
+                        continue
+                    self.entries[key] = entry.get("digest")
+        except FileNotFoundError:
+            pass
+
+    def is_done(self, region, operation, key, digest=None):
+        """Return True when `operation` on `key` was done for `region`."""
+        entry = (region, operation, key)
+        return entry in self.entries and self.entries[entry] == digest
+
+    def record(self, region, operation, key, digest=None):
+        """Record that `operation` on `key` was completed for `region`."""
+        line = json.dumps({
+            "region": region, "op": operation, "key": key, "digest": digest,
+        }, sort_keys=True)
+        with self.lock:
+            self.entries[(region, operation, key)] = digest
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+    def remove(self):
+        """Close and remove the journal once the run has completed."""
+        self.stream.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        """Close the journal, keeping it to resume from."""
+        self.stream.close()
@@ -0,0 +1,29 @@
+# Copyright 2016 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Metrics of the calls made to each region during a run."""
+
+import json
+
+
+class MetricsError(Exception):
+    """Raised when the metrics cannot be written."""
+
+
+def collect_metrics(regions):
+    """Return the metrics of each of `regions` keyed by name."""
+    return {
+        "regions": {
+            region.name: region.get_metrics()
+            for region in regions
+        },
+    }
+
+
+def write_metrics(path, regions):
+    """Write the metrics of `regions` as JSON to `path`."""
+    try:
+        with open(path, "w") as stream:
+            json.dump(collect_metrics(regions), stream, sort_keys=True)
+    except OSError as exc:
+        raise MetricsError("Failed to write metrics: %s" % path) from exc
@@ -0,0 +1,231 @@
+# Copyright 2016 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Local simplestreams mirror of the selected boot images."""
+
+import hashlib
+import http.server
+import json
+import os
+import socketserver
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from .state import write_atomically
+
+
+# Path of the simplestreams index relative to the source URL.
+INDEX_PATH = "streams/v1/index"
+
+# File in the root of the mirror that records the verified checksum of each
+# downloaded file.
+MANIFEST_FILENAME = ".meta-maas-mirror.json"
+
+# Size of the chunks read from upstream.
+CHUNK_SIZE = 1 << 20
+
+
+class MirrorError(Exception):
+    """Raised when syncing or serving the mirror fails."""
+
+
+def fetch(url):
+    """Return a stream for `url`."""
+    try:
+        return urllib.request.urlopen(url)
+    except (OSError, urllib.error.URLError) as exc:
+        raise MirrorError("Failed to fetch: %s" % url) from exc
+
+
+def is_selected(product, selections):
+    """Return True when `product` is selected by `selections`.
+
+    Bootloaders are always selected as every region needs them.
+    """
+    if "bootloader-type" in product:
+        return True
+    selection = selections.get(product.get("os"))
+    if selection is None:
+        return False
+    return (
+        product.get("release") in selection["releases"] and
+        (product.get("arch") in selection["arches"] or
+         "*" in selection["arches"]))
+
+
+class Mirror:
+    """A local simplestreams tree mirroring the selected images of a source.
+
+    The index and products files are stored as-is, including their signed
+    versions, so the regions can still verify them with the keyring. Only the
+    items of the latest version of each selected product are downloaded.
+    """
+
+    def __init__(self, path, source_url, selections):
+        """Initialize the mirror.
+
+        :param path: Root directory of the local tree.
+        :param source_url: URL of the upstream simplestreams source.
+        :param selections: Selections from the `images.source` config.
+        """
+        self.path = path
+        self.source_url = source_url.rstrip("/") + "/"
+        self.selections = selections
+        self.manifest = {}
+
+    def _local_path(self, path):
+        """Return the local path for the upstream relative `path`."""
+        local_path = os.path.normpath(os.path.join(self.path, path))
+        if not local_path.startswith(os.path.normpath(self.path) + os.sep):
+            raise MirrorError("Invalid path in simplestreams: %s" % path)
+        return local_path
+
+    def _load_manifest(self):
+        """Load the checksums of the previously downloaded files."""
+        try:
+            with open(os.path.join(self.path, MANIFEST_FILENAME)) as stream:
+                self.manifest = json.load(stream)
+        except (OSError, ValueError):
+            self.manifest = {}
+
+    def _save_manifest(self):
+        """Save the checksums of the downloaded files."""
+        with open(os.path.join(self.path, MANIFEST_FILENAME), "w") as stream:
+            json.dump(self.manifest, stream, sort_keys=True)
+
+    def _download(self, path, *, sha256=None, size=None):
+        """Download `path` from upstream, verifying `sha256` when given.
+
+        Returns the downloaded content when no checksum is given; those are
+        the small metadata files.
+        """
+        local_path = self._local_path(path)
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        checksum = hashlib.sha256()
+        content = [] if sha256 is None else None
+        with fetch(urllib.parse.urljoin(self.source_url, path)) as response:
+            with write_atomically(local_path, "wb") as stream:
+                for chunk in iter(lambda: response.read(CHUNK_SIZE), b""):
+                    checksum.update(chunk)
+                    stream.write(chunk)
+                    if content is not None:
+                        content.append(chunk)
+                # A mismatch removes the partial file.
+                if sha256 is not None and (
+                        checksum.hexdigest() != sha256 or
+                        (size is not None and stream.tell() != size)):
+                    raise MirrorError("Checksum mismatch: %s" % path)
+        if sha256 is not None:
+            self.manifest[path] = sha256
+        return None if content is None else b"".join(content)
+
+    def _download_metadata(self, path):
+        """Download the metadata file `path` and its signed version.
+
+        Returns the decoded JSON of the unsigned file.
+        """
+        base, _ = os.path.splitext(path)
+        try:
+            self._download(base + ".sjson")
+        except MirrorError:
+            # Not every source is signed.
+            pass
+        content = self._download(base + ".json")
+        try:
+            return json.loads(content.decode("utf-8"))
+        except ValueError as exc:
+            raise MirrorError("Invalid simplestreams: %s" % path) from exc
+
+    def is_current(self, item):
+        """Return True when `item` is already downloaded and verified."""
+        path = item["path"]
+        if self.manifest.get(path) != item["sha256"]:
+            return False
+        local_path = self._local_path(path)
+        return os.path.isfile(local_path) and (
+            "size" not in item or os.path.getsize(local_path) == item["size"])
+
+    def iter_items(self, products):
+        """Yield the items of the latest version of the selected products."""
+        for _, product in sorted(products.get("products", {}).items()):
+            if not is_selected(product, self.selections):
+                continue
+            versions = product.get("versions", {})
+            if not versions:
+                continue
+            latest = versions[max(versions)]
+            for _, item in sorted(latest.get("items", {}).items()):
+                yield item
+
+    def sync(self, progress_callback=None):
+        """Sync the selected images from upstream.
+
+        Items that are already downloaded with a matching checksum are not
+        downloaded again. Returns the tuple `(downloaded, skipped)`.
+
+        :param progress_callback: Called with the path of each item before
+            it is downloaded.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        self._load_manifest()
+        downloaded, skipped = 0, 0
+        try:
+            index = self._download_metadata(INDEX_PATH + ".json")
+            for _, entry in sorted(index.get("index", {}).items()):
+                products = self._download_metadata(entry["path"])
+                for item in self.iter_items(products):
+                    if self.is_current(item):
+                        skipped += 1
+                        continue
+                    if progress_callback is not None:
+                        progress_callback(item["path"])
+                    self._download(
+                        item["path"], sha256=item["sha256"],
+                        size=item.get("size"))
+                    downloaded += 1
+        finally:
+            self._save_manifest()
+        return downloaded, skipped
+
+
+class MirrorRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """Serves the files in the mirror's root directory."""
+
+    root = None
+
+    def translate_path(self, path):
+        """Translate `path` relative to the mirror instead of the CWD."""
+        path = super().translate_path(path)
+        return os.path.join(self.root, os.path.relpath(path, os.getcwd()))
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """Don't log every request."""
+
+
+class MirrorServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """Threaded HTTP server for the mirror."""
+
+    daemon_threads = True
+
+
+def make_server(path, listen):
+    """Make a `MirrorServer` serving `path` on `listen` ('host:port')."""
+    host, _, port = listen.rpartition(":")
+    try:
+        port = int(port)
+    except ValueError as exc:
+        raise MirrorError("Invalid listen address: %s" % listen) from exc
+    handler = type(
+        "MirrorRequestHandler", (MirrorRequestHandler,),
+        {"root": os.path.abspath(path)})
+    return MirrorServer((host, port), handler)
+
+
+def apply_mirror(images, mirror):
+    """Return `images` with the source pointing at the `mirror` URL."""
+    if images is None or mirror is None or 'source' not in images:
+        return images
+    images = dict(images)
+    images['source'] = dict(images['source'], url=mirror['url'])
+    return images
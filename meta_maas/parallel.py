@@ -0,0 +1,52 @@
+# Copyright 2016 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Run work for multiple regions at the same time."""
+
+import asyncio
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+
+@contextlib.contextmanager
+def ensure_event_loop():
+    """Make sure the calling thread has an event loop in the `with` body.
+
+    python-libmaas blocks on the current thread's event loop for every call,
+    and only the main thread gets one by default. A loop created here is
+    closed at the end of the body so its file descriptors aren't leaked.
+    """
+    try:
+        asyncio.get_event_loop()
+    except RuntimeError:
+        pass
+    else:
+        yield
+        return
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        yield
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+def run_parallel(func, items, *, jobs=1):
+    """Call `func` with each of `items` using at most `jobs` threads.
+
+    Returns the results in the same order as `items`. Every call is allowed
+    to finish before the first raised exception is re-raised.
+    """
+    items = list(items)
+    if jobs <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+
+    def call(item):
+        """Call `func` in a worker thread."""
+        with ensure_event_loop():
+            return func(item)
+
+    with ThreadPoolExecutor(max_workers=min(jobs, len(items))) as executor:
+        futures = [executor.submit(call, item) for item in items]
+    return [future.result() for future in futures]
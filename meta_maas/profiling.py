@@ -0,0 +1,150 @@
+# Copyright 2016 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Profile where the time and memory of a run go."""
+
+import collections
+import contextlib
+import cProfile
+import os
+import re
+import sys
+import threading
+import tracemalloc
+
+
+# Seconds between samples of the stacks of every thread.
+SAMPLE_INTERVAL = 0.01
+
+# Number of allocation sites written for a phase that traces memory.
+TOP_ALLOCATIONS = 25
+
+
+def get_frame_name(frame):
+    """Return the name of `frame` in a collapsed stack."""
+    code = frame.f_code
+    return "%s:%s" % (os.path.basename(code.co_filename), code.co_name)
+
+
+def collapse_stack(frame):
+    """Return the stack ending at `frame` as `root;...;frame`."""
+    names = []
+    while frame is not None:
+        names.append(get_frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Profiler:
+    """Writes profiles of a run to `directory`.
+
+    Each phase is profiled with cProfile to `<phase>.pstats`. The stacks of
+    every thread are sampled for the whole run and written to
+    `stacks.collapsed`, the format flamegraph tools read. Phases that trace
+    memory also write their top allocations to `<phase>.tracemalloc.txt`.
+    A phase that cannot be profiled with cProfile writes why to
+    `<phase>.skipped.txt` instead. Nothing is profiled when `directory` is
+    None.
+    """
+
+    def __init__(self, directory, *, interval=SAMPLE_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+        self.stacks = collections.Counter()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    @property
+    def enabled(self):
+        """True when profiling."""
+        return self.directory is not None
+
+    def get_path(self, name, extension):
+        """Return the path of the `extension` output of phase `name`."""
+        filename = "%s.%s" % (re.sub(r"[^\w.-]", "_", name), extension)
+        return os.path.join(self.directory, filename)
+
+    @contextlib.contextmanager
+    def phase(self, name, *, memory=False):
+        """Profile the body of the `with` as phase `name`.
+
+        Only the calling thread is profiled, so phases can be profiled in
+        several threads at the same time.
+
+        :param memory: Also trace the memory allocated in the phase.
+        """
+        if not self.enabled:
+            yield
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as exc:
+            # Only one profiler can be active at a time from Python 3.12,
+            # so concurrent phases are only in the sampled stacks.
+            profile = None
+            self.write_skipped(name, exc)
+        trace = memory and not tracemalloc.is_tracing()
+        if trace:
+            tracemalloc.start()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+                profile.dump_stats(self.get_path(name, "pstats"))
+            if memory:
+                self.write_allocations(name, tracemalloc.take_snapshot())
+            if trace:
+                tracemalloc.stop()
+
+    def write_skipped(self, name, error):
+        """Write why phase `name` wasn't profiled with cProfile."""
+        with open(self.get_path(name, "skipped.txt"), "w") as stream:
+            stream.write(
+                "cProfile skipped: %s\n"
+                "The phase is still in stacks.collapsed.\n" % error)
+
+    def write_allocations(self, name, snapshot):
+        """Write the top allocations in `snapshot` for phase `name`."""
+        statistics = snapshot.statistics("lineno")[:TOP_ALLOCATIONS]
+        with open(self.get_path(name, "tracemalloc.txt"), "w") as stream:
+            for statistic in statistics:
+                stream.write("%s\n" % statistic)
+
+    def sample(self, stop):
+        """Count the stacks of every other thread until `stop` is set."""
+        current = threading.get_ident()
+        names = {}
+        while not stop.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            frames = sys._current_frames()  # pylint: disable=protected-access
+            for ident, frame in frames.items():
+                if ident != current:
+                    self.stacks["%s;%s" % (
+                        names.get(ident, ident), collapse_stack(frame))] += 1
+
+    def write_stacks(self):
+        """Write the sampled stacks in the collapsed format."""
+        path = os.path.join(self.directory, "stacks.collapsed")
+        with open(path, "w") as stream:
+            for stack, count in sorted(self.stacks.items()):
+                stream.write("%s %d\n" % (stack, count))
+
+    @contextlib.contextmanager
+    def sampling(self):
+        """Sample the stacks of every thread in the body of the `with`."""
+        if not self.enabled:
+            yield
+            return
+        stop = threading.Event()
+        sampler = threading.Thread(
+            target=self.sample, args=(stop,), name="profiler", daemon=True)
+        sampler.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            sampler.join()
+            self.write_stacks()
@@ -3,92 +3,332 @@
 
 """Region class to connect and sync."""
 
+import contextlib
 import copy
-import enum
-import signal
-import sys
+import threading
 import time
 
-from colorclass import Color
 from maas.client.bones import CallError
 from maas.client.viscera import Origin, boot_resources
-from progressbar import Bar, Percentage, ProgressBar
 
+from .events import Finished, Message, MessageLevel, Progress
+from .history import get_image_identity
+from .imports import ImportCoordinator
+from .journal import get_digest, get_file_checksum
+from .parallel import run_parallel
+from .resilience import RegionCalls, is_region_failure
+from .users import describe_users, iter_batches, iter_users
 
-# Used for mocking out in tests.
-print = print  # pylint: disable=invalid-name,redefined-builtin
 
+# Times a selection is tried to be created while the cache isn't ready.
+SELECTION_CREATE_ATTEMPTS = 5
 
-class MessageLevel(enum.Enum):
-    """Level of message to print."""
+# Seconds between the attempts to create a selection.
+SELECTION_RETRY_DELAY = 1
 
-    PROGRESS = 0
-    SUCCESS = 1
-    WARN = 2
+# Seconds after which the selections of a source are no longer retried.
+SELECTION_RECONCILE_TIMEOUT = 120
 
+# Marks a collection that isn't memoized.
+_NOT_READ = object()
 
-class Region:
+
+# Besides the connection, a region holds the state of its sync for the run
+# that the history, journal and metrics are written from.
+class Region:  # pylint: disable=too-many-instance-attributes
     """Handles connection and synchronising region."""
 
-    def __init__(self, name, url, apikey, *, quiet=False):
-        """Initialize region."""
+    def __init__(self, name, url, apikey, *, events=None, calls=None):
+        """Initialize region.
+
+        :param events: `EventBus` to publish events to. Events are dropped
+            when not provided.
+        :param calls: `RegionCalls` every call to the region goes through.
+            Default calls are used when not provided.
+        """
         self.profile, self.origin = None, None
         self.name, self.url, self.apikey = name, url, apikey
-        self.quiet = quiet
+        self.events = events
+        self.calls = RegionCalls() if calls is None else calls
+        self.journal = None
+        self.memo = {}
+        self.memo_lock = threading.Lock()
+        self.timings = {}
+        self.bytes_uploaded = 0
+        self.custom_images = {}
+        self.imports = None
+        self.selection_update_supported = True
 
     def connect(self):
         """Connect to the region."""
         self.profile, self.origin = Origin.connect(
             self.url, apikey=self.apikey)
+        self.imports = ImportCoordinator(self.origin, call=self._call)
+
+    def _call(self, func, *args, invalidates=(), timed=True, **kwargs):
+        """Call `func` on the region through its limiter and circuit breaker.
+
+        :param invalidates: Collections `func` writes to. Their memoized
+            reads are dropped even when the call fails, as the write might
+            still have been applied.
+        :param timed: Count the call as slow when it takes too long. Calls
+            that are expected to be long, like uploads, are not timed.
+        """
+        try:
+            return self.calls.call(func, *args, timed=timed, **kwargs)
+        finally:
+            self.invalidate(*invalidates)
+
+    def _read(self, collection, func, *args):
+        """Call the idempotent read `func` through the circuit breaker.
+
+        The result is memoized for the run until a write to `collection`
+        invalidates it. The read is hedged when the region's calls hedge.
+        """
+        key = (collection,) + tuple(getattr(arg, "id", arg) for arg in args)
+        with self.memo_lock:
+            result = self.memo.get(key, _NOT_READ)
+        if result is not _NOT_READ:
+            return result
+        result = self.calls.read(func, *args)
+        with self.memo_lock:
+            self.memo[key] = result
+        return result
+
+    @contextlib.contextmanager
+    def _phase(self, name):
+        """Add the time spent in the body of the `with` to phase `name`."""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.timings[name] = (
+                self.timings.get(name, 0) + time.monotonic() - started)
+
+    def invalidate(self, *collections):
+        """Drop the memoized reads of `collections`."""
+        with self.memo_lock:
+            for key in [key for key in self.memo if key[0] in collections]:
+                del self.memo[key]
+
+    def _run_concurrently(self, func, items):
+        """Call `func` with each of `items` at the same time.
+
+        As many calls are in flight as the region's limiter allows.
+        """
+        return run_parallel(func, items, jobs=self.calls.limiter.max_limit)
+
+    def read_users(self):
+        """Return the users on the region."""
+        return self._read("Users", self.origin.Users.read)
+
+    def read_boot_sources(self):
+        """Return the boot sources on the region."""
+        return self._read("BootSources", self.origin.BootSources.read)
+
+    def read_selections(self, source):
+        """Return the selections of the boot `source` on the region."""
+        return self._read(
+            "BootSourceSelections", self.origin.BootSourceSelections.read,
+            source)
 
-    def sync(self, users, images):
-        """Sync the users and images on the region."""
-        self.sync_users(users)
-        self.sync_images(images)
-        self.print_msg("sync finished", level=MessageLevel.SUCCESS)
+    def read_machines(self):
+        """Return the machines on the region.
+
+        The machines are not memoized so they aren't kept in memory once
+        they are exported or reported.
+        """
+        return self.calls.read(self.origin.Machines.read)
+
+    def read_boot_resources(self):
+        """Return the boot resources on the region."""
+        return self._read("BootResources", self.origin.BootResources.read)
+
+    def _get_digest(self, value):
+        """Return the digest of `value` when journaling."""
+        return None if self.journal is None else get_digest(value)
+
+    def _get_arches_digest(self, arches):
+        """Return the digest of `arches` in any order when journaling."""
+        return None if self.journal is None else get_digest(sorted(arches))
+
+    def _get_users_digest(self, users, *values):
+        """Return the digest of `users` and `values` when journaling."""
+        if self.journal is None:
+            return None
+        return get_digest([describe_users(users)] + list(values))
+
+    def _is_done(self, operation, key, digest=None):
+        """Return True when the journal has `operation` on `key` as done."""
+        return (
+            self.journal is not None and
+            self.journal.is_done(self.name, operation, key, digest))
+
+    def _record(self, operation, key, digest=None):
+        """Record `operation` on `key` as completed in the journal."""
+        if self.journal is not None:
+            self.journal.record(self.name, operation, key, digest)
+
+    def _resume_pending_import(self):
+        """Request the import a previous run requested but didn't start."""
+        if (self._is_done("import", "requested") and
+                not self._is_done("import", "started")):
+            self.imports.request("resumed pending import")
+
+    def sync(
+            self, users, images, *, start_import=True, changelog=None,
+            journal=None):
+        """Sync the users and images on the region.
+
+        :param start_import: Start the import once synced. When False the
+            import is left pending for an `ImportScheduler` to start.
+        :param changelog: `Changelog` of the users added to the directory.
+            Only the users added since the region's watermark are created,
+            instead of the `users`.
+        :param journal: `Journal` that records the completed work. Work
+            recorded by a resumed run's journal is skipped.
+        """
+        self.journal = journal
+        digest = self._get_users_digest(users, images)
+        synced = self._is_done("sync", "region", digest)
+        if synced:
+            self._resume_pending_import()
+        else:
+            # With a changelog only its changes are created, so the
+            # region's users are never read.
+            if users is not None and changelog is None:
+                with self._phase("users"):
+                    self.sync_users(users)
+            self.sync_images(images)
+        if changelog is not None:
+            with self._phase("changes"):
+                self.sync_user_changes(changelog)
+        if start_import:
+            with self._phase("import"):
+                self.start_import()
+        if synced:
+            self.message(
+                "already synced; skipped", level=MessageLevel.SUCCESS)
+        else:
+            self._record("sync", "region", digest)
+            self.message("sync finished", level=MessageLevel.SUCCESS)
+        self.publish(Finished(self.name))
+
+    def skip(self, reason):
+        """Skip syncing the region because of `reason`."""
+        self.message(
+            "sync skipped; %s" % reason, level=MessageLevel.SUCCESS)
+        self.publish(Finished(self.name))
 
     def sync_users(self, users):
-        """Sync the users on the region."""
-        if users is None:
-            users = {}
-        region_users = self.origin.Users.read()
-        region_usernames = [
-            user.username
-            for user in region_users
-        ]
-        users_to_add = {
-            username: data
-            for username, data in users.items()
-            if username not in region_usernames
-        }
-        users_to_update = {
-            username: data
-            for username, data in users.items()
-            if username in region_usernames
-        }
-        for username, data in users_to_add.items():
-            self.origin.Users.create(
-                username, data['password'],
-                email=data.get('email', None),
-                is_admin=data.get('is_admin', False))
-            self.print_msg(
-                "created user '%s'." % username, level=MessageLevel.SUCCESS)
-        for username, _ in users_to_update.items():
-            self.print_msg(
-                "unable to update user '%s'; API doesn't support "
-                "user updating" % username, level=MessageLevel.WARN)
+        """Sync the users on the region.
+
+        :param users: Mapping of the users or the path of a users file. The
+            users are compared with the region in batches so a users file is
+            never read into memory.
+        """
+        digest = self._get_users_digest(users)
+        if self._is_done("users", "all", digest):
+            self.message("users already synced; skipped")
+            return
+        # The region's users are only read for the first batch a resumed
+        # run hasn't synced yet.
+        region_usernames = None
+        for batch in iter_batches(iter_users(users)):
+            batch_digest = self._get_digest(batch)
+            if self._is_done("users", batch_digest):
+                continue
+            if region_usernames is None:
+                region_usernames = {
+                    user.username for user in self.read_users()}
+            users_to_add = [
+                (username, data)
+                for username, data in batch
+                if username not in region_usernames
+            ]
+            users_to_update = [
+                username
+                for username, _ in batch
+                if username in region_usernames
+            ]
+            # The users are created at the same time, as many in flight as
+            # the region's limiter allows.
+            self._run_concurrently(self._create_user, users_to_add)
+            for username in users_to_update:
+                self.message(
+                    "unable to update user '%s'; API doesn't support "
+                    "user updating" % username, level=MessageLevel.WARN)
+            region_usernames.update(username for username, _ in users_to_add)
+            self._record("users", batch_digest)
+        self._record("users", "all", digest)
+
+    def _create_user(self, user):
+        """Create the `(username, data)` user."""
+        username, data = user
+        self._call(
+            self.origin.Users.create, username, data['password'],
+            email=data.get('email', None),
+            is_admin=data.get('is_admin', False), invalidates=["Users"])
+        self.message(
+            "created user '%s'." % username, level=MessageLevel.SUCCESS)
+
+    def sync_user_changes(self, changelog):
+        """Create the users added to `changelog` since the watermark.
+
+        The region's users are not read. A user that cannot be created,
+        e.g. because it already exists, is reported and skipped. The
+        watermark is kept up to the last change applied, even when the sync
+        fails part way.
+        """
+        watermark = start = changelog.get_watermark(self.name)
+        created = 0
+        try:
+            for change in changelog.iter_changes(watermark):
+                data = change.data
+                try:
+                    self._call(
+                        self.origin.Users.create, change.username,
+                        data['password'], email=data.get('email', None),
+                        is_admin=data.get('is_admin', False),
+                        invalidates=["Users"])
+                except CallError as exc:
+                    if is_region_failure(exc):
+                        raise
+                    self.message(
+                        "unable to create user '%s': %s" % (
+                            change.username, exc), level=MessageLevel.WARN)
+                else:
+                    created += 1
+                    self.message(
+                        "created user '%s'." % change.username,
+                        level=MessageLevel.SUCCESS)
+                watermark = change.watermark
+        finally:
+            if watermark != start:
+                changelog.set_watermark(self.name, watermark)
+        self.message(
+            "created %d users from the changelog up to change %d" % (
+                created, watermark.seq), level=MessageLevel.SUCCESS)
 
     def sync_images(self, images):
         """Sync the images on the region."""
         source = images.get('source')
         if source is not None:
-            self.sync_source(source)
+            with self._phase("source"):
+                self.sync_source(source)
         custom_images = images.get('custom', {})
         for name, info in custom_images.items():
-            self.sync_custom(name, info)
+            with self._phase("custom"):
+                self.sync_custom(name, info)
 
     def sync_source(self, source):
         """Sync the boot sources on the region."""
+        digest = self._get_digest(source)
+        if self._is_done("source", source['url'], digest):
+            self._resume_pending_import()
+            self.message(
+                "image source already synced; skipped: '%s'" % source['url'])
+            return
         # Find the matching source and remove the none matching.
         matching_source, updated = self._get_matching_source(source)
 
@@ -98,13 +338,17 @@ class Region:
         if matching_source is not None:
             is_new = False
             if matching_source.keyring_filename != source['keyring_filename']:
-                matching_source.delete()
+                self._call(
+                    matching_source.delete,
+                    invalidates=["BootSources", "BootSourceSelections"])
                 matching_source = None
 
         # Create a new source.
         if matching_source is None:
-            matching_source = self.origin.BootSources.create(
-                url=source['url'], keyring_filename=source['keyring_filename'])
+            matching_source = self._call(
+                self.origin.BootSources.create, url=source['url'],
+                keyring_filename=source['keyring_filename'],
+                invalidates=["BootSources"])
             updated = True
 
         # Remove old selections and get a list of those that need to be
@@ -114,23 +358,25 @@ class Region:
         if not updated:
             updated = selections_updated
 
-        # Start import and/or print message based on what actually occurred.
+        # Request an import and/or print message based on what actually
+        # occurred. The import is started once the sync has finished.
         if is_new or updated:
-            self.origin.BootResources.start_import()
+            self._record("import", "requested")
             if is_new:
-                self.print_msg(
-                    "created image source '%s'; started import" % (
-                        source['url']),
-                    level=MessageLevel.SUCCESS, replace=True)
+                self.imports.request("created image source")
+                self.message(
+                    "created image source '%s'" % source['url'],
+                    level=MessageLevel.SUCCESS)
             else:
-                self.print_msg(
-                    "updated image source '%s'; started import" % (
-                        source['url']),
-                    level=MessageLevel.SUCCESS, replace=True)
+                self.imports.request("updated image source")
+                self.message(
+                    "updated image source '%s'" % source['url'],
+                    level=MessageLevel.SUCCESS)
         else:
-            self.print_msg(
+            self.message(
                 "image source unchanged: '%s'" % source['url'],
-                level=MessageLevel.SUCCESS, replace=True)
+                level=MessageLevel.SUCCESS)
+        self._record("source", source['url'], digest)
 
     def _get_matching_source(self, source):
         """Return the matching `BootSource` if exists.
@@ -138,13 +384,15 @@ class Region:
         Any other none matching `BootSource` will be deleted.
         """
         updated = False
-        remote_sources = self.origin.BootSources.read()
+        remote_sources = self.read_boot_sources()
         matching_source = None
         for remote_source in remote_sources:
             if remote_source.url != source['url']:
                 # Remove this source.
-                remote_source.delete()
-                self.print_msg(
+                self._call(
+                    remote_source.delete,
+                    invalidates=["BootSources", "BootSourceSelections"])
+                self.message(
                     "removed source '%s'" % remote_source.url,
                     level=MessageLevel.WARN)
                 updated = True
@@ -153,161 +401,222 @@ class Region:
         return matching_source, updated
 
     def _update_selections(self, source, selections, updated):
-        """Update the selections for the `source`."""
+        """Update the selections for the `source`.
+
+        The selections that don't match are deleted and the missing ones
+        created at the same time, as many in flight as the region's limiter
+        allows. The creates are only retried for up to
+        `SELECTION_RECONCILE_TIMEOUT` seconds from the start. Returns True
+        when a selection was changed and an import is required.
+        """
+        deadline = time.monotonic() + SELECTION_RECONCILE_TIMEOUT
+        changed = False
         missing_selections = copy.deepcopy(selections)
-        remote_selections = (
-            self.origin.BootSourceSelections.read(source))
+        selections_to_delete = []
+        remote_selections = self.read_selections(source)
         for remote_selection in remote_selections:
             match_os = selections.get(remote_selection.os)
             if match_os is None:
                 # OS is not selected.
-                remote_selection.delete()
-                updated = True
-            else:
-                if remote_selection.release not in match_os['releases']:
-                    # Not a selected release.
-                    remote_selection.delete()
-                    updated = True
-                elif set(remote_selection.arches) != set(match_os['arches']):
-                    # One of the arches doesn't match so we need to remove
-                    # the selection to make a new selection.
-                    remote_selection.delete()
-                    updated = True
+                selections_to_delete.append(remote_selection)
+            elif remote_selection.release not in match_os['releases']:
+                # Not a selected release.
+                selections_to_delete.append(remote_selection)
+            elif set(remote_selection.arches) != set(match_os['arches']):
+                # One of the arches doesn't match. Update the selection in
+                # place so the cache doesn't need to be refreshed, otherwise
+                # remove it to make a new selection.
+                if self._update_selection_arches(
+                        remote_selection, match_os['arches']):
+                    missing_selections[remote_selection.os][
+                        'releases'].remove(remote_selection.release)
+                    changed = True
                 else:
-                    # Release and arches are correct so we remove it so its
-                    # not created again.
-                    missing_selections[remote_selection.os]['releases'].remove(
-                        remote_selection.release)
+                    selections_to_delete.append(remote_selection)
+            else:
+                # Release and arches are correct so we remove it so its not
+                # created again. One the interrupted run created still needs
+                # to be imported.
+                missing_selections[remote_selection.os]['releases'].remove(
+                    remote_selection.release)
+                if self._is_pending_selection(remote_selection):
+                    changed = True
+        if selections_to_delete:
+            updated = True
+            self._run_concurrently(
+                lambda selection: self._call(
+                    selection.delete, invalidates=["BootSourceSelections"]),
+                selections_to_delete)
 
         # Because of lp:1636992, we start and stop the import of
         # boot-resources. This causes the cache to be updated, but nothing
-        # gets changed in the images.
+        # gets changed in the images. Selections updated in place don't
+        # need the cache to be updated. The cache is waited for once for
+        # all the selections.
         if updated:
             self._force_cache_update()
 
-        # Add the selections that need to be created.
-        first_pass = True
-        for os_name, info in missing_selections.items():
-            for release in info['releases']:
-                updated = True
-                self._create_selection(
-                    source, os_name, release, info['arches'],
-                    retry=first_pass)
-                first_pass = False
+        # Add the selections that need to be created. Each one is retried
+        # as the cache might not be ready for it yet.
+        selections_to_create = [
+            (os_name, release, info['arches'])
+            for os_name, info in missing_selections.items()
+            for release in info['releases']
+        ]
+        if selections_to_create:
+            updated = True
+            self._run_concurrently(
+                lambda selection: self._create_selection(
+                    source, *selection, deadline=deadline),
+                selections_to_create)
 
-        return updated
+        return updated or changed
+
+    def _update_selection_arches(self, selection, arches):
+        """Update the arches of `selection` in place.
+
+        Returns False when the region's API doesn't support updating a
+        `BootSourceSelection`, in which case it must be deleted and created
+        again. A failure of the region is raised.
+        """
+        if not self.selection_update_supported:
+            return False
+        selection.arches = arches
+        try:
+            self._call(
+                selection.save, invalidates=["BootSourceSelections"])
+        except (AttributeError, CallError) as exc:
+            if is_region_failure(exc):
+                raise
+            # Don't try again for the other selections on this region.
+            self.selection_update_supported = False
+            return False
+        return True
 
     def _create_selection(
-            self, source, os_name, release, arches, *, retry=False):
+            self, source, os_name, release, arches, *, deadline=None):
         """Create a `BootSourceSelection`.
 
-        :param retry: Retry up to 5 times to make the selection. This is useful
-            when the `BootSource` cache is not updated yet on first create.
+        :param deadline: `time.monotonic()` until which the selection is
+            tried again, up to `SELECTION_CREATE_ATTEMPTS` times. This is
+            useful when the `BootSource` cache is not updated yet. It's only
+            tried once when not given.
         """
-        if retry:
-            for i in range(5):
-                try:
-                    self.origin.BootSourceSelections.create(
-                        source, os_name, release, arches=arches)
-                except CallError:
-                    # Allow this to fail up to 5 times then raise the error.
-                    if i == 4:
-                        raise
-                    # Cache is not updated so wait 1 second to try again.
-                    else:
-                        time.sleep(1)
-                else:
-                    # Worked exit the retry.
-                    break
-        else:
-            self.origin.BootSourceSelections.create(
-                source, os_name, release, arches=arches)
+        attempts = 1 if deadline is None else SELECTION_CREATE_ATTEMPTS
+        for attempt in range(1, attempts + 1):
+            try:
+                self._call(
+                    self.origin.BootSourceSelections.create,
+                    source, os_name, release, arches=arches,
+                    invalidates=["BootSourceSelections"])
+            except CallError:
+                # Allow this to fail on every attempt, or until the deadline,
+                # then raise the error.
+                if (attempt == attempts or
+                        time.monotonic() + SELECTION_RETRY_DELAY > deadline):
+                    raise
+                # Cache is not updated so wait to try again.
+                time.sleep(SELECTION_RETRY_DELAY)
+            else:
+                break
+        self._record(
+            "selection", "%s/%s" % (os_name, release),
+            self._get_arches_digest(arches))
+
+    def _is_pending_selection(self, selection):
+        """Return True when the journal has `selection` as created by a run
+        that didn't start its import."""
+        return (
+            self._is_done(
+                "selection", "%s/%s" % (selection.os, selection.release),
+                self._get_arches_digest(selection.arches)) and
+            not self._is_done("import", "started"))
 
     def _force_cache_update(self):
         """Force the boot source cache to be updated."""
-        self.origin.BootResources.start_import()
-        if sys.stdout.isatty():
-            msg = "waiting for image source cache to be synced"
-            for i in range(3):
-                self.print_msg(
-                    "%s %s" % (msg, '.' * (i + 1)),
-                    newline=False, replace=False if i == 0 else True)
-                time.sleep(0.75)
-        else:
+
+        def wait():
+            """Wait for the import to update the cache."""
+            self.message("waiting for image source cache to be synced")
             time.sleep(0.75 * 3)
-        self.origin.BootResources.stop_import()
+
+        if not self.imports.refresh_cache(wait):
+            self.message(
+                "import already running; image source cache not refreshed")
 
     def sync_custom(self, name, image_info):
         """Sync a custom image."""
+        checksum = None
+        if self.journal is not None:
+            checksum = get_file_checksum(image_info['path'])
+            if self._is_done("custom", name, checksum):
+                self.message(
+                    "custom/%s already uploaded; skipped" % name,
+                    level=MessageLevel.SUCCESS)
+                return
         upload_started = False
-        progress_bar = ProgressBar(
-            widgets=[
-                "Region %s: uploading custom/%s " % (self.name, name),
-                Bar(marker='=', left='[', right=']'),
-                " ",
-                Percentage()
-            ], maxval=1)
+        task = "uploading custom/%s" % name
 
         def update_progress(progress):
-            """Update the progress bar on each chunk upload."""
-            # Show the progress bar on the first call.
+            """Publish the progress on each chunk upload."""
             nonlocal upload_started
-            if not upload_started:
-                upload_started = True
-                if not self.quiet and sys.stdout.isatty():
-                    progress_bar.start()
-            if not self.quiet and sys.stdout.isatty():
-                progress_bar.update(progress)
+            upload_started = True
+            self.publish(Progress(self.name, task, progress))
             if progress == 1:
-                # Don't call finish on progress bar because we want to
-                # replace the whole line.
-                fill = None
-                if not self.quiet and sys.stdout.isatty():
-                    if progress_bar.signal_set:
-                        signal.signal(signal.SIGWINCH, signal.SIG_DFL)
-                    fill = progress_bar.term_width
-                self.print_msg(
-                    "custom/%s uploaded" % name,
-                    level=MessageLevel.SUCCESS, replace=True, fill=fill)
+                self.message(
+                    "custom/%s uploaded" % name, level=MessageLevel.SUCCESS)
 
+        # Uploads are expected to be slow so they are not timed.
         with open(image_info['path'], "rb") as stream:
-            self.origin.BootResources.create(
+            self._call(
+                self.origin.BootResources.create,
                 'custom/%s' % name, image_info['architecture'], stream,
                 title=image_info.get('title', ''),
                 filetype=boot_resources.BootResourceFileType(
                     image_info.get('filetype', 'tgz')),
-                progress_callback=update_progress)
-        if not upload_started:
-            self.print_msg(
+                progress_callback=update_progress, timed=False,
+                invalidates=["BootResources"])
+        identity = get_image_identity(image_info)
+        if upload_started:
+            self.bytes_uploaded += identity[0]
+        else:
+            self.message(
                 "custom/%s already in sync" % name, level=MessageLevel.SUCCESS)
+        # Recorded in the history so the next run can tell whether the
+        # image will have to be uploaded again.
+        self.custom_images[name] = identity
+        self._record("custom", name, checksum)
 
-    def print_msg(
-            self, msg, *, level=None, newline=True, replace=False, fill=None):
-        """Print a message."""
-        if not self.quiet:
-            if level is None or level == MessageLevel.PROGRESS:
-                start_color = ""
-                end_color = ""
-            elif level == MessageLevel.SUCCESS:
-                start_color = "{autogreen}"
-                end_color = "{/autogreen}"
-            elif level == MessageLevel.WARN:
-                start_color = "{autoyellow}"
-                end_color = "{/autoyellow}"
-            else:
-                raise ValueError("unknown level: %s" % level)
-
-            msg = Color(
-                '%s%sRegion %s: %s%s' % (
-                    "\r" if replace else "",
-                    start_color,
-                    self.name,
-                    msg,
-                    end_color))
-            if fill is not None:
-                msg += " " * (fill - len(msg))
-                if replace:
-                    # \r gets counted in the length, so add extra character
-                    # when replace is also used.
-                    msg += " "
-            print(msg, end=None if newline is True else "", flush=True)
+    def start_import(self):
+        """Start a single import for every change made during the sync.
+
+        Returns True when an import was started.
+        """
+        requested = bool(self.imports.reasons)
+        reasons = self.imports.flush()
+        if reasons:
+            self._record("import", "started")
+            self.message(
+                "started import; %s" % ", ".join(reasons),
+                level=MessageLevel.SUCCESS)
+        elif requested:
+            self.message(
+                "import already running; not restarted",
+                level=MessageLevel.SUCCESS)
+        return bool(reasons)
+
+    def get_metrics(self):
+        """Return the metrics of the calls to the region for this run."""
+        metrics = self.calls.get_metrics()
+        metrics["phases"] = dict(self.timings)
+        metrics["bytes_uploaded"] = self.bytes_uploaded
+        return metrics
+
+    def publish(self, event):
+        """Publish `event` to the event bus."""
+        if self.events is not None:
+            self.events.publish(event)
+
+    def message(self, msg, *, level=MessageLevel.PROGRESS):
+        """Publish a message."""
+        self.publish(Message(self.name, level, msg))
@@ -3,46 +3,258 @@
 
 """Output HTML to render status of regions."""
 
+import hashlib
 import json
 import os
+import threading
+import time
 
-from collections import defaultdict
-from distutils.dir_util import copy_tree
+from .aggregate import MachineColumns, merge_aggregates, to_chart
+from .assets import build_assets, write_asset
+from .events import MessageLevel
+from .parallel import ensure_event_loop
+from .state import write_atomically
 
 
 SERVICE_TEMPLATE = """\
 angular.module('meta-maas').service('metaData', function() {
     this.regions = %s;
+    this.fleet = %s;
 });
 """
 
+# Each region's data is a script that passes it to the loaded page, so it
+# can be lazily loaded even when the report is opened from disk.
+REGION_TEMPLATE = """\
+metaMaasRegion(%s, %s);
+"""
+
+# Directory in the report with the data file of each region.
+REGIONS_DIRECTORY = "regions"
+
+# Fields of each region that are kept in the index.
+INDEX_FIELDS = ('url', 'machine_count', 'stale', 'stale_age')
+
 
 class OutputHTMLError(Exception):
     """Raised when generating HTML output fails."""
 
 
-def render_data(regions):
-    """Render the data.js file based on the regions."""
+def collect_region_data(region):
+    """Collect the report data of `region`.
+
+    The machines are collected into `MachineColumns` and aggregated by every
+    dimension. `statuses` is kept next to the aggregates so data from older
+    shards still renders.
+    """
+    columns = MachineColumns()
+    # Use the API data so the aggregates don't depend on viscera's fields.
+    # pylint: disable=protected-access
+    for machine in region.read_machines():
+        columns.append(machine._data)
+    aggregates = columns.aggregate()
+    return {
+        'url': region.url,
+        'statuses': aggregates['status'],
+        'aggregates': aggregates,
+        'machine_count': columns.count,
+    }
+
+
+def get_cache_path(cache_dir, name):
+    """Return the path of the cached report data of region `name`."""
+    return os.path.join(cache_dir, "%s.json" % name)
+
+
+def read_cached_data(cache_dir, name):
+    """Return the tuple `(data, collected_at)` cached for region `name`.
+
+    Returns None when nothing is cached.
+    """
+    try:
+        with open(get_cache_path(cache_dir, name), "r") as stream:
+            cached = json.load(stream)
+        return cached['data'], cached['collected_at']
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def write_cached_data(cache_dir, name, data):
+    """Cache the report `data` of region `name`."""
+    try:
+        with write_atomically(get_cache_path(cache_dir, name)) as stream:
+            json.dump({'data': data, 'collected_at': time.time()}, stream)
+    except OSError:
+        # The cache is only a fallback; the report is still written.
+        pass
+
+
+def get_stale_data(region, reason, cache_dir):
+    """Return the last cached report data of `region`, marked as stale.
+
+    Without cached data the region is reported with no machines.
+    """
+    cached = None
+    if cache_dir is not None:
+        cached = read_cached_data(cache_dir, region.name)
+    if cached is None:
+        region.message(
+            "report data %s; no cached data" % reason,
+            level=MessageLevel.WARN)
+        return {
+            'url': region.url,
+            'statuses': to_chart({}),
+            'aggregates': {},
+            'machine_count': 0,
+            'stale': True,
+            'stale_age': None,
+        }
+    data, collected_at = cached
+    age = max(0, int(time.time() - collected_at))
+    region.message(
+        "report data %s; using cached data from %ds ago" % (reason, age),
+        level=MessageLevel.WARN)
+    return dict(data, stale=True, stale_age=age)
+
+
+def collect_data(regions, *, timeout=None, cache_dir=None):
+    """Collect the report data for each region.
+
+    Every region is collected at the same time. A region that fails or isn't
+    collected within `timeout` seconds is reported with its last cached data
+    and marked stale, so the report is always written on time.
+
+    :param timeout: Seconds to wait for the regions.
+    :param cache_dir: Directory that caches the data of each region.
+    """
+    regions = list(regions)
+    results = {}
+
+    def collect(region):
+        """Collect `region` in its own thread."""
+        with ensure_event_loop():
+            try:
+                results[region.name] = collect_region_data(region)
+            except Exception as exc:  # pylint: disable=broad-except
+                results[region.name] = exc
+
+    # Daemon threads so a hung region never blocks exiting.
+    threads = [
+        threading.Thread(target=collect, args=(region,), daemon=True)
+        for region in regions
+    ]
+    deadline = None if timeout is None else time.monotonic() + timeout
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(
+            None if deadline is None else
+            max(0, deadline - time.monotonic()))
+
     data = {}
     for region in regions:
-        statuses = defaultdict(int)
-        count = 0
-        for machine in region.origin.Machines.read():
-            statuses[machine.status_name] += 1
-            count += 1
-        labels = sorted(statuses.keys())
-        data[region.name] = {
-            'url': region.url,
-            'statuses': {
-                'data': [
-                    statuses[label]
-                    for label in labels
-                ],
-                'labels': labels,
-            },
-            'machine_count': count,
+        result = results.get(region.name)
+        if isinstance(result, dict):
+            data[region.name] = result
+            if cache_dir is not None:
+                write_cached_data(cache_dir, region.name, result)
+        elif result is None:
+            data[region.name] = get_stale_data(region, "timed out", cache_dir)
+        else:
+            data[region.name] = get_stale_data(
+                region, "failed: %s" % result, cache_dir)
+    return data
+
+
+def summarize_fleet(data):
+    """Return the fleet-wide totals and aggregates of the report `data`.
+
+    Only the per-region aggregates are merged; the machines are not read
+    again.
+    """
+    return {
+        'region_count': len(data),
+        'stale_count': sum(
+            1 for info in data.values() if info.get('stale', False)),
+        'machine_count': sum(
+            info.get('machine_count', 0) for info in data.values()),
+        'aggregates': merge_aggregates(
+            info.get('aggregates', {'status': info['statuses']})
+            for info in data.values()
+            if 'aggregates' in info or 'statuses' in info),
+    }
+
+
+def get_region_filename(name):
+    """Return the path of the data file of region `name` in the report."""
+    digest = hashlib.sha1(name.encode("utf-8")).hexdigest()[:16]
+    return "%s/%s.js" % (REGIONS_DIRECTORY, digest)
+
+
+def index_data(data):
+    """Return the index of the report `data`.
+
+    The index only has the fields needed to list and filter the regions and
+    the data file that has the rest of each region.
+    """
+    index = {}
+    for name, info in data.items():
+        entry = {
+            field: info[field] for field in INDEX_FIELDS if field in info
         }
-    return SERVICE_TEMPLATE % json.dumps(data)
+        entry['file'] = get_region_filename(name)
+        index[name] = entry
+    return index
+
+
+def render_data(regions, *, data=None):
+    """Render the data.js index file based on the regions.
+
+    :param data: Previously collected data to render instead of collecting
+        it from `regions`.
+    """
+    if data is None:
+        data = collect_data(regions)
+    return SERVICE_TEMPLATE % (
+        json.dumps(index_data(data)), json.dumps(summarize_fleet(data)))
+
+
+def render_region_data(name, info):
+    """Render the data file of region `name`."""
+    return REGION_TEMPLATE % (json.dumps(name), json.dumps(info))
+
+
+def write_data(path, data):
+    """Write the report `data` from `collect_data` as JSON to `path`.
+
+    The written file can later be combined with the data written by other
+    shards using `merge_data`.
+    """
+    try:
+        with open(path, "w") as stream:
+            json.dump(data, stream, sort_keys=True)
+    except OSError as exc:
+        raise OutputHTMLError(
+            "Failed to write report data: %s" % path) from exc
+
+
+def merge_data(paths):
+    """Merge the report data written by `write_data` in each of `paths`."""
+    data = {}
+    for path in paths:
+        try:
+            with open(path, "r") as stream:
+                shard_data = json.load(stream)
+        except (OSError, ValueError) as exc:
+            raise OutputHTMLError(
+                "Failed to read report data: %s" % path) from exc
+        duplicates = sorted(set(data).intersection(shard_data))
+        if duplicates:
+            raise OutputHTMLError(
+                "Region '%s' exists in more than one report data: %s" % (
+                    duplicates[0], path))
+        data.update(shard_data)
+    return data
 
 
 def get_html_directory():
@@ -50,8 +262,12 @@ def get_html_directory():
     return os.path.join(os.path.abspath(os.path.dirname(__file__)), "html")
 
 
-def write_html(path, regions):
-    """Write HTML to directory."""
+def write_html(path, regions, *, data=None):
+    """Write HTML to directory.
+
+    :param data: Previously collected data, e.g. from `merge_data`, to
+        render instead of collecting it from `regions`.
+    """
     if not os.path.exists(path):
         try:
             os.makedirs(path)
@@ -62,6 +278,24 @@ def write_html(path, regions):
         raise OutputHTMLError(
             "Output directory already exists and is not a "
             "directory: %s" % path)
-    copy_tree(get_html_directory(), path, update=1, verbose=0)
-    with open(os.path.join(path, "data.js"), "w") as stream:
-        stream.write(render_data(regions))
+    if data is None:
+        data = collect_data(regions)
+    build_assets(get_html_directory(), path)
+    write_asset(
+        os.path.join(path, "data.js"),
+        render_data(regions, data=data).encode("utf-8"))
+    regions_path = os.path.join(path, REGIONS_DIRECTORY)
+    os.makedirs(regions_path, exist_ok=True)
+    written = set()
+    for name, info in data.items():
+        filename = get_region_filename(name)
+        written.add(os.path.basename(filename))
+        write_asset(
+            os.path.join(path, filename),
+            render_region_data(name, info).encode("utf-8"))
+    # Remove the data of regions that are no longer in the report.
+    for filename in os.listdir(regions_path):
+        base, ext = os.path.splitext(filename)
+        if filename not in written and (
+                ext not in (".gz", ".br") or base not in written):
+            os.remove(os.path.join(regions_path, filename))
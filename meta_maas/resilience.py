@@ -0,0 +1,356 @@
+# Copyright 2016 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Fail fast on degraded regions, adapt their concurrency and hedge reads."""
+
+import asyncio
+import collections
+import contextlib
+import queue
+import threading
+import time
+
+import aiohttp
+from maas.client.bones import CallError
+
+from .parallel import ensure_event_loop
+
+
+class CircuitOpenError(Exception):
+    """Raised when a call isn't sent because the region's circuit is open."""
+
+
+def is_region_failure(exc):
+    """Return True when `exc` means the region is degraded.
+
+    Errors the API returns for a bad request, e.g. a selection that cannot be
+    created yet, are not failures of the region.
+    """
+    if isinstance(exc, CallError):
+        status = exc.status
+        return isinstance(status, int) and status >= 500
+    return isinstance(
+        exc, (OSError, asyncio.TimeoutError, aiohttp.ClientError))
+
+
+def is_overload(exc):
+    """Return True when `exc` means the region is overloaded.
+
+    The region timing out or answering 503 Service Unavailable or 429 Too
+    Many Requests means fewer calls must be sent to it at the same time.
+    """
+    if isinstance(exc, CallError):
+        return exc.status in (429, 503)
+    return isinstance(exc, (asyncio.TimeoutError, TimeoutError))
+
+
+class CircuitBreaker:
+    """Stops calling a region after too many failures.
+
+    Every failed or slow call in the last `window` seconds is counted. Once
+    `failure_threshold` is reached the circuit opens and every call fails
+    with `CircuitOpenError` without being sent. After `reset_timeout`
+    seconds a single trial call is let through; the circuit closes again
+    when it succeeds and stays open when it doesn't.
+    """
+
+    def __init__(
+            self, *, failure_threshold=5, window=60, slow_call=None,
+            reset_timeout=30):
+        """Initialize the circuit breaker.
+
+        :param failure_threshold: Failures in the window that open the
+            circuit.
+        :param window: Seconds a failure is counted for.
+        :param slow_call: Seconds after which a successful call is counted
+            as a failure. Slow calls are not counted when not set.
+        :param reset_timeout: Seconds the circuit stays open before a trial
+            call is let through.
+        """
+        self.window = window
+        self.slow_call = slow_call
+        self.reset_timeout = reset_timeout
+        # Only the latest failures up to the threshold are kept.
+        self.failures = collections.deque(maxlen=max(1, failure_threshold))
+        self.opened_at = None
+        self.trial = False
+        self.lock = threading.Lock()
+
+    @property
+    def failure_threshold(self):
+        """Failures in the window that open the circuit."""
+        return self.failures.maxlen
+
+    @property
+    def is_open(self):
+        """True when calls are not being sent."""
+        return self.opened_at is not None
+
+    def check(self):
+        """Raise `CircuitOpenError` when a call must not be sent."""
+        with self.lock:
+            if self.opened_at is None:
+                return
+            elapsed = time.monotonic() - self.opened_at
+            if elapsed >= self.reset_timeout and not self.trial:
+                self.trial = True
+                return
+        raise CircuitOpenError(
+            "Region failing; circuit opened %ds ago after %d failures" % (
+                elapsed, self.failure_threshold))
+
+    def record_success(self):
+        """Record a successful call."""
+        with self.lock:
+            if self.trial:
+                self.trial = False
+                self.opened_at = None
+                self.failures.clear()
+
+    def record_failure(self):
+        """Record a failed or slow call."""
+        now = time.monotonic()
+        with self.lock:
+            self.failures.append(now)
+            while self.failures and self.failures[0] <= now - self.window:
+                self.failures.popleft()
+            if self.trial or len(self.failures) >= self.failure_threshold:
+                self.trial = False
+                self.opened_at = now
+
+    def call(self, func, *args, timed=True, **kwargs):
+        """Call `func` unless the circuit is open.
+
+        :param timed: Count the call as a failure when slower than
+            `slow_call`. Calls that are expected to be long, like uploads,
+            are not timed.
+        """
+        self.check()
+        started = time.monotonic()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as exc:
+            if is_region_failure(exc):
+                self.record_failure()
+            elif self.trial:
+                # The region answered, so it's alive.
+                self.record_success()
+            raise
+        if (timed and self.slow_call is not None and
+                time.monotonic() - started > self.slow_call):
+            self.record_failure()
+        else:
+            self.record_success()
+        return result
+
+
+# Besides its settings, the limiter holds the calls in flight and the
+# counts reported in the metrics.
+class AdaptiveLimiter:  # pylint: disable=too-many-instance-attributes
+    """Limits the calls in flight to a region, adapting the limit (AIMD).
+
+    Every healthy call adds `1 / limit` to the limit, so it grows by one
+    for each round of calls while the region keeps up. A call that is slow,
+    times out or finds the region overloaded multiplies the limit by
+    `backoff`, once for all the calls that were in flight at the time. A
+    call is slow when it takes `tolerance` times longer than the average
+    latency of the timed calls.
+    """
+
+    def __init__(
+            self, *, initial=1, min_limit=1, max_limit=8, backoff=0.5,
+            tolerance=2.0):
+        """Initialize the limiter.
+
+        :param initial: Calls allowed in flight at the start.
+        :param min_limit: Calls always allowed in flight.
+        :param max_limit: Calls never exceeded in flight.
+        :param backoff: Factor the limit is multiplied by on a slowdown.
+        :param tolerance: Factor of the average latency above which a call
+            is slow.
+        """
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(
+            min(max(initial, self.min_limit), self.max_limit))
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.latency = None
+        self.in_flight = 0
+        self.calls = 0
+        self.backoffs = 0
+        self.backed_off_at = None
+        self.condition = threading.Condition()
+
+    def acquire(self, *, block=True):
+        """Wait until a call is allowed; returns when it started.
+
+        :param block: Wait for the call to be allowed. When False None is
+            returned instead of waiting.
+        """
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                if not block:
+                    return None
+                self.condition.wait()
+            self.in_flight += 1
+            return time.monotonic()
+
+    def release(self, started, *, healthy=True, overloaded=False):
+        """Release the call that `started`, adapting the limit.
+
+        :param healthy: The call succeeded and is timed. Its latency is
+            compared with the average.
+        :param overloaded: The call was slow, timed out or the region was
+            overloaded.
+        """
+        latency = time.monotonic() - started
+        with self.condition:
+            self.in_flight -= 1
+            self.calls += 1
+            if healthy:
+                if (self.latency is not None and
+                        latency > self.tolerance * self.latency):
+                    overloaded = True
+                # Slow calls move the average too, so it follows a lasting
+                # change of the region's latency instead of backing off
+                # forever.
+                self.latency = (
+                    latency if self.latency is None
+                    else 0.8 * self.latency + 0.2 * latency)
+            if overloaded:
+                # The calls in flight when the limit was last decreased
+                # already had their share of the decrease.
+                if self.backed_off_at is None or started > self.backed_off_at:
+                    self.limit = max(
+                        self.min_limit, self.limit * self.backoff)
+                    self.backed_off_at = time.monotonic()
+                    self.backoffs += 1
+            elif healthy:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+    @contextlib.contextmanager
+    def limited(self, *, timed=True):
+        """Run the body of the `with` as a call in flight.
+
+        :param timed: Compare the latency of the call with the average. Calls
+            that are expected to be long, like uploads, are not timed.
+        """
+        started = self.acquire()
+        try:
+            yield
+        except Exception as exc:
+            self.release(started, healthy=False, overloaded=is_overload(exc))
+            raise
+        except BaseException:
+            self.release(started, healthy=False)
+            raise
+        self.release(started, healthy=timed)
+
+    def get_metrics(self):
+        """Return the current limit and the counts of calls and backoffs."""
+        with self.condition:
+            return {
+                "concurrency_limit": int(self.limit),
+                "in_flight": self.in_flight,
+                "calls": self.calls,
+                "backoffs": self.backoffs,
+            }
+
+
+def hedged_call(func, *args, delay, limiter=None):
+    """Call `func`, calling it a second time if it takes over `delay` seconds.
+
+    Only use for idempotent reads. Returns the first successful result. When
+    both calls fail the error of the call that failed first is raised.
+
+    :param limiter: `AdaptiveLimiter` the second call is in flight in. The
+        call isn't sent again when the limiter has no room for it.
+    """
+    results = queue.Queue()
+
+    def attempt(started=None):
+        """Call `func` in its own thread, releasing the call `started`."""
+        with ensure_event_loop():
+            try:
+                results.put((True, func(*args)))
+            except Exception as exc:  # pylint: disable=broad-except
+                results.put((False, exc))
+            finally:
+                # Like the read it hedges, the second call isn't timed.
+                if started is not None:
+                    limiter.release(started, healthy=False)
+
+    threading.Thread(target=attempt, daemon=True).start()
+    attempts = 1
+    try:
+        succeeded, value = results.get(timeout=delay)
+    except queue.Empty:
+        started = None if limiter is None else limiter.acquire(block=False)
+        if limiter is None or started is not None:
+            threading.Thread(
+                target=attempt, args=(started,), daemon=True).start()
+            attempts = 2
+    else:
+        if succeeded:
+            return value
+        # Failing fast isn't a latency problem so it's not hedged.
+        raise value
+    errors = []
+    for _ in range(attempts):
+        succeeded, value = results.get()
+        if succeeded:
+            return value
+        errors.append(value)
+    raise errors[0]
+
+
+class RegionCalls:
+    """Makes the calls to a region.
+
+    Every call goes through the `limiter` of the calls in flight and the
+    circuit `breaker`. Reads are sent again when they take longer than
+    `hedge_after` seconds.
+
+    Reads take as long as the collection they return is large, so they are
+    not timed by the limiter; only the calls share its average latency.
+    """
+
+    def __init__(self, *, breaker=None, limiter=None, hedge_after=None):
+        """Initialize the calls.
+
+        :param breaker: `CircuitBreaker` of the region. A default breaker is
+            used when not provided.
+        :param limiter: `AdaptiveLimiter` of the calls in flight to the
+            region. A default limiter is used when not provided.
+        :param hedge_after: Seconds after which a slow read is sent again.
+            Reads are not hedged when not set.
+        """
+        self.breaker = CircuitBreaker() if breaker is None else breaker
+        self.limiter = AdaptiveLimiter() if limiter is None else limiter
+        self.hedge_after = hedge_after
+
+    def call(self, func, *args, timed=True, **kwargs):
+        """Call `func` through the limiter and circuit breaker.
+
+        :param timed: Count the call as slow when it takes too long. Calls
+            that are expected to be long, like uploads, are not timed.
+        """
+        with self.limiter.limited(timed=timed):
+            return self.breaker.call(func, *args, timed=timed, **kwargs)
+
+    def read(self, func, *args):
+        """Call the idempotent read `func`, hedged after `hedge_after`."""
+        with self.limiter.limited(timed=False):
+            if self.hedge_after is None:
+                return self.breaker.call(func, *args)
+            return self.breaker.call(
+                hedged_call, func, *args, delay=self.hedge_after,
+                limiter=self.limiter)
+
+    def get_metrics(self):
+        """Return the limiter's metrics and whether the circuit is open."""
+        metrics = self.limiter.get_metrics()
+        metrics["circuit_open"] = self.breaker.is_open
+        return metrics
@@ -0,0 +1,339 @@
+# Copyright 2016 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Compile a JSON schema into Python code that validates it."""
+
+import contextlib
+import re
+from collections import namedtuple
+
+
+# Keywords of JSON schema that `compile_schema` supports.
+SUPPORTED_KEYWORDS = frozenset([
+    "additionalProperties",
+    "enum",
+    "items",
+    "maxItems",
+    "minItems",
+    "pattern",
+    "patternProperties",
+    "properties",
+    "required",
+    "type",
+    "uniqueItems",
+])
+
+# Keywords that only apply to a type, which must be given with them.
+TYPE_KEYWORDS = {
+    "object": (
+        "additionalProperties", "patternProperties", "properties",
+        "required"),
+    "array": ("items", "maxItems", "minItems", "uniqueItems"),
+    "string": ("pattern",),
+}
+
+# Python expression that checks the type of `%s`. A schema can give a list
+# of types.
+TYPE_CHECKS = {
+    "array": "isinstance(%s, list)",
+    "boolean": "isinstance(%s, bool)",
+    "integer": "(isinstance(%s, int) and not isinstance(%s, bool))",
+    "null": "%s is None",
+    "number": "(isinstance(%s, (int, float)) and not isinstance(%s, bool))",
+    "object": "isinstance(%s, dict)",
+    "string": "isinstance(%s, str)",
+}
+
+
+# A property of an object being validated: the variables holding its `key`
+# and `value`, and the `path` of the object.
+_Property = namedtuple("_Property", ["key", "value", "path"])
+
+
+class SchemaError(Exception):
+    """Raised when a schema cannot be compiled."""
+
+
+class ValidationError(Exception):
+    """Raised when a document doesn't match the schema.
+
+    :ivar path: Keys and indexes from the root of the document to the value
+        that is invalid.
+    :ivar message: What is wrong with the value.
+    """
+
+    def __init__(self, message, path):
+        super().__init__(message, path)
+        self.message = message
+        self.path = path
+
+    def __str__(self):
+        return "%s: %s" % (format_path(self.path), self.message)
+
+
+def format_path(path):
+    """Return `path` formatted as a JSON pointer."""
+    return "/" + "/".join(
+        str(part).replace("~", "~0").replace("/", "~1") for part in path)
+
+
+def get_types(schema):
+    """Return the types of `schema` once checked it can be compiled."""
+    if not isinstance(schema, dict):
+        raise SchemaError("Schema must be an object: %r" % (schema,))
+    unsupported = set(schema) - SUPPORTED_KEYWORDS
+    if unsupported:
+        raise SchemaError(
+            "Unsupported keywords: %s" % ", ".join(sorted(unsupported)))
+    types = schema.get("type", [])
+    if isinstance(types, str):
+        types = [types]
+    for type_name in types:
+        if type_name not in TYPE_CHECKS:
+            raise SchemaError("Unsupported type: %r" % (type_name,))
+    for type_name, keywords in TYPE_KEYWORDS.items():
+        if type_name not in types and any(
+                keyword in schema for keyword in keywords):
+            raise SchemaError(
+                "Keywords %s need type '%s'" % (
+                    ", ".join(keywords), type_name))
+    return types
+
+
+def _fail(path, message):
+    """Raise `ValidationError` for the value at `path`."""
+    raise ValidationError(message, path)
+
+
+def _has_duplicates(items):
+    """Return True when `items` has the same item more than once."""
+    try:
+        return len(set(items)) != len(items)
+    except TypeError:
+        # Lists and dicts are not hashable.
+        return any(
+            item == other
+            for index, item in enumerate(items)
+            for other in items[index + 1:])
+
+
+class _SchemaCompiler:
+    """Generates the source of a function that validates a schema."""
+
+    def __init__(self):
+        self.lines = []
+        self.constants = {}
+        self.counter = 0
+
+    def new_name(self, prefix):
+        """Return a new variable name starting with `prefix`."""
+        self.counter += 1
+        return "%s%d" % (prefix, self.counter)
+
+    def add_constant(self, prefix, value):
+        """Return the name of a global holding `value`."""
+        name = self.new_name("_%s" % prefix)
+        self.constants[name] = value
+        return name
+
+    def emit(self, indent, line):
+        """Add `line` to the source at `indent` levels."""
+        self.lines.append("    " * indent + line)
+
+    def emit_fail(self, indent, path, message):
+        """Add code that fails at `path` with the `message` expression."""
+        self.emit(indent, "_fail((%s), %s)" % (
+            "".join("%s, " % part for part in path), message))
+
+    def compile(self, schema):
+        """Return the source of a `validate` function for `schema`."""
+        self.emit(0, "def validate(value):")
+        self.compile_node(schema, "value", [], 1)
+        self.emit(1, "return value")
+        return "\n".join(self.lines) + "\n"
+
+    def compile_node(self, schema, var, path, indent):
+        """Add the code that validates `var` with `schema`.
+
+        :param path: Python expressions of the keys from the root to `var`.
+        """
+        types = get_types(schema)
+        self.compile_type(types, var, path, indent)
+        self.compile_enum(schema, var, path, indent)
+        compilers = [
+            ("object", self.compile_object),
+            ("array", self.compile_array),
+            ("string", self.compile_string),
+        ]
+        for type_name, compile_type in compilers:
+            if type_name not in types:
+                continue
+            if len(types) == 1:
+                compile_type(schema, var, path, indent)
+            else:
+                # The keywords of a type only apply to values of that type.
+                self.emit(indent, "if %s:" % self.get_type_check(
+                    type_name, var))
+                with self.block(indent + 1):
+                    compile_type(schema, var, path, indent + 1)
+
+    def get_type_check(self, type_name, var):
+        """Return the expression that checks `var` is of `type_name`."""
+        return TYPE_CHECKS[type_name].replace("%s", var)
+
+    def compile_type(self, types, var, path, indent):
+        """Add the code that checks `var` is one of `types`."""
+        if types:
+            self.emit(indent, "if not (%s):" % " or ".join(
+                self.get_type_check(type_name, var) for type_name in types))
+            self.emit_fail(indent + 1, path, repr(
+                "must be of type %s" % " or ".join(
+                    "'%s'" % type_name for type_name in types)))
+
+    def compile_enum(self, schema, var, path, indent):
+        """Add the code that checks `var` is one of the schema's enum."""
+        if "enum" in schema:
+            enum = self.add_constant("enum", list(schema["enum"]))
+            self.emit(indent, "if %s not in %s:" % (var, enum))
+            self.emit_fail(
+                indent + 1, path, "'%%r is not one of %%r' %% (%s, %s)" % (
+                    var, enum))
+
+    def compile_string(self, schema, var, path, indent):
+        """Add the code that validates the string `var`."""
+        if "pattern" in schema:
+            pattern = self.add_constant(
+                "pattern", re.compile(schema["pattern"]))
+            self.emit(indent, "if %s.search(%s) is None:" % (pattern, var))
+            self.emit_fail(indent + 1, path, repr(
+                "does not match %r" % schema["pattern"]))
+
+    def compile_object(self, schema, var, path, indent):
+        """Add the code that validates the properties of the object `var`."""
+        for name in schema.get("required", []):
+            self.emit(indent, "if %r not in %s:" % (name, var))
+            self.emit_fail(
+                indent + 1, path, repr("%r is a required property" % name))
+        if (not schema.get("properties") and
+                not schema.get("patternProperties") and
+                schema.get("additionalProperties", True) is True):
+            return
+        prop = _Property(self.new_name("key"), self.new_name("value"), path)
+        self.emit(indent, "for %s, %s in %s.items():" % (
+            prop.key, prop.value, var))
+        self.compile_property(schema, prop, indent + 1)
+
+    def compile_property(self, schema, prop, indent):
+        """Add the code that validates the property `prop` of an object."""
+        properties = schema.get("properties", {})
+        patterns = schema.get("patternProperties", {})
+        additional = schema.get("additionalProperties", True)
+        # A property can match its name and any of the patterns, and is
+        # additional when it matches none of them.
+        matched = None
+        if patterns and additional is not True:
+            matched = self.new_name("matched")
+            if properties:
+                known = self.add_constant(
+                    "properties", frozenset(properties))
+                self.emit(indent, "%s = %s in %s" % (matched, prop.key, known))
+            else:
+                self.emit(indent, "%s = False" % matched)
+        for index, (name, subschema) in enumerate(properties.items()):
+            self.emit(indent, "%s %s == %r:" % (
+                "if" if index == 0 else "elif", prop.key, name))
+            self.compile_body(
+                subschema, prop.value, prop.path + [prop.key], indent + 1)
+        if properties and not patterns and additional is not True:
+            self.emit(indent, "else:")
+            self.compile_additional(additional, prop, indent + 1)
+        if patterns:
+            self.compile_patterns(patterns, prop, matched, indent)
+        if matched is not None:
+            self.emit(indent, "if not %s:" % matched)
+            self.compile_additional(additional, prop, indent + 1)
+        elif not properties and additional is not True:
+            self.compile_additional(additional, prop, indent)
+
+    def compile_patterns(self, patterns, prop, matched, indent):
+        """Add the code that validates `prop` with the matching `patterns`.
+
+        :param matched: Variable set when a pattern matches, None when the
+            matches aren't tracked.
+        """
+        self.emit(indent, "if not isinstance(%s, str):" % prop.key)
+        self.emit_fail(
+            indent + 1, prop.path,
+            "'property name %%r is not a string' %% (%s,)" % prop.key)
+        for pattern, subschema in patterns.items():
+            regex = self.add_constant("pattern", re.compile(pattern))
+            self.emit(
+                indent, "if %s.search(%s) is not None:" % (regex, prop.key))
+            if matched is not None:
+                self.emit(indent + 1, "%s = True" % matched)
+            self.compile_body(
+                subschema, prop.value, prop.path + [prop.key], indent + 1)
+
+    def compile_additional(self, additional, prop, indent):
+        """Add the code that validates the additional property `prop`."""
+        if additional is False:
+            self.emit_fail(
+                indent, prop.path,
+                "'additional property %%r is not allowed' %% (%s,)" % (
+                    prop.key))
+        else:
+            self.compile_body(
+                additional, prop.value, prop.path + [prop.key], indent)
+
+    def compile_array(self, schema, var, path, indent):
+        """Add the code that validates the items of the array `var`."""
+        if "minItems" in schema:
+            self.emit(indent, "if len(%s) < %d:" % (var, schema["minItems"]))
+            self.emit_fail(indent + 1, path, repr(
+                "must have at least %d items" % schema["minItems"]))
+        if "maxItems" in schema:
+            self.emit(indent, "if len(%s) > %d:" % (var, schema["maxItems"]))
+            self.emit_fail(indent + 1, path, repr(
+                "must have at most %d items" % schema["maxItems"]))
+        if "items" in schema:
+            index, item = self.new_name("index"), self.new_name("item")
+            self.emit(
+                indent, "for %s, %s in enumerate(%s):" % (index, item, var))
+            self.compile_body(
+                schema["items"], item, path + [index], indent + 1)
+        if schema.get("uniqueItems"):
+            self.emit(indent, "if _has_duplicates(%s):" % var)
+            self.emit_fail(indent + 1, path, repr("has non-unique items"))
+
+    @contextlib.contextmanager
+    def block(self, indent):
+        """Add `pass` when no code is added to the block at `indent`."""
+        start = len(self.lines)
+        yield
+        if len(self.lines) == start:
+            self.emit(indent, "pass")
+
+    def compile_body(self, schema, var, path, indent):
+        """Add the code that validates `var` as the body of a block."""
+        with self.block(indent):
+            self.compile_node(schema, var, path, indent)
+
+
+def compile_schema(schema):
+    """Return a function that validates a document with `schema`.
+
+    The schema is turned into Python code once, with its regular expressions
+    compiled, so validating a document only costs a pass over it. The
+    function returns the document or raises `ValidationError` with the path
+    of the first invalid value. Only the keywords in `SUPPORTED_KEYWORDS`
+    can be used.
+    """
+    compiler = _SchemaCompiler()
+    source = compiler.compile(schema)
+    namespace = dict(
+        compiler.constants, _fail=_fail, _has_duplicates=_has_duplicates)
+    # pylint: disable=exec-used
+    exec(compile(source, "<schema>", "exec"), namespace)
+    validate = namespace["validate"]
+    validate.source = source
+    return validate
@@ -0,0 +1,87 @@
+# Copyright 2016 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Deterministic partitioning of regions across multiple meta-MAAS hosts."""
+
+import bisect
+import hashlib
+import re
+
+
+# Number of points each shard places on the hash ring. More points give a
+# more even spread of regions across the shards.
+SHARD_REPLICAS = 128
+
+
+class ShardError(Exception):
+    """Raised when a shard specification is invalid."""
+
+
+def parse_shard(value):
+    """Parse a shard specification in the form 'i/N'.
+
+    `i` is the 1-based index of this shard and `N` the total number of
+    shards. Returns the tuple `(i, N)`.
+    """
+    match = re.match(r"^(\d+)/(\d+)$", value.strip())
+    if match is None:
+        raise ShardError(
+            "Invalid shard '%s'; must be in the form i/N." % value)
+    index, count = int(match.group(1)), int(match.group(2))
+    if count < 1 or index < 1 or index > count:
+        raise ShardError(
+            "Invalid shard '%s'; i must be between 1 and N." % value)
+    return index, count
+
+
+def _hash(key):
+    """Return the position of `key` on the hash ring."""
+    return int(hashlib.md5(key.encode("utf-8")).hexdigest()[:16], 16)
+
+
+# A class so the points are sorted once and then looked up for every
+# region name.
+class HashRing:  # pylint: disable=too-few-public-methods
+    """Consistent hash ring mapping keys to shards.
+
+    Every shard owns `replicas` points on the ring and a key belongs to the
+    shard owning the first point at or after the key's position. Adding or
+    removing a shard only moves the keys that land next to its points, so
+    growing the number of hosts only moves a fraction of the regions.
+    """
+
+    def __init__(self, count, *, replicas=SHARD_REPLICAS):
+        """Initialize the ring for `count` shards."""
+        points = sorted(
+            (_hash("shard-%d-%d" % (shard, replica)), shard)
+            for shard in range(1, count + 1)
+            for replica in range(replicas)
+        )
+        self.count = count
+        self._positions = [position for position, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def get_shard(self, key):
+        """Return the 1-based shard that owns `key`."""
+        idx = bisect.bisect_left(self._positions, _hash(key))
+        if idx == len(self._positions):
+            idx = 0
+        return self._shards[idx]
+
+
+def select_shard(names, shard):
+    """Return the `names` that belong to `shard`.
+
+    :param names: Iterable of region names.
+    :param shard: Tuple `(i, N)` as returned by `parse_shard`, or None to
+        select every name.
+    """
+    if shard is None:
+        return list(names)
+    index, count = shard
+    ring = HashRing(count)
+    return [
+        name
+        for name in names
+        if ring.get_shard(name) == index
+    ]
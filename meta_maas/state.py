@@ -0,0 +1,45 @@
+# Copyright 2016 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Location of the local state kept between runs."""
+
+import contextlib
+import os
+
+
+def get_cache_dir(*parts):
+    """Return the cache directory joined with `parts`, creating it.
+
+    Uses $SNAP_USER_COMMON when running in a snap, otherwise
+    $XDG_CACHE_HOME or ~/.cache.
+    """
+    if "SNAP_USER_COMMON" in os.environ:
+        base = os.environ["SNAP_USER_COMMON"]
+    else:
+        base = os.environ.get(
+            "XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    path = os.path.join(base, "meta-maas", *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+@contextlib.contextmanager
+def write_atomically(path, mode="w"):
+    """Open `path` to be written, only replacing it once fully written.
+
+    The stream writes to `path` with ".part" appended, which is renamed to
+    `path` once the body of the `with` completes. A run killed while writing
+    never leaves a partial file at `path`; the partial file is removed when
+    the body raises.
+    """
+    partial_path = path + ".part"
+    try:
+        with open(partial_path, mode) as stream:
+            yield stream
+    except BaseException:
+        try:
+            os.remove(partial_path)
+        except FileNotFoundError:
+            pass
+        raise
+    os.rename(partial_path, path)
@@ -0,0 +1,14 @@
+# Copyright 2016 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Fixtures shared by the tests."""
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def cache_home(tmpdir, monkeypatch):
+    """Keep the cache of every test in its own temporary directory."""
+    monkeypatch.delenv("SNAP_USER_COMMON", raising=False)
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmpdir.join("cache")))
+    return tmpdir.join("cache")
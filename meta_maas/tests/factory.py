@@ -0,0 +1,21 @@
+# Copyright 2016 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Helpers shared by the tests of `region.py`."""
+
+from unittest.mock import MagicMock, Mock
+
+from ..imports import ImportCoordinator
+from ..region import Region
+
+
+def make_Region():
+    """Make a `Region`.
+
+    `origin` and `message` are pre-mocked.
+    """
+    region = Region('region1', 'http://localhost:5240/MAAS', 'apikey1')
+    region.origin = MagicMock()
+    region.imports = ImportCoordinator(region.origin)
+    region.message = Mock()
+    return region
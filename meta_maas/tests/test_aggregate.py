@@ -0,0 +1,50 @@
+# Copyright 2016 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for `aggregate.py`."""
+
+from ..aggregate import UNKNOWN, MachineColumns, merge_aggregates, to_chart
+
+
+def test_MachineColumns_interns_values():
+    """MachineColumns stores each distinct value once."""
+    columns = MachineColumns({"status": "status_name", "zone": "zone"})
+    for status in ["New", "Ready", "New", "New"]:
+        columns.append({"status_name": status, "zone": {"name": "default"}})
+    assert columns.count == 4
+    assert columns.values["status"] == ["New", "Ready"]
+    assert list(columns.columns["status"]) == [0, 1, 0, 0]
+    assert columns.values["zone"] == ["default"]
+    assert columns.counts("status") == {"New": 3, "Ready": 1}
+
+
+def test_MachineColumns_counts_missing_values_as_unknown():
+    """MachineColumns counts machines without a value as unknown."""
+    columns = MachineColumns({"pool": "pool"})
+    columns.append({"pool": None})
+    columns.append({})
+    assert columns.counts("pool") == {UNKNOWN: 2}
+
+
+def test_MachineColumns_aggregate_returns_chart_for_each_dimension():
+    """MachineColumns.aggregate returns the chart data of every dimension."""
+    columns = MachineColumns({"status": "status_name", "power": "power_state"})
+    columns.append({"status_name": "Ready", "power_state": "off"})
+    columns.append({"status_name": "Deployed", "power_state": "on"})
+    columns.append({"status_name": "Deployed", "power_state": "on"})
+    assert columns.aggregate() == {
+        "status": {"data": [2, 1], "labels": ["Deployed", "Ready"]},
+        "power": {"data": [1, 2], "labels": ["off", "on"]},
+    }
+
+
+def test_merge_aggregates_sums_every_dimension():
+    """merge_aggregates sums the counts of every dimension."""
+    merged = merge_aggregates([
+        {"status": to_chart({"New": 1, "Ready": 2})},
+        {"status": to_chart({"Ready": 1}), "zone": to_chart({"z1": 1})},
+    ])
+    assert merged == {
+        "status": {"data": [1, 3], "labels": ["New", "Ready"]},
+        "zone": {"data": [1], "labels": ["z1"]},
+    }
@@ -0,0 +1,127 @@
+# Copyright 2016 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for `assets.py`."""
+
+import gzip
+from unittest.mock import Mock
+
+from .. import assets as assets_module
+from ..assets import (
+    build_assets,
+    get_fingerprinted_name,
+    gzip_compress,
+    resolve_reference,
+    rewrite_references,
+    write_asset
+)
+
+
+def make_html_tree(tmpdir):
+    """Make a source tree with an entry point, a stylesheet and assets."""
+    src = tmpdir.mkdir("src")
+    src.mkdir("assets").join("font.woff").write_binary(b"font")
+    src.join("assets", "logo.svg").write_binary(b"<svg/>")
+    src.mkdir("libs").join("app.css").write(
+        "@font-face { src: url('../assets/font.woff?#iefix'); }\n"
+        "body { background: url(../assets/logo.svg); }\n")
+    src.join("libs", "app.js").write("var app;")
+    src.join("index.html").write(
+        '<link href="libs/app.css" />'
+        '<script src="libs/app.js"></script>'
+        '<script src="data.js"></script>'
+        '<a href="http://example.com/">link</a>')
+    return src
+
+
+def test_get_fingerprinted_name_adds_content_hash():
+    """get_fingerprinted_name adds the hash of the content to the name."""
+    name = get_fingerprinted_name("libs/app.js", b"content")
+    assert name.startswith("libs/app.")
+    assert name.endswith(".js")
+    assert name != get_fingerprinted_name("libs/app.js", b"changed")
+
+
+def test_resolve_reference_keeps_suffix_and_relative_path():
+    """resolve_reference resolves relative to the asset and keeps suffix."""
+    manifest = {"assets/font.woff": "assets/font.abc.woff"}
+    assert resolve_reference(
+        "../assets/font.woff?#iefix", "libs/app.css", manifest) == (
+            "../assets/font.abc.woff?#iefix")
+
+
+def test_resolve_reference_ignores_external_and_unknown():
+    """resolve_reference leaves external and unknown references unchanged."""
+    manifest = {"data.js": "data.abc.js"}
+    for reference in ["http://example.com/data.js", "/data.js", "#nav"]:
+        assert resolve_reference(reference, "index.html", manifest) == (
+            reference)
+    assert resolve_reference("other.js", "index.html", manifest) == (
+        "other.js")
+
+
+def test_rewrite_references_rewrites_css_urls():
+    """rewrite_references rewrites the urls in a stylesheet."""
+    manifest = {"assets/logo.svg": "assets/logo.abc.svg"}
+    assert rewrite_references(
+        "a { background: url('../assets/logo.svg'); }",
+        "libs/app.css", manifest) == (
+            "a { background: url('../assets/logo.abc.svg'); }")
+
+
+def test_gzip_compress_has_no_mtime():
+    """gzip_compress zeroes the mtime so the output is the same every run."""
+    compressed = gzip_compress(b"var app;")
+    assert compressed[4:8] == b"\0\0\0\0"
+    assert gzip.decompress(compressed) == b"var app;"
+
+
+def test_write_asset_writes_precompressed_siblings(tmpdir, monkeypatch):
+    """write_asset writes gzip and brotli versions of the asset."""
+    monkeypatch.setattr(
+        assets_module, "brotli", Mock(compress=lambda _data: b"br"))
+    path = tmpdir.join("app.js")
+    write_asset(str(path), b"var app;")
+    assert path.read_binary() == b"var app;"
+    assert gzip.decompress(
+        tmpdir.join("app.js.gz").read_binary()) == b"var app;"
+    assert tmpdir.join("app.js.br").read_binary() == b"br"
+    assert tmpdir.join("app.js.part").check() is False
+
+
+def test_write_asset_skips_compressed_assets(tmpdir):
+    """write_asset doesn't precompress assets that are already compressed."""
+    path = tmpdir.join("font.woff")
+    write_asset(str(path), b"font")
+    assert tmpdir.join("font.woff.gz").check() is False
+
+
+def test_build_assets_fingerprints_and_rewrites_references(tmpdir):
+    """build_assets fingerprints every asset and rewrites references."""
+    src = make_html_tree(tmpdir)
+    dst = tmpdir.join("dst")
+    manifest = build_assets(str(src), str(dst))
+    assert sorted(manifest) == [
+        "assets/font.woff", "assets/logo.svg", "libs/app.css", "libs/app.js"]
+    for path in manifest.values():
+        assert dst.join(path).check() is True
+    css = dst.join(manifest["libs/app.css"]).read()
+    assert "../%s?#iefix" % manifest["assets/font.woff"] in css
+    assert "../%s)" % manifest["assets/logo.svg"] in css
+    index = dst.join("index.html").read()
+    assert 'href="%s"' % manifest["libs/app.css"] in index
+    assert 'src="%s"' % manifest["libs/app.js"] in index
+    assert 'src="data.js"' in index
+    assert 'href="http://example.com/"' in index
+    assert dst.join("index.html.gz").check() is True
+
+
+def test_build_assets_changes_name_of_referencing_asset(tmpdir):
+    """build_assets changes the stylesheet's name when a font changes."""
+    src = make_html_tree(tmpdir)
+    first = build_assets(str(src), str(tmpdir.join("dst")))
+    src.join("assets", "font.woff").write_binary(b"new font")
+    second = build_assets(str(src), str(tmpdir.join("dst")))
+    assert first["libs/app.js"] == second["libs/app.js"]
+    assert first["assets/font.woff"] != second["assets/font.woff"]
+    assert first["libs/app.css"] != second["libs/app.css"]
@@ -0,0 +1,148 @@
+# Copyright 2016 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for `changelog.py`."""
+
+import json
+from unittest.mock import MagicMock, call
+
+import pytest
+from maas.client.bones import CallError
+
+from ..changelog import START, Changelog, ChangelogError, Watermark
+from ..region import MessageLevel
+from .factory import make_Region
+
+
+def make_change(seq, username):
+    """Return the changelog line of user `username`."""
+    return json.dumps({
+        "seq": seq, "username": username,
+        "email": "%s@localhost" % username, "password": "pass",
+    }) + "\n"
+
+
+def make_Changelog(tmpdir, *lines):
+    """Make a `Changelog` of `lines` in `tmpdir`."""
+    path = tmpdir.join("users.changelog")
+    path.write("".join(lines))
+    return Changelog(str(path), str(tmpdir.mkdir("watermarks")))
+
+
+def test_Changelog_iter_changes_from_start(tmpdir):
+    """iter_changes yields every change with its watermark."""
+    first = make_change(1, "admin")
+    changelog = make_Changelog(tmpdir, first, make_change(2, "bob"))
+    changes = list(changelog.iter_changes(START))
+    assert [change.username for change in changes] == ["admin", "bob"]
+    assert changes[0].watermark == Watermark(1, len(first))
+    assert changes[0].data == {
+        "email": "admin@localhost", "password": "pass"}
+
+
+def test_Changelog_iter_changes_after_watermark(tmpdir):
+    """iter_changes only reads the changes after the watermark."""
+    first = make_change(1, "admin")
+    changelog = make_Changelog(tmpdir, first, make_change(2, "bob"))
+    changes = list(changelog.iter_changes(Watermark(1, len(first))))
+    assert [change.username for change in changes] == ["bob"]
+
+
+def test_Changelog_iter_changes_leaves_partial_line(tmpdir):
+    """A last line that is still being written is left for later."""
+    changelog = make_Changelog(
+        tmpdir, make_change(1, "admin"), make_change(2, "bob")[:10])
+    changes = list(changelog.iter_changes(START))
+    assert [change.username for change in changes] == ["admin"]
+
+
+def test_Changelog_iter_changes_rereads_rewritten_changelog(tmpdir):
+    """A rewritten changelog is read again, skipping applied changes."""
+    changelog = make_Changelog(
+        tmpdir, make_change(5, "admin"), make_change(6, "bob"))
+    changes = list(changelog.iter_changes(Watermark(5, 1000)))
+    assert [change.username for change in changes] == ["bob"]
+
+
+def test_Changelog_iter_changes_raises_ChangelogError_when_invalid(tmpdir):
+    """An invalid change raises `ChangelogError` with its position."""
+    first = make_change(1, "admin")
+    changelog = make_Changelog(
+        tmpdir, first, json.dumps({"seq": 2, "username": "bob"}) + "\n")
+    with pytest.raises(ChangelogError) as exc:
+        list(changelog.iter_changes(START))
+    assert str(exc.value) == (
+        "Invalid change in %s at byte %d: /: 'email' is a required "
+        "property" % (changelog.path, len(first)))
+
+
+def test_Changelog_watermark_is_kept_per_region(tmpdir):
+    """The watermark of each region is kept separately."""
+    changelog = make_Changelog(tmpdir)
+    assert changelog.get_watermark("region1") == START
+    changelog.set_watermark("region1", Watermark(3, 100))
+    assert changelog.get_watermark("region1") == Watermark(3, 100)
+    assert changelog.get_watermark("region2") == START
+    assert Changelog(
+        changelog.path, changelog.directory).get_watermark(
+            "region1") == Watermark(3, 100)
+
+
+def test_Region_sync_user_changes_creates_users_since_watermark(tmpdir):
+    """Region.sync_user_changes only creates the users added since the
+    watermark, without reading the region's users."""
+    changelog = make_Changelog(
+        tmpdir, make_change(1, "admin"), make_change(2, "bob"))
+    region = make_Region()
+    region.sync_user_changes(changelog)
+    assert region.origin.Users.read.called is False
+    assert region.origin.Users.create.call_args_list == [
+        call('admin', 'pass', email='admin@localhost', is_admin=False),
+        call('bob', 'pass', email='bob@localhost', is_admin=False),
+    ]
+    assert changelog.get_watermark(region.name).seq == 2
+    region.origin.Users.create.reset_mock()
+    region.sync_user_changes(changelog)
+    assert region.origin.Users.create.called is False
+
+
+def test_Region_sync_user_changes_skips_user_that_cannot_be_created(tmpdir):
+    """Region.sync_user_changes warns about a user that already exists."""
+    changelog = make_Changelog(
+        tmpdir, make_change(1, "admin"), make_change(2, "bob"))
+    region = make_Region()
+    response = MagicMock()
+    response.status = 400
+    region.origin.Users.create.side_effect = [
+        CallError(MagicMock(), response, b"User already exists.", None),
+        None]
+    region.sync_user_changes(changelog)
+    assert region.origin.Users.create.call_count == 2
+    assert changelog.get_watermark(region.name).seq == 2
+    assert call(
+        "created user 'bob'.", level=MessageLevel.SUCCESS) in (
+            region.message.call_args_list)
+
+
+def test_Region_sync_user_changes_keeps_watermark_when_failing(tmpdir):
+    """Region.sync_user_changes keeps the watermark of the last change
+    applied when the region fails."""
+    changelog = make_Changelog(
+        tmpdir, make_change(1, "admin"), make_change(2, "bob"))
+    region = make_Region()
+    region.origin.Users.create.side_effect = [None, ConnectionRefusedError()]
+    with pytest.raises(ConnectionRefusedError):
+        region.sync_user_changes(changelog)
+    assert changelog.get_watermark(region.name).seq == 1
+
+
+def test_Region_sync_applies_changelog(tmpdir):
+    """Region.sync creates the users from the changelog, not `users`."""
+    changelog = make_Changelog(tmpdir, make_change(1, "admin"))
+    region = make_Region()
+    region.sync(
+        {'bob': {'password': 'pass'}}, {}, start_import=False,
+        changelog=changelog)
+    assert region.origin.Users.create.call_args_list == [
+        call('admin', 'pass', email='admin@localhost', is_admin=False)]
+    assert region.origin.Users.read.called is False
@@ -0,0 +1,206 @@
+# Copyright 2016 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for `check.py`."""
+
+from unittest.mock import MagicMock
+
+from ..check import (
+    CRITICAL,
+    OK,
+    UNKNOWN,
+    RegionCheck,
+    check_region,
+    check_regions,
+    diff_custom,
+    diff_selections,
+    diff_users,
+    find_source,
+    format_error,
+    format_summary,
+    get_status
+)
+from ..config import ConfigError
+
+
+SOURCE = {
+    'url': 'http://images.maas.io/ephemeral-v3/daily/',
+    'keyring_filename': '/path/to/keyring',
+    'selections': {
+        'ubuntu': {
+            'releases': ['trusty', 'xenial'],
+            'arches': ['amd64', 'i386'],
+        },
+    },
+}
+
+
+def make_object(**attrs):
+    """Make a region object with `attrs`."""
+    obj = MagicMock()
+    for name, value in attrs.items():
+        setattr(obj, name, value)
+    return obj
+
+
+def make_check_region(name="region"):
+    """Make a region that matches `SOURCE` and has the user admin."""
+    region = MagicMock()
+    region.name = name
+    source = make_object(
+        url=SOURCE['url'], keyring_filename=SOURCE['keyring_filename'])
+    region.read_users.return_value = [make_object(username="admin")]
+    region.read_boot_sources.return_value = [source]
+    region.read_selections.return_value = [
+        make_object(os="ubuntu", release=release, arches=["i386", "amd64"])
+        for release in ["trusty", "xenial"]
+    ]
+    region.read_boot_resources.return_value = [
+        make_object(name="custom/image", architecture="amd64/generic")]
+    return region
+
+
+def test_diff_users_reports_missing_users():
+    """diff_users reports the configured users missing on the region."""
+    region_users = [make_object(username="admin")]
+    assert diff_users({"admin": {}, "bob": {}}, region_users) == [
+        "missing users: bob"]
+    assert diff_users(None, region_users) == []
+
+
+def test_diff_users_reads_users_file(tmpdir):
+    """diff_users reports the users in the users file missing."""
+    path = tmpdir.join("users.csv")
+    path.write(
+        "username,email,password\n"
+        "admin,admin@localhost,pass\n"
+        "bob,bob@localhost,pass\n")
+    region_users = [make_object(username="admin")]
+    assert diff_users(str(path), region_users) == ["missing users: bob"]
+
+
+def test_diff_users_counts_missing_users_not_shown():
+    """diff_users only names the first missing users and counts the rest."""
+    users = {"user%02d" % i: {} for i in range(12)}
+    assert diff_users(users, []) == [
+        "missing users: user00, user01, user02, user03, user04 and 7 more"]
+
+
+def test_find_source_reports_unexpected_and_keyring():
+    """find_source reports other sources and a different keyring."""
+    matching = make_object(url=SOURCE['url'], keyring_filename="/other")
+    other = make_object(url="http://other/", keyring_filename="/other")
+    assert find_source(SOURCE, [other, matching]) == (matching, [
+        "unexpected source 'http://other/'",
+        "source keyring differs: '/other'",
+    ])
+
+
+def test_find_source_reports_missing_source():
+    """find_source reports the source missing on the region."""
+    assert find_source(SOURCE, []) == (None, [
+        "missing source '%s'" % SOURCE['url']])
+
+
+def test_diff_selections_reports_every_difference():
+    """diff_selections reports missing, unexpected and different arches."""
+    region_selections = [
+        make_object(os="ubuntu", release="trusty", arches=["amd64"]),
+        make_object(os="centos", release="centos70", arches=["amd64"]),
+    ]
+    assert diff_selections(SOURCE['selections'], region_selections) == [
+        "selection ubuntu/trusty arches differ: amd64",
+        "unexpected selection centos/centos70",
+        "missing selection ubuntu/xenial",
+    ]
+
+
+def test_diff_custom_reports_missing_and_architecture():
+    """diff_custom reports missing images and a different architecture."""
+    resources = [make_object(name="custom/one", architecture="i386/generic")]
+    custom = {
+        "one": {"architecture": "amd64/generic"},
+        "two": {"architecture": "amd64/generic"},
+    }
+    assert diff_custom(custom, resources) == [
+        "custom/one architecture differs: i386/generic",
+        "missing custom/two",
+    ]
+
+
+def test_check_region_reads_without_writing():
+    """check_region reports no drift for a region in sync and doesn't write."""
+    region = make_check_region()
+    images = {
+        'source': SOURCE,
+        'custom': {'image': {'architecture': 'amd64/generic'}},
+    }
+    assert check_region(region, {"admin": {}}, images) == RegionCheck(
+        "region", [], None)
+    assert region.connect.called is True
+    assert region.sync.called is False
+    assert region.origin.mock_calls == []
+
+
+def test_check_region_returns_error_when_region_fails():
+    """check_region returns the error when the region cannot be read."""
+    region = make_check_region()
+    region.connect.side_effect = ConnectionRefusedError("refused")
+    assert check_region(region, {}, {}) == RegionCheck(
+        "region", [], "refused")
+
+
+def test_check_region_doesnt_read_users_without_users():
+    """check_region doesn't read the region's users without users."""
+    region = make_check_region()
+    assert check_region(region, None, {}) == RegionCheck("region", [], None)
+    assert region.read_users.called is False
+
+
+def test_check_regions_checks_every_region():
+    """check_regions returns the check of every region."""
+    regions = [make_check_region("region%d" % i) for i in range(3)]
+    regions[1].read_users.return_value = []
+    checks = check_regions(regions, {"admin": {}}, None, jobs=3)
+    assert checks == [
+        RegionCheck("region0", [], None),
+        RegionCheck("region1", ["missing users: admin"], None),
+        RegionCheck("region2", [], None),
+    ]
+
+
+def test_get_status_returns_nagios_status():
+    """get_status returns critical for drift and unknown for errors."""
+    in_sync = RegionCheck("one", [], None)
+    drifted = RegionCheck("two", ["missing users: bob"], None)
+    failed = RegionCheck("three", [], "refused")
+    assert get_status([in_sync]) == OK
+    assert get_status([in_sync, failed]) == UNKNOWN
+    assert get_status([in_sync, drifted, failed]) == CRITICAL
+
+
+def test_format_summary_lists_regions_with_problems():
+    """format_summary outputs the status and a line per region."""
+    checks = [
+        RegionCheck("one", [], None),
+        RegionCheck("two", ["missing users: bob", "missing custom/x"], None),
+        RegionCheck("three", [], "refused"),
+    ]
+    assert format_summary(checks) == "\n".join([
+        "META-MAAS CRITICAL - 1 of 3 regions drifted, 1 unknown | "
+        "regions=3 drifted=1 unknown=1",
+        "three: UNKNOWN refused",
+        "two: missing users: bob; missing custom/x",
+    ])
+
+
+def test_format_error_is_one_unknown_line():
+    """format_error returns a single UNKNOWN line with the cause."""
+    try:
+        try:
+            raise ValueError("bad\nyaml")
+        except ValueError as exc:
+            raise ConfigError("Unable to load config: /my/config") from exc
+    except ConfigError as exc:
+        assert format_error(exc) == (
+            "META-MAAS UNKNOWN - Unable to load config: /my/config: bad yaml")
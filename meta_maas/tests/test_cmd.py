@@ -3,14 +3,40 @@
 
 """Tests for `cmd.py`."""
 
+import json
 import sys
-from unittest.mock import MagicMock, Mock, call, sentinel
+from unittest.mock import ANY, MagicMock, Mock, call, sentinel
 
 import colorclass
+import pytest
 
 from .. import cmd as cmd_module
-from ..cmd import main, parse_args
-from ..config import SAMPLE_CONFIG
+from ..check import CRITICAL, OK, UNKNOWN, RegionCheck
+from ..cmd import main, parse_args, parse_export_args, parse_mirror_args
+from ..config import SAMPLE_CONFIG, ConfigError
+from ..mirror import MirrorError
+
+
+@pytest.fixture(name="history_class", autouse=True)
+def fixture_history_class(monkeypatch):
+    """Replace `History`, as the regions in these tests are mocks."""
+    history_class = MagicMock()
+    history_class.return_value.order_regions.side_effect = (
+        lambda regions, images: regions)
+    monkeypatch.setattr(cmd_module, "History", history_class)
+    return history_class
+
+
+@pytest.fixture(name="fingerprints_class", autouse=True)
+def fixture_fingerprints_class(monkeypatch):
+    """Replace `Fingerprints` so no region is converged."""
+    fingerprints_class = MagicMock()
+    fingerprints_class.return_value.is_converged.return_value = False
+    monkeypatch.setattr(cmd_module, "Fingerprints", fingerprints_class)
+    monkeypatch.setattr(
+        cmd_module, "get_desired_fingerprint",
+        lambda *args: sentinel.desired)
+    return fingerprints_class
 
 
 def test_parse_args_handles_all_long_arguments():
@@ -23,12 +49,40 @@ def test_parse_args_handles_all_long_arguments():
         "--no-color",
         "--sample",
         "--report", report_path,
+        "--report-data", "/my/test/data.json",
+        "--shard", "2/3",
+        "--jobs", "4",
+        "--report-timeout", "5",
+        "--breaker-failures", "3",
+        "--breaker-window", "30",
+        "--slow-call", "10",
+        "--hedge-after", "2",
     ])
     assert args.config == config_path
     assert args.quiet is True
     assert args.no_color is True
     assert args.sample is True
     assert args.report == report_path
+    assert args.report_data == "/my/test/data.json"
+    assert args.shard == (2, 3)
+    assert args.jobs == 4
+    assert args.report_timeout == 5
+    assert args.breaker_failures == 3
+    assert args.breaker_window == 30
+    assert args.slow_call == 10
+    assert args.hedge_after == 2
+
+
+def test_parse_args_exits_on_invalid_shard():
+    """parse_args exits when --shard is invalid."""
+    with pytest.raises(SystemExit):
+        parse_args(["--shard", "4/3"])
+
+
+def test_parse_args_exits_on_merge_report_without_report():
+    """parse_args exits when --merge-report is passed without --report."""
+    with pytest.raises(SystemExit):
+        parse_args(["--merge-report", "/my/shard.json"])
 
 
 def test_parse_args_handles_all_short_arguments():
@@ -43,6 +97,7 @@ def test_parse_args_handles_all_short_arguments():
     assert args.config == config_path
     assert args.quiet is True
     assert args.report == report_path
+    assert args.jobs == 1
 
 
 def test_main_uses_sys_argv(monkeypatch):
@@ -112,15 +167,158 @@ def test_main_creates_regions_and_calls_connect_and_sync(monkeypatch):
     region_class.return_value = region_obj
     monkeypatch.setattr(cmd_module, "Region", region_class)
     monkeypatch.setattr(cmd_module, "load_config", lambda _path: config)
+    monkeypatch.setattr(cmd_module, "prepare_images", lambda images: images)
     main(['--quiet'])
     assert region_class.call_args_list == [
-        call('region1', 'http://region1:5240/MAAS', 'apikey1', quiet=True),
-        call('region2', 'http://region2:5240/MAAS', 'apikey2', quiet=True),
+        call(
+            'region1', 'http://region1:5240/MAAS', 'apikey1', events=None,
+            calls=ANY),
+        call(
+            'region2', 'http://region2:5240/MAAS', 'apikey2', events=None,
+            calls=ANY),
     ]
     assert region_obj.connect.call_args_list == [call(), call()]
     assert region_obj.sync.call_args_list == [
-        call(sentinel.users, sentinel.images),
-        call(sentinel.users, sentinel.images)]
+        call(
+            sentinel.users, sentinel.images, start_import=True,
+            changelog=None, journal=ANY),
+        call(
+            sentinel.users, sentinel.images, start_import=True,
+            changelog=None, journal=ANY)]
+
+
+def test_main_syncs_users_changelog(tmpdir, monkeypatch):
+    """Passes the `Changelog` of `users_changelog` to each region."""
+    config = {
+        'regions': {
+            'region1': {
+                'url': 'http://region1:5240/MAAS',
+                'apikey': 'apikey1',
+            },
+        },
+        'users_changelog': str(tmpdir.join("users.changelog")),
+    }
+    region_obj = MagicMock()
+    monkeypatch.setattr(
+        cmd_module, "Region", MagicMock(return_value=region_obj))
+    monkeypatch.setattr(cmd_module, "load_config", lambda _path: config)
+    monkeypatch.setattr(cmd_module, "prepare_images", lambda images: images)
+    main(['--quiet'])
+    changelog = region_obj.sync.call_args[1]['changelog']
+    assert changelog.path == config['users_changelog']
+
+
+def test_main_writes_metrics(tmpdir, monkeypatch):
+    """Writes the metrics of each region with --metrics."""
+    config = {
+        'regions': {
+            'region1': {
+                'url': 'http://region1:5240/MAAS',
+                'apikey': 'apikey1',
+            },
+        },
+    }
+    region_obj = MagicMock()
+    region_obj.name = 'region1'
+    region_obj.get_metrics.return_value = {'concurrency_limit': 3}
+    region_class = MagicMock(return_value=region_obj)
+    monkeypatch.setattr(cmd_module, "Region", region_class)
+    monkeypatch.setattr(cmd_module, "load_config", lambda _path: config)
+    monkeypatch.setattr(cmd_module, "prepare_images", lambda images: images)
+    path = tmpdir.join("metrics.json")
+    main(['--quiet', '--metrics', str(path), '--region-calls', '4'])
+    assert json.loads(path.read()) == {
+        'regions': {'region1': {'concurrency_limit': 3}}}
+    calls = region_class.call_args[1]['calls']
+    assert calls.limiter.max_limit == 4
+
+
+def test_main_syncs_most_expensive_regions_first(
+        monkeypatch, history_class):
+    """Syncs the regions in the order of their cost and records their
+    history once synced."""
+    config = {
+        'regions': {
+            'region1': {
+                'url': 'http://region1:5240/MAAS',
+                'apikey': 'apikey1',
+            },
+            'region2': {
+                'url': 'http://region2:5240/MAAS',
+                'apikey': 'apikey2',
+            },
+        },
+    }
+    regions = {}
+
+    def make_region(name, *_args, **_kwargs):
+        """Make a mock region."""
+        regions[name] = MagicMock()
+        regions[name].name = name
+        return regions[name]
+
+    synced = []
+    monkeypatch.setattr(
+        cmd_module, "Region", MagicMock(side_effect=make_region))
+    monkeypatch.setattr(cmd_module, "load_config", lambda _path: config)
+    monkeypatch.setattr(cmd_module, "prepare_images", lambda images: images)
+    history = history_class.return_value
+    history.order_regions.side_effect = (
+        lambda regions, images: list(reversed(regions)))
+    history.record.side_effect = lambda region: synced.append(region.name)
+    main(['--quiet'])
+    assert synced == ['region2', 'region1']
+
+
+def test_main_skips_converged_regions(monkeypatch, fingerprints_class):
+    """Skips the converged regions unless --force is given."""
+    config = {
+        'regions': {
+            'region1': {
+                'url': 'http://region1:5240/MAAS',
+                'apikey': 'apikey1',
+            },
+        },
+    }
+    region_obj = MagicMock()
+    monkeypatch.setattr(
+        cmd_module, "Region", MagicMock(return_value=region_obj))
+    monkeypatch.setattr(cmd_module, "load_config", lambda _path: config)
+    monkeypatch.setattr(cmd_module, "prepare_images", lambda images: images)
+    fingerprints = fingerprints_class.return_value
+    fingerprints.is_converged.return_value = True
+    main(['--quiet', '--converged-ttl', '600'])
+    assert fingerprints_class.call_args == call(ANY, ttl=600)
+    assert region_obj.skip.called is True
+    assert region_obj.sync.called is False
+    main(['--quiet', '--force'])
+    assert region_obj.sync.called is True
+    assert fingerprints.forget.call_args == call(region_obj)
+    assert fingerprints.record.call_args == call(
+        region_obj, sentinel.desired)
+
+
+def test_main_writes_profile(tmpdir, monkeypatch):
+    """Writes the profile of each phase and region with --profile."""
+    config = {
+        'regions': {
+            'region1': {
+                'url': 'http://region1:5240/MAAS',
+                'apikey': 'apikey1',
+            },
+        },
+    }
+    region_obj = MagicMock()
+    region_obj.name = 'region1'
+    monkeypatch.setattr(
+        cmd_module, "Region", MagicMock(return_value=region_obj))
+    monkeypatch.setattr(cmd_module, "load_config", lambda _path: config)
+    monkeypatch.setattr(cmd_module, "prepare_images", lambda images: images)
+    profile = tmpdir.join("profile")
+    main(['--quiet', '--profile', str(profile)])
+    assert sorted(path.basename for path in profile.listdir()) == [
+        "connect.pstats", "load_config.pstats", "prepare_images.pstats",
+        "stacks.collapsed", "sync-region1.pstats"]
 
 
 def test_main_calls_write_html(monkeypatch):
@@ -145,7 +343,461 @@ def test_main_calls_write_html(monkeypatch):
     write_html = Mock()
     monkeypatch.setattr(cmd_module, "Region", region_class)
     monkeypatch.setattr(cmd_module, "load_config", lambda _path: config)
+    monkeypatch.setattr(cmd_module, "prepare_images", lambda images: images)
+    monkeypatch.setattr(
+        cmd_module, "collect_data", lambda _regions, **_kwargs: sentinel.data)
     monkeypatch.setattr(cmd_module, "write_html", write_html)
     report_path = "/my/test/report"
     main(['--quiet', '--report', report_path])
-    assert write_html.call_args == call(report_path, [region_obj, region_obj])
+    assert write_html.call_args == call(
+        report_path, [region_obj, region_obj], data=sentinel.data)
+
+
+def test_main_calls_write_data(monkeypatch):
+    """Calls `write_data` when report data is to be written."""
+    config = {
+        'regions': {
+            'region1': {
+                'url': 'http://region1:5240/MAAS',
+                'apikey': 'apikey1',
+            },
+        },
+    }
+    monkeypatch.setattr(cmd_module, "Region", MagicMock())
+    monkeypatch.setattr(cmd_module, "load_config", lambda _path: config)
+    monkeypatch.setattr(
+        cmd_module, "collect_data", lambda _regions, **_kwargs: sentinel.data)
+    write_data = Mock()
+    monkeypatch.setattr(cmd_module, "write_data", write_data)
+    main(['--quiet', '--report-data', "/my/test/data.json"])
+    assert write_data.call_args == call("/my/test/data.json", sentinel.data)
+
+
+def test_main_only_creates_regions_in_shard(monkeypatch):
+    """Only creates `Region` for the regions in the selected shard."""
+    config = {
+        'regions': {
+            'region%d' % i: {
+                'url': 'http://region%d:5240/MAAS' % i,
+                'apikey': 'apikey%d' % i,
+            }
+            for i in range(10)
+        },
+    }
+    monkeypatch.setattr(cmd_module, "load_config", lambda _path: config)
+    names = []
+    for shard in ("1/2", "2/2"):
+        region_class = MagicMock()
+        monkeypatch.setattr(cmd_module, "Region", region_class)
+        main(['--quiet', '--shard', shard])
+        names.extend(
+            region_call[0][0] for region_call in region_class.call_args_list)
+    assert sorted(names) == sorted(config['regions'])
+
+
+def test_main_merge_report_writes_html_without_regions(monkeypatch):
+    """Merges shard report data and writes HTML without loading config."""
+    mock_load = Mock()
+    monkeypatch.setattr(cmd_module, "load_config", mock_load)
+    merge_data = Mock(return_value=sentinel.data)
+    monkeypatch.setattr(cmd_module, "merge_data", merge_data)
+    write_html = Mock()
+    monkeypatch.setattr(cmd_module, "write_html", write_html)
+    main([
+        '--report', '/my/test/report',
+        '--merge-report', '/shard1.json', '/shard2.json'])
+    assert merge_data.call_args == call(['/shard1.json', '/shard2.json'])
+    assert write_html.call_args == call(
+        '/my/test/report', [], data=sentinel.data)
+    assert mock_load.called is False
+
+
+def test_main_syncs_regions_in_parallel_with_jobs(monkeypatch):
+    """Passes --jobs to `run_parallel` to sync the regions."""
+    config = {
+        'regions': {
+            'region1': {
+                'url': 'http://region1:5240/MAAS',
+                'apikey': 'apikey1',
+            },
+        },
+    }
+    monkeypatch.setattr(cmd_module, "Region", MagicMock())
+    monkeypatch.setattr(cmd_module, "load_config", lambda _path: config)
+    run_parallel = Mock()
+    monkeypatch.setattr(cmd_module, "run_parallel", run_parallel)
+    main(['--quiet', '--jobs', '3'])
+    assert run_parallel.call_args == call(ANY, ANY, jobs=3)
+
+
+def test_main_starts_and_stops_renderer(monkeypatch):
+    """Starts the renderer when not quiet and stops it once done."""
+    monkeypatch.setattr(
+        cmd_module, "load_config", lambda _path: {'regions': {}})
+    renderer_class = MagicMock()
+    monkeypatch.setattr(cmd_module, "Renderer", renderer_class)
+    main([])
+    assert renderer_class.return_value.start.called is True
+    assert renderer_class.return_value.stop.called is True
+
+
+def test_main_doesnt_start_renderer_when_quiet(monkeypatch):
+    """Doesn't render any events in quiet mode."""
+    monkeypatch.setattr(
+        cmd_module, "load_config", lambda _path: {'regions': {}})
+    renderer_class = MagicMock()
+    monkeypatch.setattr(cmd_module, "Renderer", renderer_class)
+    main(['--quiet'])
+    assert renderer_class.called is False
+
+
+def test_parse_args_exits_on_import_window_without_concurrency():
+    """parse_args exits when --import-window is passed without
+    --import-concurrency."""
+    with pytest.raises(SystemExit):
+        parse_args(["--import-window", "60"])
+
+
+def test_main_staggers_imports_with_import_concurrency(monkeypatch):
+    """Defers the imports to the `ImportScheduler` with
+    --import-concurrency."""
+    config = {
+        'regions': {
+            'region1': {
+                'url': 'http://region1:5240/MAAS',
+                'apikey': 'apikey1',
+            },
+        },
+        'users': sentinel.users,
+        'images': sentinel.images,
+    }
+    region_obj = MagicMock()
+    monkeypatch.setattr(
+        cmd_module, "Region", MagicMock(return_value=region_obj))
+    monkeypatch.setattr(cmd_module, "load_config", lambda _path: config)
+    monkeypatch.setattr(cmd_module, "prepare_images", lambda images: images)
+    scheduler_class = MagicMock()
+    monkeypatch.setattr(cmd_module, "ImportScheduler", scheduler_class)
+    main([
+        '--quiet', '--import-concurrency', '2', '--import-window', '60',
+        '--import-poll', '5'])
+    assert scheduler_class.call_args == call(
+        concurrency=2, window=60, poll_interval=5)
+    assert region_obj.sync.call_args == call(
+        sentinel.users, sentinel.images, start_import=False, changelog=None,
+        journal=ANY)
+    assert scheduler_class.return_value.run.call_args == call([region_obj])
+
+
+MIRROR_CONFIG = {
+    'regions': {},
+    'images': {
+        'source': {
+            'url': 'http://images.maas.io/ephemeral-v3/daily/',
+            'keyring_filename': '/keyring.gpg',
+            'selections': sentinel.selections,
+        },
+    },
+    'mirror': {
+        'path': '/srv/mirror',
+        'url': 'http://mirror:8000/',
+        'listen': ':8080',
+    },
+}
+
+
+def test_parse_mirror_args_handles_all_arguments():
+    """parse_mirror_args handles all arguments."""
+    args = parse_mirror_args([
+        "serve", "--config", "/my/config", "--listen", ":9000", "--quiet"])
+    assert args.action == "serve"
+    assert args.config == "/my/config"
+    assert args.listen == ":9000"
+    assert args.quiet is True
+
+
+def test_parse_mirror_args_rejects_import_arguments():
+    """parse_mirror_args doesn't accept the import arguments of a sync, as
+    the mirror command doesn't talk to the regions."""
+    with pytest.raises(SystemExit):
+        parse_mirror_args(["sync", "--wait-for-import"])
+    with pytest.raises(SystemExit):
+        parse_mirror_args(["sync", "--profile", "/tmp/profile"])
+
+
+def test_main_mirror_sync_syncs_mirror(monkeypatch):
+    """`meta-maas mirror sync` syncs the configured mirror."""
+    monkeypatch.setattr(
+        cmd_module, "load_config", lambda _path: MIRROR_CONFIG)
+    mirror_class = MagicMock()
+    mirror_class.return_value.sync.return_value = (1, 2)
+    monkeypatch.setattr(cmd_module, "Mirror", mirror_class)
+    main(['mirror', 'sync', '--quiet'])
+    assert mirror_class.call_args == call(
+        '/srv/mirror', 'http://images.maas.io/ephemeral-v3/daily/',
+        sentinel.selections)
+    assert mirror_class.return_value.sync.called is True
+
+
+def test_main_mirror_serve_serves_mirror(monkeypatch):
+    """`meta-maas mirror serve` serves the mirror on the configured
+    address."""
+    monkeypatch.setattr(
+        cmd_module, "load_config", lambda _path: MIRROR_CONFIG)
+    make_server = Mock()
+    make_server.return_value.serve_forever.side_effect = KeyboardInterrupt
+    monkeypatch.setattr(cmd_module, "make_server", make_server)
+    main(['mirror', 'serve', '--quiet'])
+    assert make_server.call_args == call('/srv/mirror', ':8080')
+    assert make_server.return_value.server_close.called is True
+
+
+def test_main_mirror_raises_MirrorError_without_mirror(monkeypatch):
+    """`meta-maas mirror` requires the mirror section in the config."""
+    monkeypatch.setattr(
+        cmd_module, "load_config", lambda _path: {'regions': {}})
+    with pytest.raises(MirrorError):
+        main(['mirror', 'sync'])
+
+
+def test_main_points_regions_at_mirror(monkeypatch):
+    """Regions sync the images source using the mirror URL."""
+    config = dict(MIRROR_CONFIG, regions={
+        'region1': {
+            'url': 'http://region1:5240/MAAS',
+            'apikey': 'apikey1',
+        },
+    })
+    region_obj = MagicMock()
+    monkeypatch.setattr(
+        cmd_module, "Region", MagicMock(return_value=region_obj))
+    monkeypatch.setattr(cmd_module, "load_config", lambda _path: config)
+    main(['--quiet'])
+    images = region_obj.sync.call_args[0][1]
+    assert images['source']['url'] == 'http://mirror:8000/'
+
+
+def test_main_waits_for_import(monkeypatch):
+    """Waits for the regions to import with --wait-for-import."""
+    config = {
+        'regions': {
+            'region1': {
+                'url': 'http://region1:5240/MAAS',
+                'apikey': 'apikey1',
+            },
+        },
+    }
+    region_obj = MagicMock()
+    monkeypatch.setattr(
+        cmd_module, "Region", MagicMock(return_value=region_obj))
+    monkeypatch.setattr(cmd_module, "load_config", lambda _path: config)
+    poller_class = MagicMock()
+    monkeypatch.setattr(cmd_module, "ImportPoller", poller_class)
+    main(['--quiet', '--wait-for-import', '--import-timeout', '600'])
+    assert poller_class.call_args == call([region_obj], deadline=600)
+    assert poller_class.return_value.wait.called is True
+
+
+def test_parse_export_args_handles_all_arguments():
+    """parse_export_args handles all arguments."""
+    args = parse_export_args([
+        "machines", "--config", "/my/config", "--output", "/my/output",
+        "--format", "csv", "--fields", "hostname, zone", "--jobs", "8",
+        "--shard", "1/2"])
+    assert args.collection == "machines"
+    assert args.config == "/my/config"
+    assert args.output == "/my/output"
+    assert args.format == "csv"
+    assert args.fields == ["hostname", "zone"]
+    assert args.jobs == 8
+    assert args.shard == (1, 2)
+
+
+def test_main_export_machines_writes_output(tmpdir, monkeypatch):
+    """`meta-maas export machines` exports the regions to the output."""
+    config = {
+        'regions': {
+            'region1': {
+                'url': 'http://region1:5240/MAAS',
+                'apikey': 'apikey1',
+            },
+        },
+    }
+    region_obj = MagicMock()
+    monkeypatch.setattr(
+        cmd_module, "Region", MagicMock(return_value=region_obj))
+    monkeypatch.setattr(cmd_module, "load_config", lambda _path: config)
+    export_machines = Mock()
+    monkeypatch.setattr(cmd_module, "export_machines", export_machines)
+    output = tmpdir.join("machines.csv")
+    main([
+        'export', 'machines', '--output', str(output), '--format', 'csv',
+        '--fields', 'hostname'])
+    assert region_obj.connect.called is True
+    assert export_machines.call_args == call(
+        [region_obj], ANY, fields=['hostname'], fmt='csv', jobs=4)
+
+
+def test_main_collects_report_with_timeout_and_cache(
+        monkeypatch, cache_home):
+    """Collects the report with the timeout and the report cache."""
+    config = {
+        'regions': {
+            'region1': {
+                'url': 'http://region1:5240/MAAS',
+                'apikey': 'apikey1',
+            },
+        },
+    }
+    region_obj = MagicMock()
+    monkeypatch.setattr(
+        cmd_module, "Region", MagicMock(return_value=region_obj))
+    monkeypatch.setattr(cmd_module, "load_config", lambda _path: config)
+    monkeypatch.setattr(cmd_module, "write_data", Mock())
+    collect_data = Mock(return_value=sentinel.data)
+    monkeypatch.setattr(cmd_module, "collect_data", collect_data)
+    main([
+        '--quiet', '--report-data', "/my/test/data.json",
+        '--report-timeout', '5'])
+    assert collect_data.call_args == call(
+        [region_obj], timeout=5,
+        cache_dir=str(cache_home.join("meta-maas", "report")))
+
+
+def test_main_creates_regions_with_breaker_and_hedging(monkeypatch):
+    """Creates each `Region` with its own breaker and the hedge delay."""
+    config = {
+        'regions': {
+            'region%d' % i: {
+                'url': 'http://region%d:5240/MAAS' % i,
+                'apikey': 'apikey%d' % i,
+            }
+            for i in range(2)
+        },
+    }
+    region_class = MagicMock()
+    monkeypatch.setattr(cmd_module, "Region", region_class)
+    monkeypatch.setattr(cmd_module, "load_config", lambda _path: config)
+    main([
+        '--quiet', '--breaker-failures', '3', '--breaker-window', '30',
+        '--slow-call', '10', '--hedge-after', '2'])
+    calls = [kwargs['calls'] for _, kwargs in region_class.call_args_list]
+    assert calls[0].breaker is not calls[1].breaker
+    assert calls[0].breaker.failure_threshold == 3
+    assert calls[0].breaker.window == 30
+    assert calls[0].breaker.slow_call == 10
+    assert all(region_calls.hedge_after == 2 for region_calls in calls)
+
+
+def test_main_check_returns_unknown_when_config_fails(monkeypatch):
+    """`meta-maas check` returns UNKNOWN with one line when the config
+    cannot be loaded."""
+
+    def load_config(_path):
+        """Fail to load the config."""
+        raise ConfigError("Unable to find config.")
+
+    monkeypatch.setattr(cmd_module, "load_config", load_config)
+    mock_print = Mock()
+    monkeypatch.setattr(cmd_module, "print", mock_print)
+    assert main(['check']) == UNKNOWN
+    assert mock_print.call_args == call(
+        "META-MAAS UNKNOWN - Unable to find config.")
+
+
+def test_main_check_prints_summary_and_returns_status(monkeypatch):
+    """`meta-maas check` prints the summary and returns the status."""
+    config = {
+        'regions': {
+            'region1': {
+                'url': 'http://region1:5240/MAAS',
+                'apikey': 'apikey1',
+            },
+        },
+        'users': sentinel.users,
+    }
+    region_obj = MagicMock()
+    monkeypatch.setattr(
+        cmd_module, "Region", MagicMock(return_value=region_obj))
+    monkeypatch.setattr(cmd_module, "load_config", lambda _path: config)
+    mock_print = Mock()
+    monkeypatch.setattr(cmd_module, "print", mock_print)
+    check_regions = Mock(return_value=[
+        RegionCheck('region1', ['missing users: bob'], None)])
+    monkeypatch.setattr(cmd_module, "check_regions", check_regions)
+    assert main(['check', '--jobs', '4']) == CRITICAL
+    assert check_regions.call_args == call(
+        [region_obj], sentinel.users, None, jobs=4)
+    assert region_obj.connect.called is False
+    assert mock_print.call_args[0][0].startswith("META-MAAS CRITICAL")
+
+
+def test_main_check_doesnt_compare_changelog_users(monkeypatch):
+    """`meta-maas check` has no users to compare with a users changelog."""
+    config = {
+        'regions': {
+            'region1': {
+                'url': 'http://region1:5240/MAAS',
+                'apikey': 'apikey1',
+            },
+        },
+        'users': sentinel.users,
+        'users_changelog': sentinel.users_changelog,
+    }
+    region_obj = MagicMock()
+    monkeypatch.setattr(
+        cmd_module, "Region", MagicMock(return_value=region_obj))
+    monkeypatch.setattr(cmd_module, "load_config", lambda _path: config)
+    monkeypatch.setattr(cmd_module, "print", Mock())
+    check_regions = Mock(return_value=[RegionCheck('region1', [], None)])
+    monkeypatch.setattr(cmd_module, "check_regions", check_regions)
+    assert main(['check']) == OK
+    assert check_regions.call_args == call(
+        [region_obj], None, None, jobs=16)
+
+
+def test_main_removes_journal_after_sync(monkeypatch, cache_home):
+    """The journal is removed once the sync completes."""
+    config = {
+        'regions': {
+            'region1': {
+                'url': 'http://region1:5240/MAAS',
+                'apikey': 'apikey1',
+            },
+        },
+    }
+    region_obj = MagicMock()
+    monkeypatch.setattr(
+        cmd_module, "Region", MagicMock(return_value=region_obj))
+    monkeypatch.setattr(cmd_module, "load_config", lambda _path: config)
+    main(['--quiet'])
+    journal = region_obj.sync.call_args[1]['journal']
+    assert journal.resume is False
+    assert journal.stream.closed is True
+    assert cache_home.join("meta-maas", "journal").listdir() == []
+
+
+def test_main_keeps_journal_when_sync_fails(monkeypatch, cache_home):
+    """The journal is kept to resume from when the sync fails."""
+    config = {
+        'regions': {
+            'region1': {
+                'url': 'http://region1:5240/MAAS',
+                'apikey': 'apikey1',
+            },
+        },
+    }
+    region_obj = MagicMock()
+    region_obj.sync.side_effect = ConnectionRefusedError()
+    monkeypatch.setattr(
+        cmd_module, "Region", MagicMock(return_value=region_obj))
+    monkeypatch.setattr(cmd_module, "load_config", lambda _path: config)
+    with pytest.raises(ConnectionRefusedError):
+        main(['--quiet'])
+    assert region_obj.sync.call_args[1]['journal'].stream.closed is True
+    journals = cache_home.join("meta-maas", "journal").listdir()
+    assert len(journals) == 1
+    region_obj.sync.side_effect = None
+    main(['--quiet', '--resume'])
+    assert region_obj.sync.call_args[1]['journal'].resume is True
+    assert journals[0].check() is False
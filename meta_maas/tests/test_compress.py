@@ -0,0 +1,132 @@
+# Copyright 2016 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for `compress.py`."""
+
+import gzip
+import os
+import tarfile
+from unittest.mock import Mock
+
+from .. import compress as compress_module
+from ..compress import (
+    compress_raw_image,
+    gzip_member,
+    prepare_custom_image,
+    prepare_images,
+    sha256_file
+)
+
+
+def make_raw_image(tmpdir, data):
+    """Make a raw disk image holding `data`."""
+    image = tmpdir.join("disk.img")
+    image.write_binary(data)
+    return image
+
+
+def test_gzip_member_is_valid_gzip():
+    """gzip_member returns a valid gzip member."""
+    assert gzip.decompress(gzip_member(b"data")) == b"data"
+
+
+def test_compress_raw_image_writes_tar_gz_of_image(tmpdir):
+    """compress_raw_image writes a gzipped tar holding the raw image."""
+    data = os.urandom(10000) + bytes(20000) + os.urandom(5)
+    image = make_raw_image(tmpdir, data)
+    output = tmpdir.join("disk.ddtgz")
+    compress_raw_image(str(image), str(output), jobs=3, block_size=4096)
+    with tarfile.open(str(output), "r:gz") as archive:
+        assert archive.getnames() == ["disk.img"]
+        assert archive.extractfile("disk.img").read() == data
+    assert len(gzip.decompress(output.read_binary())) % (
+        tarfile.RECORDSIZE) == 0
+
+
+def test_compress_raw_image_reuses_member_for_zero_blocks(
+        tmpdir, monkeypatch):
+    """compress_raw_image only compresses a zero block once."""
+    image = make_raw_image(tmpdir, bytes(4096 * 8))
+    calls = []
+
+    def counting_gzip_member(data, level=6):
+        """Count the blocks that are compressed."""
+        calls.append(data)
+        return gzip.compress(data, level)
+
+    monkeypatch.setattr(compress_module, "gzip_member", counting_gzip_member)
+    output = tmpdir.join("disk.ddtgz")
+    compress_raw_image(str(image), str(output), block_size=4096)
+    # Zero block member, tar header and the end of the archive.
+    assert len(calls) == 3
+    with tarfile.open(str(output), "r:gz") as archive:
+        assert archive.extractfile("disk.img").read() == bytes(4096 * 8)
+
+
+def test_prepare_custom_image_returns_other_filetypes_unchanged():
+    """prepare_custom_image returns non-raw images unchanged."""
+    info = {"path": "/image.tgz", "architecture": "amd64/generic"}
+    assert prepare_custom_image(info) is info
+
+
+def test_prepare_custom_image_compresses_raw_into_cache(tmpdir):
+    """prepare_custom_image compresses a raw image into the cache."""
+    image = make_raw_image(tmpdir, b"raw" * 1000)
+    cache = tmpdir.mkdir("cache")
+    info = prepare_custom_image({
+        "path": str(image),
+        "architecture": "amd64/generic",
+        "filetype": "raw",
+    }, cache_dir=str(cache))
+    assert info == {
+        "path": str(cache.join("%s.ddtgz" % sha256_file(str(image)))),
+        "architecture": "amd64/generic",
+        "filetype": "ddtgz",
+    }
+    with tarfile.open(info["path"], "r:gz") as archive:
+        assert archive.extractfile("disk.img").read() == b"raw" * 1000
+
+
+def test_prepare_custom_image_uses_cached_artifact(tmpdir, monkeypatch):
+    """prepare_custom_image doesn't compress an image that is cached."""
+    image = make_raw_image(tmpdir, b"raw")
+    cache = tmpdir.mkdir("cache")
+    info = {"path": str(image), "architecture": "amd64/generic",
+            "filetype": "raw"}
+    prepare_custom_image(info, cache_dir=str(cache))
+    mock_compress = Mock()
+    monkeypatch.setattr(compress_module, "compress_raw_image", mock_compress)
+    prepare_custom_image(info, cache_dir=str(cache))
+    assert mock_compress.called is False
+
+
+def test_prepare_images_prepares_each_custom_image(tmpdir):
+    """prepare_images prepares every custom image."""
+    image = make_raw_image(tmpdir, b"raw")
+    images = {
+        "source": {"url": "http://images"},
+        "custom": {
+            "raw": {"path": str(image), "architecture": "amd64/generic",
+                    "filetype": "raw"},
+            "tgz": {"path": "/image.tgz", "architecture": "amd64/generic"},
+        },
+    }
+    prepared = prepare_images(images, cache_dir=str(tmpdir.mkdir("cache")))
+    assert prepared["source"] == images["source"]
+    assert prepared["custom"]["raw"]["filetype"] == "ddtgz"
+    assert prepared["custom"]["tgz"] == images["custom"]["tgz"]
+    assert images["custom"]["raw"]["filetype"] == "raw"
+
+
+def test_prepare_images_handles_no_images():
+    """prepare_images handles no images."""
+    assert prepare_images(None) is None
+    assert prepare_images({}) == {}
+
+
+def test_sha256_file_matches_content(tmpdir):
+    """sha256_file returns the checksum of the file."""
+    path = tmpdir.join("file")
+    path.write_binary(b"data")
+    assert sha256_file(str(path)) == (
+        "3a6eb0790f39ac87c94f3856b2dd2c5d110e6811602261a9a923d3bb23adc8b7")
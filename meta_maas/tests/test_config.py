@@ -8,7 +8,9 @@ import os
 import pytest
 import yaml
 
-from ..config import ConfigError, find_config, load_config
+from ..config import ConfigError, find_config, get_validator, load_config
+from ..schema import ValidationError
+from ..users import UserSourceError
 
 
 def test_find_config_finds_local_config(tmpdir, monkeypatch):
@@ -138,6 +140,66 @@ def test_load_config_raises_ConfigError_region_missing_keys(tmpdir):
     assert str(exc.value) == "Unable to load config: %s" % str(cfg)
 
 
+def test_load_config_ConfigError_has_path_of_invalid_value(tmpdir):
+    """The cause of `ConfigError` has the path of the invalid value."""
+    cfg = tmpdir.join("meta-maas.yaml")
+    cfg.write(yaml.dump({
+        'regions': {
+            'region1': {
+                'url': 'http://localhost:5240/MAAS',
+                'apikey': 1,
+            },
+        },
+    }))
+    with pytest.raises(ConfigError) as exc:
+        load_config(str(cfg))
+    assert isinstance(exc.value.__cause__, ValidationError)
+    assert str(exc.value.__cause__) == (
+        "/regions/region1/apikey: must be of type 'string'")
+
+
+def test_load_config_accepts_users_file(tmpdir):
+    """Returns the config when users is the path of a users file."""
+    users = tmpdir.join("users.csv")
+    users.write("username,email,password\nadmin,admin@localhost,pass\n")
+    cfg = tmpdir.join("meta-maas.yaml")
+    cfg_data = {
+        'regions': {
+            'region1': {
+                'url': 'http://localhost:5240/MAAS',
+                'apikey': 'apikey',
+            },
+        },
+        'users': str(users),
+    }
+    cfg.write(yaml.dump(cfg_data))
+    assert load_config(str(cfg)) == cfg_data
+
+
+def test_load_config_raises_ConfigError_when_users_file_invalid(tmpdir):
+    """Raises `ConfigError` when a user in the users file is invalid."""
+    users = tmpdir.join("users.csv")
+    users.write("username,email\nadmin,admin@localhost\n")
+    cfg = tmpdir.join("meta-maas.yaml")
+    cfg.write(yaml.dump({
+        'regions': {
+            'region1': {
+                'url': 'http://localhost:5240/MAAS',
+                'apikey': 'apikey',
+            },
+        },
+        'users': str(users),
+    }))
+    with pytest.raises(ConfigError) as exc:
+        load_config(str(cfg))
+    assert isinstance(exc.value.__cause__, UserSourceError)
+
+
+def test_get_validator_compiles_schema_once():
+    """get_validator returns the same validator every time."""
+    assert get_validator() is get_validator()
+
+
 def test_load_config_raises_ConfigError_region_missing_url(tmpdir):
     """Raises `ConfigError` when config region missing url."""
     cfg = tmpdir.join("meta-maas.yaml")
@@ -700,3 +762,42 @@ def test_load_config_returns_config_with_complete_config(tmpdir):
     }
     cfg.write(yaml.dump(cfg_data))
     assert load_config(str(cfg)) == cfg_data
+
+
+def test_load_config_returns_config_with_mirror(tmpdir):
+    """Returns loaded config when the mirror section is valid."""
+    cfg = tmpdir.join("meta-maas.yaml")
+    cfg_data = {
+        'regions': {
+            'region1': {
+                'url': 'http://localhost:5240/MAAS',
+                'apikey': 'randomstring',
+            },
+        },
+        'mirror': {
+            'path': '/srv/mirror',
+            'url': 'http://mirror:8000/',
+            'listen': ':8000',
+        },
+    }
+    cfg.write(yaml.dump(cfg_data))
+    assert load_config(str(cfg)) == cfg_data
+
+
+def test_load_config_raises_ConfigError_when_mirror_missing_url(tmpdir):
+    """Raises `ConfigError` when the mirror is missing its url."""
+    cfg = tmpdir.join("meta-maas.yaml")
+    cfg.write(yaml.dump({
+        'regions': {
+            'region1': {
+                'url': 'http://localhost:5240/MAAS',
+                'apikey': 'randomstring',
+            },
+        },
+        'mirror': {
+            'path': '/srv/mirror',
+        },
+    }))
+    with pytest.raises(ConfigError) as exc:
+        load_config(str(cfg))
+    assert str(exc.value) == "Unable to load config: %s" % str(cfg)
@@ -0,0 +1,205 @@
+# Copyright 2016 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for `events.py`."""
+
+import io
+import json
+from unittest.mock import MagicMock, call, sentinel
+
+import pytest
+
+from .. import events as events_module
+from ..events import (
+    EventBus,
+    Finished,
+    ImportProgress,
+    Message,
+    MessageLevel,
+    Progress,
+    Renderer,
+    event_to_dict,
+    format_import_progress,
+    format_message,
+    format_progress,
+    format_size
+)
+
+
+def test_event_to_dict_includes_event_name_and_level():
+    """event_to_dict includes the event name and the level name."""
+    assert event_to_dict(Message("region1", MessageLevel.WARN, "test")) == {
+        "event": "message",
+        "region": "region1",
+        "level": "warn",
+        "text": "test",
+    }
+
+
+def test_EventBus_consume_returns_published_events_in_order():
+    """EventBus.consume returns the published events in order."""
+    bus = EventBus()
+    bus.publish(Message("region1", MessageLevel.SUCCESS, "one"))
+    bus.publish(Finished("region1"))
+    assert bus.consume() == [
+        Message("region1", MessageLevel.SUCCESS, "one"),
+        Finished("region1"),
+    ]
+    assert bus.consume(timeout=0) == []
+
+
+def test_EventBus_coalesces_progress():
+    """EventBus only keeps the latest progress for each task."""
+    bus = EventBus()
+    for progress in range(100):
+        bus.publish(Progress("region1", "upload", progress / 100))
+    bus.publish(Progress("region2", "upload", 0.5))
+    assert bus.consume(timeout=0) == [
+        Progress("region1", "upload", 0.99),
+        Progress("region2", "upload", 0.5),
+    ]
+
+
+def test_format_message_sets_no_color():
+    """format_message sets no color when level is None or PROGRESS."""
+    assert format_message("region1", "test") == "Region region1: test"
+    assert format_message("region1", "test", MessageLevel.PROGRESS) == (
+        "Region region1: test")
+
+
+def test_format_message_sets_autogreen_for_success(monkeypatch):
+    """format_message sets color to autogreen when level is SUCCESS."""
+    mock_color_class = MagicMock()
+    monkeypatch.setattr(events_module, "Color", mock_color_class)
+    format_message("region1", "test", MessageLevel.SUCCESS)
+    assert (
+        call("{autogreen}Region region1: test{/autogreen}") ==
+        mock_color_class.call_args)
+
+
+def test_format_message_sets_autoyellow_for_warn(monkeypatch):
+    """format_message sets color to autoyellow when level is WARN."""
+    mock_color_class = MagicMock()
+    monkeypatch.setattr(events_module, "Color", mock_color_class)
+    format_message("region1", "test", MessageLevel.WARN)
+    assert (
+        call("{autoyellow}Region region1: test{/autoyellow}") ==
+        mock_color_class.call_args)
+
+
+def test_format_message_raises_ValueError_on_unknown_level():
+    """format_message raises ValueError on unknown level."""
+    with pytest.raises(ValueError):
+        format_message("region1", "test", sentinel.level)
+
+
+def test_format_progress_renders_bar():
+    """format_progress renders a bar with the percentage."""
+    assert format_progress(Progress("region1", "upload", 0.5), width=4) == (
+        "upload [==  ]  50%")
+
+
+def test_Renderer_writes_json_lines_when_not_tty():
+    """Renderer writes every message and the latest progress as JSON."""
+    stream = io.StringIO()
+    bus = EventBus()
+    renderer = Renderer(bus, stream, tty=False)
+    renderer.start()
+    bus.publish(Message("region1", MessageLevel.SUCCESS, "created"))
+    bus.publish(Progress("region1", "upload", 0.5))
+    bus.publish(Progress("region1", "upload", 1))
+    bus.publish(Finished("region1"))
+    renderer.stop()
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert {
+        "event": "message", "region": "region1",
+        "level": "success", "text": "created"} in lines
+    assert {"event": "finished", "region": "region1"} in lines
+    progress = [line for line in lines if line["event"] == "progress"]
+    assert progress[-1]["progress"] == 1
+
+
+def test_Renderer_draws_line_per_region_on_tty(monkeypatch):
+    """Renderer keeps one line for each working region on a TTY."""
+    monkeypatch.setattr(
+        events_module.shutil, "get_terminal_size",
+        lambda: MagicMock(columns=80))
+    stream = io.StringIO()
+    renderer = Renderer(EventBus(), stream, tty=True)
+    renderer.handle([
+        Message("region1", MessageLevel.PROGRESS, "waiting"),
+        Progress("region2", "upload", 0.5),
+    ])
+    renderer.draw()
+    assert stream.getvalue() == (
+        "\x1b[2KRegion region1: waiting\n"
+        "\x1b[2KRegion region2: %s\n" % format_progress(
+            Progress("region2", "upload", 0.5)))
+    stream.truncate(0)
+    stream.seek(0)
+    renderer.handle([
+        Message("region1", MessageLevel.SUCCESS, "done"),
+        Finished("region1"),
+    ])
+    renderer.draw(final=True)
+    # Moves up over the two region lines, writes the message and clears the
+    # rest of the lines.
+    assert stream.getvalue() == (
+        "\x1b[2A"
+        "\x1b[2K%s\n"
+        "\x1b[2K\n") % format_message(
+            "region1", "done", MessageLevel.SUCCESS)
+
+
+def test_EventBus_coalesces_import_progress():
+    """EventBus only keeps the latest import progress for each region."""
+    bus = EventBus()
+    bus.publish(ImportProgress("region1", 10, 100, 0, 1))
+    bus.publish(ImportProgress("region1", 20, 100, 0, 1))
+    assert bus.consume() == [ImportProgress("region1", 20, 100, 0, 1)]
+
+
+def test_format_size_uses_units():
+    """format_size formats the size with the largest unit."""
+    assert format_size(512) == "512 B"
+    assert format_size(1536) == "1.5 KiB"
+    assert format_size(3 * 1024 ** 3) == "3.0 GiB"
+
+
+def test_format_import_progress_includes_bytes_and_racks():
+    """format_import_progress includes the bytes and the rack sync."""
+    assert format_import_progress(
+        ImportProgress("region1", 512, 1024, 1, 2)) == (
+            "%s (512 B of 1.0 KiB); 1/2 racks synced" % format_progress(
+                Progress("region1", "importing", 0.5)))
+
+
+def test_Renderer_clears_import_progress_when_region_finishes(monkeypatch):
+    """Renderer removes the import progress line of a finished region."""
+    monkeypatch.setattr(
+        events_module.shutil, "get_terminal_size",
+        lambda: MagicMock(columns=200))
+    stream = io.StringIO()
+    renderer = Renderer(EventBus(), stream, tty=True)
+    renderer.handle([ImportProgress("region1", 512, 1024, 1, 2)])
+    renderer.draw()
+    stream.truncate(0)
+    stream.seek(0)
+    renderer.handle([Finished("region1")])
+    renderer.draw()
+    assert stream.getvalue() == "\x1b[1A\x1b[2K\n"
+
+
+def test_Renderer_stop_renders_every_published_event():
+    """Renderer.stop renders the events published before it was called."""
+    stream = io.StringIO()
+    bus = EventBus()
+    renderer = Renderer(bus, stream, tty=False, rate=1)
+    renderer.start()
+    for index in range(3):
+        bus.publish(Message("region1", MessageLevel.SUCCESS, str(index)))
+    renderer.stop()
+    assert [
+        json.loads(line)["text"] for line in stream.getvalue().splitlines()
+    ] == ["0", "1", "2"]
+    assert renderer.is_alive() is False
@@ -0,0 +1,114 @@
+# Copyright 2016 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for `export.py`."""
+
+import csv
+import io
+import json
+from unittest.mock import MagicMock
+
+import pytest
+from maas.client.viscera.machines import Machine
+
+from .. import export as export_module
+from ..export import (
+    ExportError,
+    export_machines,
+    get_field,
+    iter_machines,
+    write_csv
+)
+
+
+def make_export_region(name, count):
+    """Make a region with `count` machines."""
+    region = MagicMock()
+    region.name = name
+    region.read_machines.return_value = [
+        Machine({
+            "hostname": "%s-%d" % (name, i),
+            "status_name": "Ready",
+            "zone": {"name": "default", "id": 1},
+            "memory": 1024,
+        })
+        for i in range(count)
+    ]
+    return region
+
+
+def test_get_field_returns_name_of_nested_objects():
+    """get_field returns the name of nested objects."""
+    data = {"zone": {"name": "zone1", "id": 1}, "memory": 1024}
+    assert get_field(data, "zone") == "zone1"
+    assert get_field(data, "zone.id") == 1
+    assert get_field(data, "memory") == 1024
+    assert get_field(data, "missing") is None
+    assert get_field(data, "memory.missing") is None
+
+
+def test_iter_machines_yields_every_machine_of_every_region():
+    """iter_machines yields a row for every machine of every region."""
+    regions = [
+        make_export_region("region%d" % i, count)
+        for i, count in enumerate([3, 0, 5])
+    ]
+    rows = list(iter_machines(regions, ["hostname"], jobs=2))
+    assert sorted(row["hostname"] for row in rows) == sorted(
+        ["region0-%d" % i for i in range(3)] +
+        ["region2-%d" % i for i in range(5)])
+    assert all(
+        row["hostname"].startswith(row["region"]) for row in rows)
+
+
+def test_iter_machines_bounds_rows_held(monkeypatch):
+    """iter_machines streams more rows than the queue can hold."""
+    monkeypatch.setattr(export_module, "QUEUE_SIZE", 2)
+    regions = [make_export_region("region%d" % i, 50) for i in range(3)]
+    assert len(list(iter_machines(regions, ["hostname"], jobs=3))) == 150
+
+
+def test_iter_machines_raises_ExportError_when_region_fails():
+    """iter_machines raises `ExportError` when reading a region fails."""
+    region = MagicMock()
+    region.name = "region1"
+    region.read_machines.side_effect = ValueError("failed")
+    with pytest.raises(ExportError) as exc:
+        list(iter_machines([region], ["hostname"]))
+    assert str(exc.value) == (
+        "Failed to export machines from region: region1")
+    assert isinstance(exc.value.__cause__, ValueError)
+
+
+def test_export_machines_writes_ndjson():
+    """export_machines writes each machine as a JSON line."""
+    stream = io.StringIO()
+    count = export_machines(
+        [make_export_region("region1", 2)], stream,
+        fields=["hostname", "zone"])
+    assert count == 2
+    rows = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert sorted(rows, key=lambda row: row["hostname"]) == [
+        {"region": "region1", "hostname": "region1-0", "zone": "default"},
+        {"region": "region1", "hostname": "region1-1", "zone": "default"},
+    ]
+
+
+def test_export_machines_writes_csv():
+    """export_machines writes the machines as CSV with a header."""
+    stream = io.StringIO()
+    count = export_machines(
+        [make_export_region("region1", 2)], stream,
+        fields=["hostname", "memory"], fmt="csv")
+    assert count == 2
+    stream.seek(0)
+    rows = list(csv.DictReader(stream))
+    assert [row["memory"] for row in rows] == ["1024", "1024"]
+    assert list(rows[0].keys()) == ["region", "hostname", "memory"]
+
+
+def test_write_csv_writes_header_without_rows():
+    """write_csv writes the header when there are no machines."""
+    stream = io.StringIO()
+    assert write_csv(iter([]), stream, ["hostname"]) == 0
+    assert stream.getvalue() == "region,hostname\r\n"
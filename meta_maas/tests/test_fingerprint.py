@@ -0,0 +1,95 @@
+# Copyright 2016 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for `fingerprint.py`."""
+
+from unittest.mock import MagicMock
+
+from .. import fingerprint as fingerprint_module
+from ..fingerprint import (
+    Fingerprints,
+    get_desired_fingerprint,
+    get_observed_fingerprint
+)
+
+
+def make_region(name="region1", arches=("amd64",)):
+    """Make a region with a boot source and a selection."""
+    region = MagicMock()
+    region.name = name
+    region.url = "http://%s:5240/MAAS" % name
+    source = MagicMock(
+        url="http://images.maas.io/", keyring_filename="/keyring")
+    selection = MagicMock(os="ubuntu", release="xenial", arches=list(arches))
+    region.read_boot_sources.return_value = [source]
+    region.read_selections.return_value = [selection]
+    return region
+
+
+def test_get_desired_fingerprint_changes_with_config(tmpdir):
+    """The desired fingerprint changes with the users, images and
+    changelog."""
+    region = make_region()
+    users = {"admin": {"password": "pass"}}
+    fingerprint = get_desired_fingerprint(region, users, {})
+    assert get_desired_fingerprint(region, users, {}) == fingerprint
+    assert get_desired_fingerprint(region, {}, {}) != fingerprint
+    assert get_desired_fingerprint(
+        region, users, {"custom": {}}) != fingerprint
+    assert get_desired_fingerprint(
+        make_region("region2"), users, {}) != fingerprint
+    image = tmpdir.join("image.tgz")
+    image.write("image")
+    images = {"custom": {"image": {"path": str(image)}}}
+    with_image = get_desired_fingerprint(region, users, images)
+    image.write("changed image")
+    assert get_desired_fingerprint(region, users, images) != with_image
+    path = tmpdir.join("users.changelog")
+    path.write("")
+    changelog = MagicMock(path=str(path))
+    with_changelog = get_desired_fingerprint(region, users, {}, changelog)
+    path.write("{}\n")
+    assert get_desired_fingerprint(
+        region, users, {}, changelog) != with_changelog
+
+
+def test_get_observed_fingerprint_changes_with_selections():
+    """The observed fingerprint changes with the region's selections."""
+    assert get_observed_fingerprint(make_region()) != (
+        get_observed_fingerprint(make_region(arches=("amd64", "i386"))))
+
+
+def test_Fingerprints_converged_after_record(tmpdir):
+    """A recorded region is converged while nothing changes."""
+    fingerprints = Fingerprints(str(tmpdir), ttl=60)
+    region = make_region()
+    assert fingerprints.is_converged(region, "desired") is False
+    fingerprints.record(region, "desired")
+    assert fingerprints.is_converged(region, "desired") is True
+    assert fingerprints.is_converged(region, "changed") is False
+    assert fingerprints.is_converged(
+        make_region(arches=("i386",)), "desired") is False
+    fingerprints.forget(region)
+    assert fingerprints.is_converged(region, "desired") is False
+
+
+def test_Fingerprints_not_converged_after_ttl(tmpdir, monkeypatch):
+    """A region is synced again once the TTL expires."""
+    now = [1000.0]
+    monkeypatch.setattr(fingerprint_module.time, "time", lambda: now[0])
+    fingerprints = Fingerprints(str(tmpdir), ttl=60)
+    region = make_region()
+    fingerprints.record(region, "desired")
+    now[0] += 59
+    assert fingerprints.is_converged(region, "desired") is True
+    now[0] += 1
+    assert fingerprints.is_converged(region, "desired") is False
+
+
+def test_Fingerprints_not_converged_when_probe_fails(tmpdir):
+    """A region that cannot be probed is synced."""
+    fingerprints = Fingerprints(str(tmpdir), ttl=60)
+    region = make_region()
+    fingerprints.record(region, "desired")
+    region.read_boot_sources.side_effect = ConnectionRefusedError()
+    assert fingerprints.is_converged(region, "desired") is False
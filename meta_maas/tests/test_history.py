@@ -0,0 +1,75 @@
+# Copyright 2016 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for `history.py`."""
+
+from unittest.mock import Mock
+
+import pytest
+
+from ..history import DEFAULT_THROUGHPUT, History, get_image_identity, smooth
+
+
+def make_synced_region(name, timings, *, bytes_uploaded=0, images=None):
+    """Make a region that was synced in `timings`."""
+    region = Mock()
+    region.name = name
+    region.timings = timings
+    region.bytes_uploaded = bytes_uploaded
+    region.custom_images = images or {}
+    return region
+
+
+def make_image(tmpdir, name, size):
+    """Make a custom image of `size` bytes."""
+    path = tmpdir.join(name)
+    path.write_binary(b"x" * size)
+    return {'path': str(path), 'architecture': 'amd64/generic'}
+
+
+def test_smooth_averages_with_latest():
+    """smooth weighs the latest value with the previous average."""
+    assert smooth(None, 10) == 10
+    assert smooth(10, 20) == 15
+
+
+def test_History_records_phases_of_each_region(tmpdir):
+    """History keeps the phases of each region between runs."""
+    history = History(str(tmpdir))
+    assert history.get("region1") is None
+    history.record(make_synced_region("region1", {"users": 10}))
+    history.record(make_synced_region("region1", {"users": 20}))
+    assert History(str(tmpdir)).get("region1")["phases"] == {"users": 15}
+    assert History(str(tmpdir)).get("region2") is None
+
+
+def test_History_estimate_cost_adds_changed_uploads(tmpdir):
+    """estimate_cost adds the time to upload the images that changed."""
+    info = make_image(tmpdir, "image.tgz", 1000)
+    history = History(str(tmpdir.mkdir("history")))
+    history.record(make_synced_region(
+        "region1", {"users": 2, "custom": 10}, bytes_uploaded=1000,
+        images={"image": get_image_identity(info)}))
+    images = {'custom': {'image': info}}
+    assert history.estimate_cost("region1", images) == 2
+    tmpdir.join("image.tgz").write_binary(b"x" * 2000)
+    assert history.estimate_cost("region1", images) == 2 + 2000 / 100
+    history.record(make_synced_region("region2", {"users": 1}))
+    assert history.estimate_cost("region2", images) == pytest.approx(
+        1 + 2000 / DEFAULT_THROUGHPUT)
+    assert history.estimate_cost("region3", images) is None
+
+
+def test_History_order_regions_puts_expensive_and_unknown_first(tmpdir):
+    """order_regions puts regions without history first, then the most
+    expensive."""
+    history = History(str(tmpdir))
+    history.record(make_synced_region("cheap", {"users": 1}))
+    history.record(make_synced_region("expensive", {"users": 100}))
+    regions = [
+        make_synced_region(name, {})
+        for name in ["cheap", "expensive", "new"]
+    ]
+    assert [
+        region.name for region in history.order_regions(regions, {})
+    ] == ["new", "expensive", "cheap"]
@@ -0,0 +1,402 @@
+# Copyright 2016 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for `imports.py`."""
+
+import time
+from unittest.mock import MagicMock, call
+
+import pytest
+from maas.client.bones import CallError
+
+from ..events import Finished, ImportProgress
+from ..imports import (
+    ImportCoordinator,
+    ImportPoller,
+    ImportScheduler,
+    ImportTimeoutError,
+    call_directly,
+    call_handler,
+    list_boot_images,
+    read_import_progress,
+    read_rack_status
+)
+
+
+# Allow test code to access a protected member.
+# pylint: disable=protected-access
+
+
+def test_call_handler_returns_None_when_operation_missing():
+    """call_handler returns None when the handler lacks the operation."""
+    origin = MagicMock()
+    origin.BootResources._handler = object()
+    assert call_handler(origin, "is_importing") is None
+
+
+@pytest.mark.parametrize("status", [404, 405])
+def test_call_handler_returns_None_when_operation_unsupported(status):
+    """call_handler returns None when the region doesn't know the
+    operation."""
+    response = MagicMock()
+    response.status = status
+    origin = MagicMock()
+    origin.BootResources._handler.is_importing.side_effect = CallError(
+        MagicMock(), response, b"", None)
+    assert call_handler(origin, "is_importing") is None
+
+
+def test_call_handler_raises_other_CallError():
+    """call_handler raises the errors of an operation the region has."""
+    response = MagicMock()
+    response.status = 503
+    origin = MagicMock()
+    origin.BootResources._handler.is_importing.side_effect = CallError(
+        MagicMock(), response, b"", None)
+    with pytest.raises(CallError):
+        call_handler(origin, "is_importing")
+
+
+def test_call_handler_waits_for_coroutine():
+    """call_handler runs the operation on the event loop when async."""
+    origin = MagicMock()
+
+    async def is_importing():
+        """Fake async operation."""
+        return True
+
+    origin.BootResources._handler.is_importing = is_importing
+    assert call_handler(origin, "is_importing") is True
+
+
+def test_ImportCoordinator_flush_does_nothing_without_reasons():
+    """flush doesn't start an import when nothing was requested."""
+    origin = MagicMock()
+    coordinator = ImportCoordinator(origin)
+    assert coordinator.flush() == []
+    assert origin.BootResources.start_import.called is False
+
+
+def test_ImportCoordinator_flush_starts_one_import_for_all_reasons():
+    """flush starts a single import for every requested reason."""
+    origin = MagicMock()
+    origin.BootResources._handler.is_importing.return_value = False
+    coordinator = ImportCoordinator(origin)
+    coordinator.request("created image source")
+    coordinator.request("updated selections")
+    assert coordinator.flush() == [
+        "created image source", "updated selections"]
+    assert origin.BootResources.start_import.call_count == 1
+    assert coordinator.reasons == []
+
+
+def test_ImportCoordinator_flush_skips_when_import_is_running():
+    """flush doesn't start an import when the region is already importing."""
+    origin = MagicMock()
+    origin.BootResources._handler.is_importing.return_value = True
+    coordinator = ImportCoordinator(origin)
+    coordinator.request("updated selections")
+    assert coordinator.flush() == []
+    assert origin.BootResources.start_import.called is False
+
+
+def test_ImportCoordinator_flush_starts_when_not_importing():
+    """flush starts an import when the region isn't importing."""
+    origin = MagicMock()
+    origin.BootResources._handler.is_importing.return_value = False
+    coordinator = ImportCoordinator(origin)
+    coordinator.request("updated selections")
+    assert coordinator.flush() == ["updated selections"]
+    assert origin.BootResources.start_import.call_count == 1
+
+
+def test_ImportCoordinator_makes_calls_with_call():
+    """ImportCoordinator makes every call to the region with `call`."""
+    origin = MagicMock()
+    origin.BootResources._handler.is_importing.return_value = False
+    calls = []
+
+    def region_call(func, *args, **_kwargs):
+        """Record the call and make it."""
+        calls.append(func)
+        return func(*args)
+
+    coordinator = ImportCoordinator(origin, call=region_call)
+    coordinator.request("updated selections")
+    coordinator.flush()
+    assert calls == [call_handler, origin.BootResources.start_import]
+
+
+def test_ImportCoordinator_refresh_cache_starts_and_stops_import():
+    """refresh_cache starts an import, waits and stops it."""
+    origin = MagicMock()
+    origin.BootResources._handler.is_importing.return_value = False
+    wait = MagicMock()
+    assert ImportCoordinator(origin).refresh_cache(wait) is True
+    assert origin.BootResources.start_import.call_count == 1
+    assert wait.call_count == 1
+    assert origin.BootResources.stop_import.call_count == 1
+
+
+def test_ImportCoordinator_refresh_cache_leaves_running_import():
+    """refresh_cache never stops an import it didn't start."""
+    origin = MagicMock()
+    origin.BootResources._handler.is_importing.return_value = True
+    wait = MagicMock()
+    assert ImportCoordinator(origin).refresh_cache(wait) is False
+    assert origin.BootResources.start_import.called is False
+    assert wait.called is False
+    assert origin.BootResources.stop_import.called is False
+
+
+def test_ImportCoordinator_is_importing_returns_None_when_unknown():
+    """is_importing returns None when the region cannot report it."""
+    origin = MagicMock()
+    origin.BootResources._handler = object()
+    assert ImportCoordinator(origin).is_importing() is None
+
+
+def make_importing_region(name, polls):
+    """Make a region that reports importing for `polls` checks."""
+    region = MagicMock()
+    region.name = name
+    region.imports.reasons = ["updated selections"]
+    region.imports.is_importing.side_effect = (
+        [True] * (polls - 1) + [False])
+    region.start_import.return_value = True
+    return region
+
+
+def test_ImportScheduler_limits_concurrent_imports(monkeypatch):
+    """ImportScheduler only lets `concurrency` regions import at once."""
+    monkeypatch.setattr(time, "sleep", lambda *_args: None)
+    started, active = [], set()
+    regions = [make_importing_region("region%d" % i, 2) for i in range(5)]
+    max_active = 0
+
+    def start_import(region):
+        """Track the regions that are importing."""
+        nonlocal max_active
+        started.append(region.name)
+        active.add(region.name)
+        max_active = max(max_active, len(active))
+        return True
+
+    def is_importing(region, results):
+        """Stop tracking the region once it has finished."""
+        result = results.pop(0)
+        if not result:
+            active.discard(region.name)
+        return result
+
+    for region in regions:
+        region.start_import.side_effect = (
+            lambda region=region: start_import(region))
+        results = list(region.imports.is_importing.side_effect)
+        region.imports.is_importing.side_effect = (
+            lambda region=region, results=results: is_importing(
+                region, results))
+    ImportScheduler(concurrency=2, poll_interval=0).run(regions)
+    assert started == ["region%d" % i for i in range(5)]
+    assert max_active == 2
+
+
+def test_ImportScheduler_skips_regions_without_reasons(monkeypatch):
+    """ImportScheduler doesn't start an import on unchanged regions."""
+    monkeypatch.setattr(time, "sleep", lambda *_args: None)
+    region = MagicMock()
+    region.imports.reasons = []
+    ImportScheduler(concurrency=1, poll_interval=0).run([region])
+    assert region.start_import.called is False
+
+
+def test_ImportScheduler_releases_region_after_window(monkeypatch):
+    """ImportScheduler releases the next region once the window elapsed."""
+    monkeypatch.setattr(time, "sleep", lambda *_args: None)
+    now = [0]
+
+    def monotonic():
+        """Move time forward 30 seconds on every call."""
+        now[0] += 30
+        return now[0]
+
+    monkeypatch.setattr(time, "monotonic", monotonic)
+    region = make_importing_region("region1", 1000)
+    ImportScheduler(concurrency=1, window=60, poll_interval=0).run([region])
+    assert region.imports.is_importing.call_count < 1000
+    assert region.message.called is True
+
+
+def test_ImportScheduler_waits_for_window_when_progress_unknown(monkeypatch):
+    """ImportScheduler holds the token for the window when the region cannot
+    report its import progress."""
+    monkeypatch.setattr(time, "sleep", lambda *_args: None)
+    now = [0]
+
+    def monotonic():
+        """Move time forward 10 seconds on every call."""
+        now[0] += 10
+        return now[0]
+
+    monkeypatch.setattr(time, "monotonic", monotonic)
+    region = MagicMock()
+    region.imports.reasons = ["updated selections"]
+    region.imports.is_importing.return_value = None
+    region.start_import.return_value = True
+    ImportScheduler(concurrency=1, window=60, poll_interval=0).run([region])
+    assert region.imports.is_importing.call_count > 1
+
+
+def make_resource(sets):
+    """Make a boot resource with `sets`."""
+    resource = MagicMock()
+    resource.sets = sets
+    return resource
+
+
+def make_set(size, complete, progress=0):
+    """Make a boot resource set."""
+    resource_set = MagicMock()
+    resource_set.size = size
+    resource_set.complete = complete
+    resource_set._data = {"progress": progress}
+    return resource_set
+
+
+def make_rack(status):
+    """Make a rack controller reporting `status`."""
+    rack = MagicMock()
+    rack._handler.list_boot_images.return_value = {"status": status}
+    return rack
+
+
+def test_read_rack_status_counts_synced_racks():
+    """read_rack_status counts the racks that are synced."""
+    origin = MagicMock()
+    origin.RackControllers.read.return_value = [
+        make_rack("synced"), make_rack("syncing")]
+    assert read_rack_status(origin) == (1, 2)
+
+
+def test_read_rack_status_skips_racks_that_cannot_report():
+    """read_rack_status doesn't count racks without the operation or whose
+    call fails as synced."""
+    origin = MagicMock()
+    missing = MagicMock()
+    missing._handler = MagicMock(spec=[])
+    failing = make_rack("synced")
+    failing._handler.list_boot_images.side_effect = CallError(
+        MagicMock(), MagicMock(), b"", None)
+    origin.RackControllers.read.return_value = [missing, failing]
+    assert read_rack_status(origin) == (0, 2)
+
+
+def test_read_import_progress_sums_latest_sets():
+    """read_import_progress sums the bytes of the latest set of each
+    resource."""
+    region = MagicMock()
+    region.name = "region1"
+    region._call.side_effect = call_directly
+    region.origin.BootResources.read.return_value = [
+        MagicMock(id=1), MagicMock(id=2), MagicMock(id=3)]
+    resources = {
+        1: make_resource({
+            "20161001": make_set(50, True),
+            "20161020": make_set(100, True),
+        }),
+        2: make_resource({"20161020": make_set(200, False, progress=25)}),
+        3: make_resource({}),
+    }
+    region.origin.BootResource.read.side_effect = resources.get
+    region.origin.RackControllers.read.return_value = [make_rack("synced")]
+    assert read_import_progress(region) == ImportProgress(
+        "region1", 150, 300, 1, 1)
+    # Every call goes through the region's limiter and circuit breaker.
+    assert [
+        region.origin.BootResources.read,
+        region.origin.BootResource.read,
+        region.origin.BootResource.read,
+        region.origin.BootResource.read,
+        region.origin.RackControllers.read,
+        list_boot_images,
+    ] == [args[0] for args, _ in region._call.call_args_list]
+
+
+def make_polled_region(name, progresses, importing=False):
+    """Make a region that reports each of `progresses` when polled."""
+    region = MagicMock()
+    region.name = name
+    region.imports.is_importing.return_value = importing
+    region.progresses = list(progresses)
+    return region
+
+
+def test_ImportPoller_wait_returns_once_regions_finish(monkeypatch):
+    """ImportPoller.wait returns when every region finished."""
+    now = [0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(
+        time, "sleep", lambda seconds: now.__setitem__(0, now[0] + seconds))
+    region_one = make_polled_region("region1", [
+        ImportProgress("region1", 50, 100, 0, 1),
+        ImportProgress("region1", 100, 100, 1, 1),
+    ])
+    region_two = make_polled_region("region2", [
+        ImportProgress("region2", 100, 100, 1, 1),
+    ])
+    monkeypatch.setattr(
+        "meta_maas.imports.read_import_progress",
+        lambda region: region.progresses.pop(0))
+    result = ImportPoller([region_one, region_two], min_interval=5).wait()
+    assert result == {
+        "region1": ImportProgress("region1", 100, 100, 1, 1),
+        "region2": ImportProgress("region2", 100, 100, 1, 1),
+    }
+    assert now[0] == 5
+    assert call(Finished("region1")) in region_one.publish.call_args_list
+    assert call(Finished("region2")) in region_two.publish.call_args_list
+
+
+def test_ImportPoller_backs_off_without_progress(monkeypatch):
+    """ImportPoller polls a region less often while it makes no progress."""
+    now = [0]
+    polled_at = []
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(
+        time, "sleep", lambda seconds: now.__setitem__(0, now[0] + seconds))
+    stuck = ImportProgress("region1", 0, 100, 0, 1)
+    region = make_polled_region("region1", [stuck] * 5 + [
+        ImportProgress("region1", 100, 100, 1, 1)])
+
+    def read(region):
+        """Record when the region was polled."""
+        polled_at.append(now[0])
+        return region.progresses.pop(0)
+
+    monkeypatch.setattr("meta_maas.imports.read_import_progress", read)
+    ImportPoller([region], min_interval=5, max_interval=20).wait()
+    assert polled_at == [0, 5, 15, 35, 55, 75]
+
+
+def test_ImportPoller_raises_ImportTimeoutError_at_deadline(monkeypatch):
+    """ImportPoller.wait raises `ImportTimeoutError` at the deadline."""
+    now = [0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(
+        time, "sleep", lambda seconds: now.__setitem__(0, now[0] + seconds))
+    region = make_polled_region("region1", [])
+    monkeypatch.setattr(
+        "meta_maas.imports.read_import_progress",
+        lambda region: ImportProgress("region1", 0, 100, 0, 1))
+    with pytest.raises(ImportTimeoutError) as exc:
+        ImportPoller([region], deadline=30).wait()
+    assert str(exc.value) == (
+        "Timed out waiting for import on regions: region1")
+    assert now[0] == 30
+
+
+def test_ImportPoller_waits_while_region_is_importing():
+    """ImportPoller doesn't finish a region that reports importing."""
+    region = make_polled_region("region1", [], importing=True)
+    assert ImportPoller([region]).is_done(
+        region, ImportProgress("region1", 100, 100, 1, 1)) is False
@@ -0,0 +1,215 @@
+# Copyright 2016 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for `journal.py`."""
+
+import json
+from unittest.mock import MagicMock, Mock, call, sentinel
+
+import pytest
+
+from .. import region as region_module
+from ..journal import (
+    Journal,
+    JournalError,
+    get_digest,
+    get_file_checksum,
+    get_journal_name
+)
+from ..region import MessageLevel
+from ..users import iter_batches
+from .factory import make_Region
+
+
+# Allow test code to access a protected member.
+# pylint: disable=protected-access
+
+
+def test_get_digest_ignores_key_order():
+    """get_digest is the same for equal configuration."""
+    assert get_digest({"a": 1, "b": [1, 2]}) == get_digest(
+        {"b": [1, 2], "a": 1})
+    assert get_digest({"a": 1}) != get_digest({"a": 2})
+
+
+def test_get_journal_name_depends_on_regions():
+    """get_journal_name is the same for the same regions in any order."""
+    assert get_journal_name(["one", "two"]) == get_journal_name(
+        ["two", "one"])
+    assert get_journal_name(["one"]) != get_journal_name(["one", "two"])
+
+
+def test_get_file_checksum_changes_with_file(tmpdir):
+    """get_file_checksum is calculated again when the file changes."""
+    path = tmpdir.join("image")
+    path.write_binary(b"one")
+    first = get_file_checksum(str(path))
+    path.write_binary(b"two!")
+    assert get_file_checksum(str(path)) != first
+
+
+def test_Journal_records_entries_to_file(tmpdir):
+    """Journal writes each entry as a JSON line."""
+    path = tmpdir.join("journal.jsonl")
+    journal = Journal(str(path))
+    journal.record("region", "users", "all")
+    journal.record("region", "custom", "image", "abc")
+    journal.close()
+    assert [json.loads(line) for line in path.readlines()] == [
+        {"region": "region", "op": "users", "key": "all", "digest": None},
+        {"region": "region", "op": "custom", "key": "image", "digest": "abc"},
+    ]
+    assert journal.is_done("region", "custom", "image", "abc") is True
+    assert journal.is_done("region", "custom", "image", "def") is False
+    assert journal.is_done("other", "custom", "image", "abc") is False
+
+
+def test_Journal_resume_loads_previous_entries(tmpdir):
+    """Journal loads the entries of the previous run when resuming."""
+    path = tmpdir.join("journal.jsonl")
+    journal = Journal(str(path))
+    journal.record("region", "sync", "region", "abc")
+    journal.close()
+    # A killed run can leave a partial last line.
+    with open(str(path), "a") as stream:
+        stream.write('{"region": "reg')
+    resumed = Journal(str(path), resume=True)
+    resumed.close()
+    assert resumed.is_done("region", "sync", "region", "abc") is True
+    restarted = Journal(str(path))
+    restarted.close()
+    assert restarted.is_done("region", "sync", "region", "abc") is False
+
+
+def test_Journal_remove_deletes_file(tmpdir):
+    """Journal.remove deletes the journal."""
+    path = tmpdir.join("journal.jsonl")
+    Journal(str(path)).remove()
+    assert path.check() is False
+
+
+def test_Journal_raises_JournalError_when_cannot_open(tmpdir):
+    """Journal raises `JournalError` when the file cannot be opened."""
+    path = tmpdir.join("missing", "journal.jsonl")
+    with pytest.raises(JournalError):
+        Journal(str(path))
+
+
+def make_journaled_Region(tmpdir, *, resume=False):
+    """Make a `Region` with a journal in `tmpdir`."""
+    region = make_Region()
+    region.journal = Journal(
+        str(tmpdir.join("journal.jsonl")), resume=resume)
+    return region
+
+
+def test_Region_sync_skips_region_completed_by_previous_run(tmpdir):
+    """Region.sync skips a region the resumed journal has as synced."""
+    users = {'admin': {'password': 'pass'}}
+    region = make_journaled_Region(tmpdir)
+    region.sync(users, {}, journal=region.journal)
+    region.journal.close()
+    region = make_journaled_Region(tmpdir, resume=True)
+    region.sync(users, {}, journal=region.journal)
+    region.journal.close()
+    assert region.origin.Users.read.called is False
+    assert region.message.call_args == call(
+        "already synced; skipped", level=MessageLevel.SUCCESS)
+
+
+def test_Region_sync_resyncs_when_config_changed(tmpdir):
+    """Region.sync doesn't skip work when the config has changed."""
+    region = make_journaled_Region(tmpdir)
+    region.sync({'admin': {'password': 'pass'}}, {}, journal=region.journal)
+    region.journal.close()
+    region = make_journaled_Region(tmpdir, resume=True)
+    region.sync({'bob': {'password': 'pass'}}, {}, journal=region.journal)
+    region.journal.close()
+    assert region.origin.Users.read.called is True
+
+
+def test_Region_sync_users_skips_journaled_batches(tmpdir, monkeypatch):
+    """Region.sync_users skips the batches the resumed journal has as
+    synced."""
+    monkeypatch.setattr(
+        region_module, "iter_batches", lambda users: iter_batches(users, 1))
+    users = {'admin': {'password': 'pass'}, 'bob': {'password': 'pass'}}
+    region = make_journaled_Region(tmpdir)
+    region.journal.record(
+        region.name, "users",
+        region._get_digest([("admin", {'password': 'pass'})]))
+    region.journal.close()
+    region = make_journaled_Region(tmpdir, resume=True)
+    region.origin.Users.read.return_value = []
+    region.sync_users(users)
+    region.journal.close()
+    assert region.origin.Users.create.call_args_list == [
+        call('bob', 'pass', email=None, is_admin=False)]
+
+
+def test_Region_sync_users_doesnt_read_when_batches_journaled(tmpdir):
+    """Region.sync_users doesn't read the region's users when every batch
+    was synced by the interrupted run."""
+    region = make_journaled_Region(tmpdir)
+    region.journal.record(
+        region.name, "users",
+        region._get_digest([("admin", {'password': 'pass'})]))
+    region.journal.close()
+    region = make_journaled_Region(tmpdir, resume=True)
+    region.sync_users({'admin': {'password': 'pass'}})
+    region.journal.close()
+    assert region.origin.Users.read.called is False
+
+
+def test_Region__update_selections_imports_journaled_selections(tmpdir):
+    """A selection the interrupted run created still requires an import
+    when the run didn't start it."""
+    selection = MagicMock(os="ubuntu", release="xenial", arches=["amd64"])
+    selections = {"ubuntu": {"releases": ["xenial"], "arches": ["amd64"]}}
+    region = make_journaled_Region(tmpdir)
+    region._create_selection(sentinel.source, "ubuntu", "xenial", ["amd64"])
+    region.journal.close()
+    region = make_journaled_Region(tmpdir, resume=True)
+    region.origin.BootSourceSelections.read.return_value = [selection]
+    assert region._update_selections(
+        sentinel.source, selections, False) is True
+    region._record("import", "started")
+    assert region._update_selections(
+        sentinel.source, selections, False) is False
+    region.journal.close()
+
+
+def test_Region_sync_custom_skips_journaled_upload(tmpdir):
+    """Region.sync_custom skips an image uploaded with the same checksum."""
+    image = tmpdir.join("image.tgz")
+    image.write_binary(b"image")
+    info = {'path': str(image), 'architecture': 'amd64/generic'}
+    region = make_journaled_Region(tmpdir)
+    region.sync_custom("image", info)
+    region.journal.close()
+    region = make_journaled_Region(tmpdir, resume=True)
+    region.sync_custom("image", info)
+    assert region.origin.BootResources.create.called is False
+    image.write_binary(b"changed image")
+    region.sync_custom("image", info)
+    region.journal.close()
+    assert region.origin.BootResources.create.called is True
+
+
+def test_Region_sync_source_skip_requests_pending_import(tmpdir):
+    """A skipped source requests the import the killed run didn't start."""
+    region = make_journaled_Region(tmpdir)
+    source = {
+        'url': 'http://images.maas.io/ephemeral-v3/daily/',
+        'keyring_filename': '/path/to/keyring',
+        'selections': {},
+    }
+    region._get_matching_source = Mock(return_value=(None, False))
+    region._update_selections = Mock(return_value=False)
+    region.sync_source(source)
+    region.journal.close()
+    region = make_journaled_Region(tmpdir, resume=True)
+    region.sync_source(source)
+    region.journal.close()
+    assert region.origin.BootSources.create.called is False
+    assert region.imports.reasons == ["resumed pending import"]
@@ -0,0 +1,43 @@
+# Copyright 2016 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for `metrics.py`."""
+
+import json
+
+import pytest
+
+from ..metrics import MetricsError, collect_metrics, write_metrics
+from ..region import Region
+
+
+def make_regions():
+    """Make two regions."""
+    return [
+        Region("region1", "http://region1:5240/MAAS", "apikey1"),
+        Region("region2", "http://region2:5240/MAAS", "apikey2"),
+    ]
+
+
+def test_collect_metrics_has_limit_of_each_region():
+    """collect_metrics has the concurrency limit of each region."""
+    metrics = collect_metrics(make_regions())
+    assert sorted(metrics["regions"]) == ["region1", "region2"]
+    assert metrics["regions"]["region1"] == {
+        "concurrency_limit": 1, "in_flight": 0, "calls": 0, "backoffs": 0,
+        "circuit_open": False, "phases": {}, "bytes_uploaded": 0,
+    }
+
+
+def test_write_metrics_writes_json(tmpdir):
+    """write_metrics writes the metrics as JSON."""
+    path = tmpdir.join("metrics.json")
+    regions = make_regions()
+    write_metrics(str(path), regions)
+    assert json.loads(path.read()) == collect_metrics(regions)
+
+
+def test_write_metrics_raises_MetricsError(tmpdir):
+    """write_metrics raises `MetricsError` when the file can't be written."""
+    with pytest.raises(MetricsError):
+        write_metrics(str(tmpdir.join("missing", "metrics.json")), [])
@@ -0,0 +1,249 @@
+# Copyright 2016 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for `mirror.py`."""
+
+import hashlib
+import json
+import os
+import threading
+import urllib.request
+
+import pytest
+
+from ..mirror import (
+    MANIFEST_FILENAME,
+    Mirror,
+    MirrorError,
+    apply_mirror,
+    is_selected,
+    make_server
+)
+
+
+SELECTIONS = {
+    "ubuntu": {
+        "releases": ["xenial"],
+        "arches": ["amd64"],
+    },
+}
+
+
+def make_item(upstream, path, content):
+    """Write `content` to `path` in `upstream` and return its item."""
+    item_path = upstream.join(path)
+    item_path.ensure()
+    item_path.write_binary(content)
+    return {
+        "path": path,
+        "sha256": hashlib.sha256(content).hexdigest(),
+        "size": len(content),
+    }
+
+
+def make_upstream(tmpdir):
+    """Make a local stand-in for an upstream simplestreams source."""
+    upstream = tmpdir.join("upstream")
+    products = {
+        "products": {
+            "xenial-amd64": {
+                "os": "ubuntu", "release": "xenial", "arch": "amd64",
+                "versions": {
+                    "20161001": {"items": {
+                        "squashfs": make_item(
+                            upstream, "xenial/amd64/20161001/squashfs",
+                            b"old"),
+                    }},
+                    "20161020": {"items": {
+                        "squashfs": make_item(
+                            upstream, "xenial/amd64/20161020/squashfs",
+                            b"new"),
+                        "boot-kernel": make_item(
+                            upstream, "xenial/amd64/20161020/boot-kernel",
+                            b"kernel"),
+                    }},
+                },
+            },
+            "trusty-amd64": {
+                "os": "ubuntu", "release": "trusty", "arch": "amd64",
+                "versions": {
+                    "20161020": {"items": {
+                        "squashfs": make_item(
+                            upstream, "trusty/amd64/20161020/squashfs",
+                            b"trusty"),
+                    }},
+                },
+            },
+            "grub-efi-amd64": {
+                "os": "grub-efi", "arch": "amd64",
+                "bootloader-type": "uefi",
+                "versions": {
+                    "20161020": {"items": {
+                        "grub": make_item(
+                            upstream, "bootloaders/uefi/amd64/grub.tar.xz",
+                            b"grub"),
+                    }},
+                },
+            },
+        },
+    }
+    products_path = upstream.join("streams/v1/com.ubuntu.maas:v3.json")
+    products_path.ensure()
+    products_path.write(json.dumps(products))
+    upstream.join("streams/v1/com.ubuntu.maas:v3.sjson").write("signed")
+    upstream.join("streams/v1/index.json").write(json.dumps({
+        "index": {
+            "com.ubuntu.maas:v3": {
+                "path": "streams/v1/com.ubuntu.maas:v3.json",
+            },
+        },
+    }))
+    return upstream
+
+
+def test_is_selected_matches_release_and_arch():
+    """is_selected matches the product's release and arch."""
+    assert is_selected(
+        {"os": "ubuntu", "release": "xenial", "arch": "amd64"}, SELECTIONS)
+    assert not is_selected(
+        {"os": "ubuntu", "release": "xenial", "arch": "i386"}, SELECTIONS)
+    assert not is_selected(
+        {"os": "centos", "release": "centos70", "arch": "amd64"},
+        SELECTIONS)
+
+
+def test_is_selected_always_selects_bootloaders():
+    """is_selected selects every bootloader."""
+    assert is_selected({"os": "pxelinux", "bootloader-type": "pxe"}, {})
+
+
+def test_Mirror_sync_downloads_latest_selected_items(tmpdir):
+    """Mirror.sync downloads the latest version of the selected products and
+    copies the metadata as-is."""
+    upstream = make_upstream(tmpdir)
+    local = tmpdir.join("mirror")
+    mirror = Mirror(str(local), "file://%s" % upstream, SELECTIONS)
+    assert mirror.sync() == (3, 0)
+    assert local.join("xenial/amd64/20161020/squashfs").read() == "new"
+    assert local.join("xenial/amd64/20161020/boot-kernel").check()
+    assert local.join("bootloaders/uefi/amd64/grub.tar.xz").check()
+    assert not local.join("xenial/amd64/20161001/squashfs").check()
+    assert not local.join("trusty/amd64/20161020/squashfs").check()
+    assert local.join("streams/v1/index.json").read() == (
+        upstream.join("streams/v1/index.json").read())
+    assert local.join("streams/v1/com.ubuntu.maas:v3.sjson").read() == (
+        "signed")
+
+
+def test_Mirror_sync_skips_verified_items(tmpdir):
+    """Mirror.sync doesn't download items already in the mirror."""
+    upstream = make_upstream(tmpdir)
+    local = tmpdir.join("mirror")
+    mirror = Mirror(str(local), "file://%s" % upstream, SELECTIONS)
+    mirror.sync()
+    downloaded = []
+    assert Mirror(str(local), "file://%s" % upstream, SELECTIONS).sync(
+        progress_callback=downloaded.append) == (0, 3)
+    assert downloaded == []
+
+
+def test_Mirror_sync_downloads_item_again_when_changed(tmpdir):
+    """Mirror.sync downloads an item again when the local file changed."""
+    upstream = make_upstream(tmpdir)
+    local = tmpdir.join("mirror")
+    Mirror(str(local), "file://%s" % upstream, SELECTIONS).sync()
+    local.join("xenial/amd64/20161020/squashfs").write("corrupt")
+    assert Mirror(str(local), "file://%s" % upstream, SELECTIONS).sync() == (
+        1, 2)
+    assert local.join("xenial/amd64/20161020/squashfs").read() == "new"
+
+
+def test_Mirror_sync_raises_MirrorError_on_checksum_mismatch(tmpdir):
+    """Mirror.sync raises `MirrorError` when an item doesn't match its
+    checksum and doesn't keep the file."""
+    upstream = make_upstream(tmpdir)
+    upstream.join("xenial/amd64/20161020/squashfs").write("tampered")
+    local = tmpdir.join("mirror")
+    with pytest.raises(MirrorError) as exc:
+        Mirror(str(local), "file://%s" % upstream, SELECTIONS).sync()
+    assert str(exc.value) == (
+        "Checksum mismatch: xenial/amd64/20161020/squashfs")
+    assert not local.join("xenial/amd64/20161020/squashfs").check()
+    assert not local.join("xenial/amd64/20161020/squashfs.part").check()
+
+
+def test_Mirror_sync_raises_MirrorError_when_upstream_missing(tmpdir):
+    """Mirror.sync raises `MirrorError` when upstream cannot be fetched."""
+    local = tmpdir.join("mirror")
+    with pytest.raises(MirrorError):
+        Mirror(
+            str(local), "file://%s" % tmpdir.join("missing"),
+            SELECTIONS).sync()
+
+
+def test_Mirror_rejects_paths_outside_the_mirror(tmpdir):
+    """Mirror doesn't write files outside of its directory."""
+    mirror = Mirror(str(tmpdir.join("mirror")), "file:///", SELECTIONS)
+    with pytest.raises(MirrorError):
+        mirror._local_path(  # pylint: disable=protected-access
+            "../outside")
+
+
+def test_Mirror_sync_writes_manifest(tmpdir):
+    """Mirror.sync records the checksum of each downloaded item."""
+    upstream = make_upstream(tmpdir)
+    local = tmpdir.join("mirror")
+    Mirror(str(local), "file://%s" % upstream, SELECTIONS).sync()
+    manifest = json.loads(local.join(MANIFEST_FILENAME).read())
+    assert manifest["xenial/amd64/20161020/squashfs"] == (
+        hashlib.sha256(b"new").hexdigest())
+
+
+def test_make_server_serves_the_mirror(tmpdir):
+    """make_server serves the files in the mirror over HTTP."""
+    tmpdir.join("streams/v1/index.json").ensure().write("{}")
+    server = make_server(str(tmpdir), "127.0.0.1:0")
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        url = "http://127.0.0.1:%d/streams/v1/index.json" % (
+            server.server_address[1])
+        with urllib.request.urlopen(url) as response:
+            assert response.read() == b"{}"
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert os.getcwd() != str(tmpdir)
+
+
+def test_make_server_raises_MirrorError_on_invalid_listen(tmpdir):
+    """make_server raises `MirrorError` when listen has no valid port."""
+    with pytest.raises(MirrorError):
+        make_server(str(tmpdir), "localhost")
+
+
+def test_apply_mirror_points_source_at_mirror():
+    """apply_mirror replaces the source URL with the mirror URL."""
+    images = {
+        'source': {
+            'url': 'http://images.maas.io/ephemeral-v3/daily/',
+            'keyring_filename': '/keyring.gpg',
+            'selections': SELECTIONS,
+        },
+    }
+    assert apply_mirror(images, {'url': 'http://mirror:8000/'}) == {
+        'source': {
+            'url': 'http://mirror:8000/',
+            'keyring_filename': '/keyring.gpg',
+            'selections': SELECTIONS,
+        },
+    }
+    assert images['source']['url'] == (
+        'http://images.maas.io/ephemeral-v3/daily/')
+
+
+def test_apply_mirror_returns_images_without_mirror():
+    """apply_mirror returns the images unchanged without a mirror."""
+    images = {'custom': {}}
+    assert apply_mirror(images, None) is images
+    assert apply_mirror(images, {'url': 'http://mirror:8000/'}) is images
@@ -0,0 +1,66 @@
+# Copyright 2016 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for `parallel.py`."""
+
+import asyncio
+import threading
+
+import pytest
+
+from ..parallel import ensure_event_loop, run_parallel
+
+
+def test_run_parallel_returns_results_in_order():
+    """run_parallel returns the results in the order of the items."""
+    assert run_parallel(lambda item: item * 2, range(10), jobs=4) == [
+        item * 2 for item in range(10)]
+
+
+def test_run_parallel_runs_serially_with_one_job():
+    """run_parallel calls `func` in the calling thread with one job."""
+    threads = run_parallel(
+        lambda _item: threading.current_thread(), range(3), jobs=1)
+    assert threads == [threading.current_thread()] * 3
+
+
+def test_run_parallel_gives_each_thread_an_event_loop():
+    """run_parallel sets an event loop in each worker thread."""
+    loops = run_parallel(
+        lambda _item: asyncio.get_event_loop(), range(4), jobs=4)
+    assert all(loop is not None for loop in loops)
+
+
+def test_run_parallel_closes_the_event_loops():
+    """run_parallel closes the event loop of each worker thread."""
+    loops = run_parallel(
+        lambda _item: asyncio.get_event_loop(), range(4), jobs=4)
+    assert all(loop.is_closed() for loop in loops)
+
+
+def test_ensure_event_loop_keeps_an_existing_loop():
+    """ensure_event_loop doesn't replace or close the thread's own loop."""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        with ensure_event_loop():
+            assert asyncio.get_event_loop() is loop
+        assert loop.is_closed() is False
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+def test_run_parallel_raises_after_all_calls_finish():
+    """run_parallel re-raises the exception once every call has finished."""
+    called = []
+
+    def func(item):
+        """Fail on the first item."""
+        called.append(item)
+        if item == 0:
+            raise ValueError(item)
+
+    with pytest.raises(ValueError):
+        run_parallel(func, range(5), jobs=2)
+    assert sorted(called) == list(range(5))
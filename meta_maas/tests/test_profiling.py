@@ -0,0 +1,83 @@
+# Copyright 2016 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for `profiling.py`."""
+
+import pstats
+import sys
+import time
+from unittest.mock import MagicMock
+
+from .. import profiling as profiling_module
+from ..profiling import Profiler, collapse_stack
+
+
+def busy(seconds):
+    """Keep the CPU busy for `seconds`."""
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        pass
+
+
+def test_collapse_stack_joins_frames_from_root():
+    """collapse_stack ends with the given frame."""
+    stack = collapse_stack(sys._getframe())  # pylint: disable=protected-access
+    assert stack.endswith(
+        ";test_profiling.py:test_collapse_stack_joins_frames_from_root")
+
+
+def test_Profiler_does_nothing_without_directory():
+    """Profiler doesn't profile when not given a directory."""
+    profiler = Profiler(None)
+    with profiler.sampling():
+        with profiler.phase("phase", memory=True):
+            pass
+    assert profiler.enabled is False
+    assert profiler.stacks == {}
+
+
+def test_Profiler_phase_writes_pstats(tmpdir):
+    """Profiler.phase writes the cProfile data of the phase."""
+    profiler = Profiler(str(tmpdir))
+    with profiler.phase("sync-region/1"):
+        busy(0.01)
+    stats = pstats.Stats(str(tmpdir.join("sync-region_1.pstats")))
+    assert any(function[2] == "busy" for function in stats.stats)
+
+
+def test_Profiler_phase_writes_skipped_when_cprofile_busy(
+        tmpdir, monkeypatch):
+    """Profiler.phase writes why a phase wasn't profiled when another
+    profiler is active."""
+    profile_class = MagicMock()
+    profile_class.return_value.enable.side_effect = ValueError(
+        "Another profiling tool is already active")
+    monkeypatch.setattr(profiling_module.cProfile, "Profile", profile_class)
+    profiler = Profiler(str(tmpdir))
+    with profiler.phase("sync-region1"):
+        pass
+    assert tmpdir.join("sync-region1.pstats").check() is False
+    assert tmpdir.join("sync-region1.skipped.txt").read().startswith(
+        "cProfile skipped: Another profiling tool is already active")
+
+
+def test_Profiler_phase_writes_top_allocations(tmpdir):
+    """Profiler.phase writes the top allocations when tracing memory."""
+    profiler = Profiler(str(tmpdir))
+    with profiler.phase("report", memory=True):
+        data = [str(index) * 10 for index in range(10000)]
+    assert len(data) == 10000
+    allocations = tmpdir.join("report.tracemalloc.txt").read()
+    assert "test_profiling.py" in allocations
+
+
+def test_Profiler_sampling_writes_collapsed_stacks(tmpdir):
+    """Profiler.sampling writes the sampled stacks of every thread."""
+    profiler = Profiler(str(tmpdir), interval=0.001)
+    with profiler.sampling():
+        busy(0.1)
+    lines = tmpdir.join("stacks.collapsed").read().splitlines()
+    assert any("test_profiling.py:busy" in line for line in lines)
+    stack, count = lines[0].rsplit(" ", 1)
+    assert int(count) > 0
+    assert stack.startswith("MainThread;")
@@ -3,51 +3,37 @@
 
 """Tests for `region.py`."""
 
-import random
-import signal
-import sys
 import time
 from unittest.mock import ANY, MagicMock, Mock, call, sentinel
 
 import pytest
-from colorclass import Color
-from maas.client.bones import CallError
 from maas.client.viscera.boot_resources import BootResourceFileType
 from maas.client.viscera.users import User
 
 from .. import region as region_module
+from .. import resilience as resilience_module
+from ..events import EventBus, Finished, Message, Progress
 from ..region import MessageLevel, Region
+from ..resilience import CircuitBreaker, CircuitOpenError
+from .factory import make_Region
 
 
 # Allow test code to access a protected member.
 # pylint: disable=protected-access
 
 
-def make_Region(quiet=True):
-    """Make a `Region`.
-
-    `origin` and `pring_msg` are pre-mocked.
-    """
-    region = Region(
-        'region1', 'http://localhost:5240/MAAS', 'apikey1', quiet=quiet)
-    region.origin = MagicMock()
-    region.print_msg = Mock()
-    return region
-
-
 def test_Region__init__sets_properties():
     """Test Region.__init__ sets up class properties."""
     name = 'region1'
     url = 'http://localhost:5240/MAAS'
     apikey = 'apikey1'
-    quiet = random.choice([True, False])
-    region = Region(name, url, apikey, quiet=quiet)
+    region = Region(name, url, apikey, events=sentinel.events)
     assert region.profile is None
     assert region.origin is None
     assert region.name == name
     assert region.url == url
     assert region.apikey == apikey
-    assert region.quiet == quiet
+    assert region.events == sentinel.events
 
 
 def test_Region_connect_calls_Origin_connect(monkeypatch):
@@ -55,8 +41,7 @@ def test_Region_connect_calls_Origin_connect(monkeypatch):
     name = 'region1'
     url = 'http://localhost:5240/MAAS'
     apikey = 'apikey1'
-    quiet = random.choice([True, False])
-    region = Region(name, url, apikey, quiet=quiet)
+    region = Region(name, url, apikey)
     mock_connect = MagicMock()
     mock_connect.return_value = (sentinel.profile, sentinel.origin)
     monkeypatch.setattr(region_module.Origin, "connect", mock_connect)
@@ -64,6 +49,7 @@ def test_Region_connect_calls_Origin_connect(monkeypatch):
     assert mock_connect.call_args == call(url, apikey=apikey)
     assert region.profile == sentinel.profile
     assert region.origin == sentinel.origin
+    assert region.imports.origin == sentinel.origin
 
 
 def test_Region_sync_calls_sync_users_then_images():
@@ -74,17 +60,55 @@ def test_Region_sync_calls_sync_users_then_images():
     region.sync(sentinel.users, sentinel.images)
     assert region.sync_users.call_args == call(sentinel.users)
     assert region.sync_images.call_args == call(sentinel.images)
-    assert region.print_msg.call_args == call(
+    assert region.message.call_args == call(
         "sync finished", level=MessageLevel.SUCCESS)
 
 
+def test_Region_sync_publishes_Finished():
+    """Test Region.sync publishes `Finished` once done."""
+    region = make_Region()
+    region.events = Mock()
+    region.sync_users = Mock()
+    region.sync_images = Mock()
+    region.sync(sentinel.users, sentinel.images)
+    assert region.events.publish.call_args == call(Finished('region1'))
+
+
+def test_Region_sync_starts_single_import_once_synced():
+    """Test Region.sync starts one import for every requested reason."""
+    region = make_Region()
+    region.origin.BootResources._handler.is_importing.return_value = False
+
+    def sync_images(_images):
+        """Request two imports."""
+        region.imports.request("created image source")
+        region.imports.request("updated selections")
+
+    region.sync_users = Mock()
+    region.sync_images = sync_images
+    region.sync(sentinel.users, sentinel.images)
+    assert region.origin.BootResources.start_import.call_count == 1
+    assert call(
+        "started import; created image source, updated selections",
+        level=MessageLevel.SUCCESS) in region.message.call_args_list
+
+
+def test_Region_sync_doesnt_start_import_when_nothing_changed():
+    """Test Region.sync doesn't start an import when nothing changed."""
+    region = make_Region()
+    region.sync_users = Mock()
+    region.sync_images = Mock()
+    region.sync(sentinel.users, sentinel.images)
+    assert region.origin.BootResources.start_import.called is False
+
+
 def test_Region_sync_users_handles_None():
     """Test Region.sync_users does nothing when empty."""
     region = make_Region()
     region.origin.Users.read.return_value = []
     region.sync_users(None)
     assert region.origin.Users.create.called is False
-    assert region.print_msg.called is False
+    assert region.message.called is False
 
 
 def test_Region_sync_users_creates_missing_users():
@@ -109,14 +133,35 @@ def test_Region_sync_users_creates_missing_users():
         region.origin.Users.create.call_args_list)
     assert (
         call("created user 'admin1'.", level=MessageLevel.SUCCESS) in
-        region.print_msg.call_args_list)
+        region.message.call_args_list)
     assert (
         call(
             'user2', 'password2', email=None, is_admin=False) in
         region.origin.Users.create.call_args_list)
     assert (
         call("created user 'user2'.", level=MessageLevel.SUCCESS) in
-        region.print_msg.call_args_list)
+        region.message.call_args_list)
+
+def test_Region_sync_users_reads_users_file(tmpdir):
+    """Test Region.sync_users creates the missing users from a file."""
+    path = tmpdir.join("users.csv")
+    path.write(
+        "username,email,password\n"
+        "admin1,admin1@localhost,password1\n"
+        "user2,user2@localhost,password2\n")
+    region = make_Region()
+    region.origin.Users.read.return_value = [
+        User({
+            "username": "admin1",
+            "email": "admin1@localhost",
+            "is_superuser": True,
+        })
+    ]
+    region.sync_users(str(path))
+    assert region.origin.Users.create.call_args_list == [
+        call('user2', 'password2', email='user2@localhost', is_admin=False),
+    ]
+
 
 def test_Region_sync_users_prints_warn_on_update():
     """Test Region.sync_users prints warning on update."""
@@ -140,7 +185,7 @@ def test_Region_sync_users_prints_warn_on_update():
         call(
             "unable to update user 'admin1'; API doesn't support "
             "user updating", level=MessageLevel.WARN) in
-        region.print_msg.call_args_list)
+        region.message.call_args_list)
 
 
 def test_Region_sync_images_calls_sync_source_when_source_in_images():
@@ -201,7 +246,7 @@ def test_Region_sync_source_does_nothing_if_source_matches():
     })
     assert call(
         "image source unchanged: '%s'" % source.url,
-        level=MessageLevel.SUCCESS, replace=True) == region.print_msg.call_args
+        level=MessageLevel.SUCCESS) == region.message.call_args
 
 
 def test_Region_sync_source_deletes_source_when_keyring_mismatch():
@@ -222,10 +267,10 @@ def test_Region_sync_source_deletes_source_when_keyring_mismatch():
     assert (
         call(url=source.url, keyring_filename='/new/keyring.gpg') ==
         region.origin.BootSources.create.call_args)
-    assert region.origin.BootResources.start_import.called is True
+    assert region.imports.reasons == ["updated image source"]
     assert call(
-        "updated image source '%s'; started import" % source.url,
-        level=MessageLevel.SUCCESS, replace=True) == region.print_msg.call_args
+        "updated image source '%s'" % source.url,
+        level=MessageLevel.SUCCESS) == region.message.call_args
 
 
 def test_Region_sync_source_creates_new_source():
@@ -241,10 +286,10 @@ def test_Region_sync_source_creates_new_source():
     assert (
         call(url="http://my/source", keyring_filename='/new/keyring.gpg') ==
         region.origin.BootSources.create.call_args)
-    assert region.origin.BootResources.start_import.called is True
+    assert region.imports.reasons == ["created image source"]
     assert call(
-        "created image source 'http://my/source'; started import",
-        level=MessageLevel.SUCCESS, replace=True) == region.print_msg.call_args
+        "created image source 'http://my/source'",
+        level=MessageLevel.SUCCESS) == region.message.call_args
 
 
 def test_Region__get_matching_source_deletes_not_matching_sources():
@@ -289,199 +334,42 @@ def test_Region__get_matching_source_finds_match():
     assert updated is False
 
 
-def test_Region__update_selections_deletes_not_matching_os():
-    """Test Region._update_selections deletes selection when os missing."""
-    region = make_Region()
-    region._force_cache_update = Mock()
-    delete_selection = MagicMock()
-    delete_selection.os = "invalid"
-    region.origin.BootSourceSelections.read.return_value = [delete_selection]
-    updated = region._update_selections(sentinel.source, {}, False)
-    assert delete_selection.delete.called is True
-    assert updated is True
-
-
-def test_Region__update_selections_removes_mismatch_and_creates_new_release():
-    """Test Region._update_selections deletes selection when release missing."""
-    region = make_Region()
-    region._force_cache_update = Mock()
-    region._create_selection = Mock()
-    delete_selection = MagicMock()
-    delete_selection.os = "ubuntu"
-    delete_selection.release = "invalid"
-    region.origin.BootSourceSelections.read.return_value = [delete_selection]
-    updated = region._update_selections(sentinel.source, {
-        "ubuntu": {
-            "releases": ["trusty"],
-            "arches": ["amd64"],
-        }
-    }, False)
-    assert delete_selection.delete.called is True
-    assert (
-        call(sentinel.source, "ubuntu", "trusty", ["amd64"], retry=True) ==
-        region._create_selection.call_args)
-    assert updated is True
-
-
-def test_Region__update_selections_removes_mismatch_and_creates_new_arches():
-    """Test Region._update_selections deletes selection when release missing
-    correct architectures."""
-    region = make_Region()
-    region._force_cache_update = Mock()
-    region._create_selection = Mock()
-    delete_selection = MagicMock()
-    delete_selection.os = "ubuntu"
-    delete_selection.release = "trusty"
-    delete_selection.arches = ["amd64", "i386"]
-    region.origin.BootSourceSelections.read.return_value = [delete_selection]
-    updated = region._update_selections(sentinel.source, {
-        "ubuntu": {
-            "releases": ["trusty"],
-            "arches": ["amd64", "arm64"],
-        }
-    }, False)
-    assert delete_selection.delete.called is True
-    assert (
-        call(
-            sentinel.source,
-            "ubuntu", "trusty", ["amd64", "arm64"],
-            retry=True) ==
-        region._create_selection.call_args)
-    assert updated is True
-
-
-def test_Region__update_selections_does_nothing_if_all_matches():
-    """Test Region._update_selections deletes selection when release missing
-    correct architectures."""
-    region = make_Region()
-    region._force_cache_update = Mock()
-    region._create_selection = Mock()
-    keep_selection = MagicMock()
-    keep_selection.os = "ubuntu"
-    keep_selection.release = "trusty"
-    keep_selection.arches = ["amd64", "i386"]
-    region.origin.BootSourceSelections.read.return_value = [keep_selection]
-    updated = region._update_selections(sentinel.source, {
-        "ubuntu": {
-            "releases": ["trusty"],
-            "arches": ["i386", "amd64"],
-        }
-    }, False)
-    assert keep_selection.delete.called is False
-    assert region._create_selection.called is False
-    assert updated is False
-
-
-def test_Region__update_selections_passes_updated_through():
-    """Test Region._update_selections passes updated value through."""
-    region = make_Region()
-    region._force_cache_update = Mock()
-    region.origin.BootSourceSelections.read.return_value = []
-    updated = region._update_selections(sentinel.source, {}, True)
-    assert updated is True
-
-
-def test_Region__update_selections_updated_calls_force_cache_update():
-    """Test Region._update_selections calls `_force_cache_update` when
-    updated."""
-    region = make_Region()
-    region._force_cache_update = Mock()
-    region.origin.BootSourceSelections.read.return_value = []
-    updated = region._update_selections(sentinel.source, {}, True)
-    assert updated is True
-    assert region._force_cache_update.called is True
-
-
-def test_Region__create_selection_works_on_first_try():
-    """Test Region._create_selection only calls create once when it works with
-    retry set to True."""
-    region = make_Region()
-    region._create_selection(
-        sentinel.source, sentinel.os_name, sentinel.release, sentinel.arches,
-        retry=True)
-    assert region.origin.BootSourceSelections.create.call_count == 1
-
-
-def test_Region__create_selection_works_on_fifth_try(monkeypatch):
-    """Test Region._create_selection works after 5 times of trying."""
-    region = make_Region()
-    region.origin.BootSourceSelections.create.side_effect = [
-        CallError(MagicMock(), MagicMock(), b"", None),
-        CallError(MagicMock(), MagicMock(), b"", None),
-        CallError(MagicMock(), MagicMock(), b"", None),
-        CallError(MagicMock(), MagicMock(), b"", None),
-        None,
-    ]
-    # Speed up test by makin time.sleep a no-op.
-    monkeypatch.setattr(time, "sleep", lambda *_args: None)
-    region._create_selection(
-        sentinel.source, sentinel.os_name, sentinel.release, sentinel.arches,
-        retry=True)
-    assert region.origin.BootSourceSelections.create.call_count == 5
-
-
-def test_Region__create_selection_raises_error_on_fifth_failure(monkeypatch):
-    """Test Region._create_selection raises error when the fifth time fails."""
-    region = make_Region()
-    region.origin.BootSourceSelections.create.side_effect = [
-        CallError(MagicMock(), MagicMock(), b"", None),
-        CallError(MagicMock(), MagicMock(), b"", None),
-        CallError(MagicMock(), MagicMock(), b"", None),
-        CallError(MagicMock(), MagicMock(), b"", None),
-        CallError(MagicMock(), MagicMock(), b"", None),
-    ]
-    # Speed up test by makin time.sleep a no-op.
-    monkeypatch.setattr(time, "sleep", lambda *_args: None)
-    with pytest.raises(CallError):
-        region._create_selection(
-            sentinel.source, sentinel.os_name, sentinel.release,
-            sentinel.arches, retry=True)
-    assert region.origin.BootSourceSelections.create.call_count == 5
-
-
-def test_Region__create_selection_raises_error_on_failure_no_retry():
-    """Test Region._create_selection doesn't retry when told not to."""
-    region = make_Region()
-    region.origin.BootSourceSelections.create.side_effect = CallError(
-        MagicMock(), MagicMock(), b"", None)
-    with pytest.raises(CallError):
-        region._create_selection(
-            sentinel.source, sentinel.os_name, sentinel.release,
-            sentinel.arches, retry=False)
-    assert region.origin.BootSourceSelections.create.call_count == 1
-
-
-def test_Region__force_cache_update_calls_start_and_stop_with_tty(monkeypatch):
+def test_Region__force_cache_update_calls_start_and_stop(monkeypatch):
     """Test Region._force_cache_update calls `start_import` and `stop_import`
-    printing a status updating message when running in a tty."""
+    publishing a waiting message."""
     region = make_Region()
-    monkeypatch.setattr(sys.stdout, "isatty", lambda: True)
+    region.origin.BootResources._handler.is_importing.return_value = False
     monkeypatch.setattr(time, "sleep", lambda *_args: None)
     region._force_cache_update()
     assert region.origin.BootResources.start_import.called is True
     assert region.origin.BootResources.stop_import.called is True
     assert [
-        call(
-            "waiting for image source cache to be synced .",
-            newline=False, replace=False),
-        call(
-            "waiting for image source cache to be synced ..",
-            newline=False, replace=True),
-        call(
-            "waiting for image source cache to be synced ...",
-            newline=False, replace=True)] == region.print_msg.call_args_list
+        call("waiting for image source cache to be synced"),
+    ] == region.message.call_args_list
 
 
-def test_Region__force_cache_update_calls_start_and_stop_wo_tty(monkeypatch):
-    """Test Region._force_cache_update calls `start_import` and `stop_import`
-    not printing any information."""
+def test_Region__force_cache_update_leaves_running_import():
+    """Test Region._force_cache_update doesn't stop an import that's
+    already running on the region."""
     region = make_Region()
-    monkeypatch.setattr(sys.stdout, "isatty", lambda: False)
-    monkeypatch.setattr(time, "sleep", lambda *_args: None)
+    region.origin.BootResources._handler.is_importing.return_value = True
     region._force_cache_update()
-    assert region.origin.BootResources.start_import.called is True
-    assert region.origin.BootResources.stop_import.called is True
-    assert region.print_msg.called is False
+    assert region.origin.BootResources.start_import.called is False
+    assert region.origin.BootResources.stop_import.called is False
+    assert [
+        call("import already running; image source cache not refreshed"),
+    ] == region.message.call_args_list
+
+
+def test_Region_connect_routes_imports_through_call(monkeypatch):
+    """Test Region.connect makes the import calls through `_call`."""
+    region = Region('region1', 'http://localhost:5240/MAAS', 'apikey1')
+    monkeypatch.setattr(
+        region_module.Origin, "connect",
+        MagicMock(return_value=(sentinel.profile, MagicMock())))
+    region.connect()
+    region.imports.is_importing()
+    assert region.get_metrics()["calls"] == 1
 
 
 def test_Region_sync_custom_image_already_synced(tmpdir):
@@ -501,22 +389,13 @@ def test_Region_sync_custom_image_already_synced(tmpdir):
         progress_callback=ANY) == region.origin.BootResources.create.call_args
     assert (
         call("custom/image already in sync", level=MessageLevel.SUCCESS) ==
-        region.print_msg.call_args)
+        region.message.call_args)
 
 
-def test_Region_sync_custom_image_not_synced_uses_progress_bar(tmpdir, monkeypatch):
-    """Test Region.sync_custom performs create and handles when its already
-    synced."""
-    region = make_Region(quiet=False)
-    mock_progress_bar = MagicMock()
-    mock_progress_bar.signal_set = True
-    mock_progress_bar_class = MagicMock()
-    mock_progress_bar_class.return_value = mock_progress_bar
-    mock_progress_bar.term_width = 80
-    monkeypatch.setattr(sys.stdout, "isatty", lambda: True)
-    monkeypatch.setattr(region_module, "ProgressBar", mock_progress_bar_class)
-    mock_signal = Mock()
-    monkeypatch.setattr(signal, "signal", mock_signal)
+def test_Region_sync_custom_image_not_synced_publishes_progress(tmpdir):
+    """Test Region.sync_custom publishes `Progress` while uploading."""
+    region = make_Region()
+    region.events = Mock()
     image_path = tmpdir.join("image.tar.gz")
     image_path.write(b"data")
 
@@ -538,122 +417,168 @@ def test_Region_sync_custom_image_not_synced_uses_progress_bar(tmpdir, monkeypat
         "architecture": "amd64/generic",
         "title": "My Title",
     })
-    assert mock_progress_bar.start.called is True
-    assert [call(0), call(1)] == mock_progress_bar.update.call_args_list
-    assert call(signal.SIGWINCH, signal.SIG_DFL) == mock_signal.call_args
+    assert [
+        call(Progress("region1", "uploading custom/image", 0)),
+        call(Progress("region1", "uploading custom/image", 1)),
+    ] == region.events.publish.call_args_list
     assert (
-        call(
-            "custom/image uploaded", level=MessageLevel.SUCCESS,
-            replace=True, fill=80) ==
-        region.print_msg.call_args)
+        call("custom/image uploaded", level=MessageLevel.SUCCESS) ==
+        region.message.call_args)
 
 
-def test_Region_print_msg_does_nothing_when_quiet(monkeypatch):
-    """Test Region.print_msg does nothing when in quiet mode."""
-    mock_print = Mock()
-    monkeypatch.setattr(region_module, "print", mock_print)
+def test_Region_message_publishes_Message():
+    """Test Region.message publishes a `Message` to the event bus."""
+    events = EventBus()
     region = Region(
-        'region1', 'http://localhost:5240/MAAS', 'apikey1', quiet=True)
-    region.print_msg("test")
-    assert mock_print.called is False
+        'region1', 'http://localhost:5240/MAAS', 'apikey1', events=events)
+    region.message("test", level=MessageLevel.WARN)
+    assert events.consume() == [
+        Message('region1', MessageLevel.WARN, "test")]
 
 
-def test_Region_print_msg_sets_no_color(monkeypatch):
-    """Test Region.print_msg sets no color when level is None."""
-    mock_print = Mock()
-    monkeypatch.setattr(region_module, "print", mock_print)
-    mock_color_class = MagicMock()
-    monkeypatch.setattr(region_module, "Color", mock_color_class)
-    region = Region(
-        'region1', 'http://localhost:5240/MAAS', 'apikey1', quiet=False)
-    region.print_msg("test")
-    assert call("Region region1: test") == mock_color_class.call_args
+def test_Region_message_does_nothing_without_events():
+    """Test Region.message works when no event bus is set."""
+    region = Region('region1', 'http://localhost:5240/MAAS', 'apikey1')
+    # Test is that no exception is raised.
+    region.message("test")
 
 
-def test_Region_print_msg_sets_no_color_for_progress(monkeypatch):
-    """Test Region.print_msg sets no color when level is PROGRESS."""
-    mock_print = Mock()
-    monkeypatch.setattr(region_module, "print", mock_print)
-    mock_color_class = MagicMock()
-    monkeypatch.setattr(region_module, "Color", mock_color_class)
-    region = Region(
-        'region1', 'http://localhost:5240/MAAS', 'apikey1', quiet=False)
-    region.print_msg("test", level=MessageLevel.PROGRESS)
-    assert call("Region region1: test") == mock_color_class.call_args
+def test_Region_sync_fails_fast_when_circuit_open():
+    """Region.sync doesn't call the region once its circuit is open."""
+    region = make_Region()
+    region.calls.breaker = CircuitBreaker(failure_threshold=1)
+    region.origin.Users.read.side_effect = ConnectionRefusedError()
+    users = {'admin': {'password': 'pass'}}
+    with pytest.raises(ConnectionRefusedError):
+        region.sync_users(users)
+    with pytest.raises(CircuitOpenError):
+        region.sync(users, {})
+    assert region.origin.Users.read.call_count == 1
+
+
+def test_Region_read_machines_hedges_when_enabled(monkeypatch):
+    """Region.read_machines hedges the read when `hedge_after` is set."""
+    region = make_Region()
+    region.calls.hedge_after = 5
+    hedged_call = Mock(return_value=sentinel.machines)
+    monkeypatch.setattr(resilience_module, "hedged_call", hedged_call)
+    assert region.read_machines() is sentinel.machines
+    assert hedged_call.call_args == call(
+        region.origin.Machines.read, delay=5, limiter=region.calls.limiter)
 
 
-def test_Region_print_msg_sets_autogreen_for_success(monkeypatch):
-    """Test Region.print_msg sets color to autogreen when level is SUCCESS."""
-    mock_print = Mock()
-    monkeypatch.setattr(region_module, "print", mock_print)
-    mock_color_class = MagicMock()
-    monkeypatch.setattr(region_module, "Color", mock_color_class)
-    region = Region(
-        'region1', 'http://localhost:5240/MAAS', 'apikey1', quiet=False)
-    region.print_msg("test", level=MessageLevel.SUCCESS)
-    assert (
-        call("{autogreen}Region region1: test{/autogreen}") ==
-        mock_color_class.call_args)
+def test_Region_read_machines_doesnt_hedge_by_default(monkeypatch):
+    """Region.read_machines reads directly without `hedge_after`."""
+    region = make_Region()
+    hedged_call = Mock()
+    monkeypatch.setattr(resilience_module, "hedged_call", hedged_call)
+    region.origin.Machines.read.return_value = sentinel.machines
+    assert region.read_machines() is sentinel.machines
+    assert hedged_call.called is False
 
 
-def test_Region_print_msg_sets_autoyellow_for_warn(monkeypatch):
-    """Test Region.print_msg sets color to autoyellow when level is WARN."""
-    mock_print = Mock()
-    monkeypatch.setattr(region_module, "print", mock_print)
-    mock_color_class = MagicMock()
-    monkeypatch.setattr(region_module, "Color", mock_color_class)
-    region = Region(
-        'region1', 'http://localhost:5240/MAAS', 'apikey1', quiet=False)
-    region.print_msg("test", level=MessageLevel.WARN)
-    assert (
-        call("{autoyellow}Region region1: test{/autoyellow}") ==
-        mock_color_class.call_args)
+def test_Region_read_memoizes_collection():
+    """Region only reads a collection once until it's written to."""
+    region = make_Region()
+    region.origin.BootResources.read.return_value = sentinel.resources
+    assert region.read_boot_resources() is sentinel.resources
+    assert region.read_boot_resources() is sentinel.resources
+    assert region.origin.BootResources.read.call_count == 1
 
 
-def test_Region_print_msg_raises_ValueError_on_unknown_level(monkeypatch):
-    """Test Region.print_msg raises ValueError on unknown level."""
-    mock_print = Mock()
-    monkeypatch.setattr(region_module, "print", mock_print)
-    mock_color_class = MagicMock()
-    monkeypatch.setattr(region_module, "Color", mock_color_class)
-    region = Region(
-        'region1', 'http://localhost:5240/MAAS', 'apikey1', quiet=False)
+def test_Region_doesnt_memoize_machines():
+    """Region reads the machines every time so they aren't held for the
+    whole run."""
+    region = make_Region()
+    region.read_machines()
+    region.read_machines()
+    assert region.origin.Machines.read.call_count == 2
+    assert region.memo == {}
+
+
+def test_Region_write_invalidates_only_its_collection():
+    """A write only invalidates the reads of the collection it writes."""
+    region = make_Region()
+    region.origin.Users.read.return_value = [Mock(username='bob')]
+    bob = {'bob': {'password': 'pass'}}
+    region.read_boot_resources()
+    region.sync_users(bob)
+    region.sync_users({
+        'admin': {'password': 'pass', 'email': 'admin@example.com'},
+    })
+    region.sync_users(bob)
+    region.read_boot_resources()
+    assert region.origin.Users.read.call_count == 2
+    assert region.origin.BootResources.read.call_count == 1
+
+
+def test_Region_memoizes_selections_per_source():
+    """Region memoizes the selections of each source separately."""
+    region = make_Region()
+    source_one, source_two = MagicMock(id=1), MagicMock(id=2)
+    region._update_selections(source_one, {}, False)
+    region._update_selections(source_two, {}, False)
+    region._update_selections(source_one, {}, False)
+    assert region.origin.BootSourceSelections.read.call_args_list == [
+        call(source_one), call(source_two)]
+
+
+def test_Region_invalidates_when_write_fails():
+    """A failed write still invalidates its collection."""
+    region = make_Region()
+    region.read_boot_resources()
     with pytest.raises(ValueError):
-        region.print_msg("test", level=sentinel.level)
+        region._call(
+            Mock(side_effect=ValueError()), invalidates=["BootResources"])
+    region.read_boot_resources()
+    assert region.origin.BootResources.read.call_count == 2
 
 
-def test_Region_print_msg_includes_back_r_when_replace(monkeypatch):
-    """Test Region.print_msg starts with '\r' when replace is True."""
-    mock_print = Mock()
-    monkeypatch.setattr(region_module, "print", mock_print)
-    region = Region(
-        'region1', 'http://localhost:5240/MAAS', 'apikey1', quiet=False)
-    region.print_msg("test", replace=True)
-    assert (
-        call(Color("\rRegion region1: test"), end=None, flush=True) ==
-        mock_print.call_args)
+def test_Region_sync_doesnt_read_users_without_users():
+    """Region.sync doesn't read the region's users when there are none."""
+    region = make_Region()
+    region.sync(None, {}, start_import=False)
+    assert region.origin.Users.read.called is False
 
 
-def test_Region_print_msg_sets_no_end_when_newline_is_False(monkeypatch):
-    """Test Region.print_msg calls print with end='' when newline is False."""
-    mock_print = Mock()
-    monkeypatch.setattr(region_module, "print", mock_print)
-    region = Region(
-        'region1', 'http://localhost:5240/MAAS', 'apikey1', quiet=False)
-    region.print_msg("test", newline=False)
-    assert (
-        call(Color("Region region1: test"), end="", flush=True) ==
-        mock_print.call_args)
+def test_Region_calls_go_through_limiter():
+    """Every call to the region is counted by its limiter."""
+    region = make_Region()
+    region.origin.Users.read.return_value = []
+    region.sync_users({'admin': {'password': 'pass', 'email': 'a@b'}})
+    metrics = region.get_metrics()
+    assert metrics["calls"] == 2
+    assert metrics["circuit_open"] is False
 
 
-def test_Region_print_msg_with_fill_and_replace(monkeypatch):
-    """Test Region.print_msg fills with blank space include replace."""
-    mock_print = Mock()
-    monkeypatch.setattr(region_module, "print", mock_print)
-    region = Region(
-        'region1', 'http://localhost:5240/MAAS', 'apikey1', quiet=False)
-    region.print_msg("test", fill=80, replace=True)
-    msg = "\rRegion region1: test"
-    assert (
-        call(Color(msg) + " " * (81 - len(msg)), end=None, flush=True) ==
-        mock_print.call_args)
+def test_Region_sync_records_phases_and_uploads(tmpdir):
+    """Region.sync records how long each phase took and what it
+    uploaded."""
+    image = tmpdir.join("image.tgz")
+    image.write_binary(b"image")
+    region = make_Region()
+    region.origin.Users.read.return_value = []
+
+    def create(*_args, progress_callback, **_kwargs):
+        """Upload the image."""
+        progress_callback(1)
+
+    region.origin.BootResources.create.side_effect = create
+    region.sync({}, {
+        'custom': {
+            'image': {'path': str(image), 'architecture': 'amd64/generic'},
+        },
+    }, start_import=False)
+    assert sorted(region.timings) == ["custom", "users"]
+    assert region.bytes_uploaded == 5
+    assert region.custom_images["image"][0] == 5
+
+
+def test_Region_skip_finishes_region():
+    """Region.skip reports why the region was skipped and finishes it."""
+    region = make_Region()
+    region.events = MagicMock()
+    region.skip("converged")
+    assert region.message.call_args == call(
+        "sync skipped; converged", level=MessageLevel.SUCCESS)
+    assert region.events.publish.call_args == call(Finished(region.name))
@@ -0,0 +1,349 @@
+# Copyright 2016 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for the boot source selections of `region.py`."""
+
+import time
+from unittest.mock import ANY, MagicMock, Mock, call, sentinel
+
+import pytest
+from maas.client.bones import CallError
+
+from .. import region as region_module
+from .factory import make_Region
+
+
+# Allow test code to access a protected member.
+# pylint: disable=protected-access
+
+
+def test_Region__update_selections_deletes_not_matching_os():
+    """Test Region._update_selections deletes selection when os missing."""
+    region = make_Region()
+    region._force_cache_update = Mock()
+    delete_selection = MagicMock()
+    delete_selection.os = "invalid"
+    region.origin.BootSourceSelections.read.return_value = [delete_selection]
+    updated = region._update_selections(sentinel.source, {}, False)
+    assert delete_selection.delete.called is True
+    assert updated is True
+
+
+def test_Region__update_selections_removes_mismatch_and_creates_new_release():
+    """Test Region._update_selections deletes selection when release missing."""
+    region = make_Region()
+    region._force_cache_update = Mock()
+    region._create_selection = Mock()
+    delete_selection = MagicMock()
+    delete_selection.os = "ubuntu"
+    delete_selection.release = "invalid"
+    region.origin.BootSourceSelections.read.return_value = [delete_selection]
+    updated = region._update_selections(sentinel.source, {
+        "ubuntu": {
+            "releases": ["trusty"],
+            "arches": ["amd64"],
+        }
+    }, False)
+    assert delete_selection.delete.called is True
+    assert (
+        call(sentinel.source, "ubuntu", "trusty", ["amd64"], deadline=ANY) ==
+        region._create_selection.call_args)
+    assert updated is True
+
+
+def test_Region__update_selections_removes_mismatch_and_creates_new_arches():
+    """Test Region._update_selections deletes selection when release missing
+    correct architectures."""
+    region = make_Region()
+    region._force_cache_update = Mock()
+    region._create_selection = Mock()
+    delete_selection = MagicMock()
+    delete_selection.os = "ubuntu"
+    delete_selection.release = "trusty"
+    delete_selection.arches = ["amd64", "i386"]
+    delete_selection.save.side_effect = CallError(
+        MagicMock(), MagicMock(), b"", None)
+    region.origin.BootSourceSelections.read.return_value = [delete_selection]
+    updated = region._update_selections(sentinel.source, {
+        "ubuntu": {
+            "releases": ["trusty"],
+            "arches": ["amd64", "arm64"],
+        }
+    }, False)
+    assert delete_selection.delete.called is True
+    assert (
+        call(
+            sentinel.source,
+            "ubuntu", "trusty", ["amd64", "arm64"],
+            deadline=ANY) ==
+        region._create_selection.call_args)
+    assert updated is True
+
+
+def test_Region__update_selections_updates_arches_in_place():
+    """Test Region._update_selections updates the arches of a selection in
+    place without refreshing the cache or creating a new selection."""
+    region = make_Region()
+    region._force_cache_update = Mock()
+    region._create_selection = Mock()
+    update_selection = MagicMock()
+    update_selection.os = "ubuntu"
+    update_selection.release = "trusty"
+    update_selection.arches = ["amd64"]
+    region.origin.BootSourceSelections.read.return_value = [update_selection]
+    updated = region._update_selections(sentinel.source, {
+        "ubuntu": {
+            "releases": ["trusty"],
+            "arches": ["amd64", "arm64"],
+        }
+    }, False)
+    assert update_selection.arches == ["amd64", "arm64"]
+    assert update_selection.save.called is True
+    assert update_selection.delete.called is False
+    assert region._create_selection.called is False
+    assert region._force_cache_update.called is False
+    assert updated is True
+
+
+def test_Region__update_selection_arches_stops_trying_when_unsupported():
+    """Test Region._update_selection_arches doesn't try to update again once
+    the region doesn't support it."""
+    region = make_Region()
+    selection = MagicMock()
+    selection.save.side_effect = AttributeError()
+    assert region._update_selection_arches(selection, ["amd64"]) is False
+    assert region.selection_update_supported is False
+    selection.save.reset_mock()
+    assert region._update_selection_arches(selection, ["amd64"]) is False
+    assert selection.save.called is False
+
+
+def test_Region__update_selection_arches_raises_region_failure():
+    """Test Region._update_selection_arches raises a failure of the region
+    and tries again for the next selection."""
+    region = make_Region()
+    response = MagicMock()
+    response.status = 502
+    selection = MagicMock()
+    selection.save.side_effect = CallError(MagicMock(), response, b"", None)
+    with pytest.raises(CallError):
+        region._update_selection_arches(selection, ["amd64"])
+    assert region.selection_update_supported is True
+
+
+def test_Region__update_selections_does_nothing_if_all_matches():
+    """Test Region._update_selections deletes selection when release missing
+    correct architectures."""
+    region = make_Region()
+    region._force_cache_update = Mock()
+    region._create_selection = Mock()
+    keep_selection = MagicMock()
+    keep_selection.os = "ubuntu"
+    keep_selection.release = "trusty"
+    keep_selection.arches = ["amd64", "i386"]
+    region.origin.BootSourceSelections.read.return_value = [keep_selection]
+    updated = region._update_selections(sentinel.source, {
+        "ubuntu": {
+            "releases": ["trusty"],
+            "arches": ["i386", "amd64"],
+        }
+    }, False)
+    assert keep_selection.delete.called is False
+    assert region._create_selection.called is False
+    assert updated is False
+
+
+def test_Region__update_selections_passes_updated_through():
+    """Test Region._update_selections passes updated value through."""
+    region = make_Region()
+    region._force_cache_update = Mock()
+    region.origin.BootSourceSelections.read.return_value = []
+    updated = region._update_selections(sentinel.source, {}, True)
+    assert updated is True
+
+
+def test_Region__update_selections_updated_calls_force_cache_update():
+    """Test Region._update_selections calls `_force_cache_update` when
+    updated."""
+    region = make_Region()
+    region._force_cache_update = Mock()
+    region.origin.BootSourceSelections.read.return_value = []
+    updated = region._update_selections(sentinel.source, {}, True)
+    assert updated is True
+    assert region._force_cache_update.called is True
+
+
+def test_Region__update_selections_retries_every_create():
+    """Test Region._update_selections creates every missing selection with
+    retry, not only the first one."""
+    region = make_Region()
+    region._force_cache_update = Mock()
+    region._create_selection = Mock()
+    region.origin.BootSourceSelections.read.return_value = []
+    updated = region._update_selections(sentinel.source, {
+        "ubuntu": {
+            "releases": ["trusty", "xenial"],
+            "arches": ["amd64"],
+        },
+        "centos": {
+            "releases": ["centos70"],
+            "arches": ["amd64"],
+        },
+    }, False)
+    assert sorted([
+        call(sentinel.source, "centos", "centos70", ["amd64"], deadline=ANY),
+        call(sentinel.source, "ubuntu", "trusty", ["amd64"], deadline=ANY),
+        call(sentinel.source, "ubuntu", "xenial", ["amd64"], deadline=ANY),
+    ]) == sorted(region._create_selection.call_args_list)
+    assert updated is True
+
+
+def test_Region__update_selections_forces_cache_update_once():
+    """Test Region._update_selections waits for the cache once, after every
+    delete and before any create."""
+    region = make_Region()
+    order = []
+    region._force_cache_update = Mock(
+        side_effect=lambda: order.append("cache"))
+    region._create_selection = Mock(
+        side_effect=lambda *args, **kwargs: order.append("create"))
+    delete_selections = []
+    for release in ["invalid1", "invalid2"]:
+        selection = MagicMock()
+        selection.os = "ubuntu"
+        selection.release = release
+        selection.delete.side_effect = lambda: order.append("delete")
+        delete_selections.append(selection)
+    region.origin.BootSourceSelections.read.return_value = delete_selections
+    region._update_selections(sentinel.source, {
+        "ubuntu": {
+            "releases": ["trusty", "xenial"],
+            "arches": ["amd64"],
+        }
+    }, False)
+    assert [
+        "delete", "delete", "cache", "create", "create"] == order
+
+
+def test_Region__update_selections_runs_concurrently(monkeypatch):
+    """Test Region._update_selections deletes and creates the selections at
+    the same time, as many as the limiter allows."""
+    region = make_Region()
+    region._force_cache_update = Mock()
+    region._create_selection = Mock()
+    run_parallel = Mock(side_effect=lambda func, items, jobs: [
+        func(item) for item in items])
+    monkeypatch.setattr(region_module, "run_parallel", run_parallel)
+    delete_selection = MagicMock()
+    delete_selection.os = "invalid"
+    region.origin.BootSourceSelections.read.return_value = [delete_selection]
+    region._update_selections(sentinel.source, {
+        "ubuntu": {
+            "releases": ["trusty", "xenial"],
+            "arches": ["amd64"],
+        }
+    }, False)
+    assert 2 == run_parallel.call_count
+    assert [region.calls.limiter.max_limit] * 2 == [
+        kwargs["jobs"] for _, kwargs in run_parallel.call_args_list]
+    assert [delete_selection] == run_parallel.call_args_list[0][0][1]
+    assert [
+        ("ubuntu", "trusty", ["amd64"]),
+        ("ubuntu", "xenial", ["amd64"]),
+    ] == run_parallel.call_args_list[1][0][1]
+    assert delete_selection.delete.called is True
+    assert 2 == region._create_selection.call_count
+
+
+def test_Region__create_selection_works_on_first_try():
+    """Test Region._create_selection only calls create once when it works with
+    retry set to True."""
+    region = make_Region()
+    region._create_selection(
+        sentinel.source, sentinel.os_name, sentinel.release, sentinel.arches,
+        deadline=time.monotonic() + 60)
+    assert region.origin.BootSourceSelections.create.call_count == 1
+
+
+def test_Region__create_selection_works_on_fifth_try(monkeypatch):
+    """Test Region._create_selection works after 5 times of trying."""
+    region = make_Region()
+    region.origin.BootSourceSelections.create.side_effect = [
+        CallError(MagicMock(), MagicMock(), b"", None),
+        CallError(MagicMock(), MagicMock(), b"", None),
+        CallError(MagicMock(), MagicMock(), b"", None),
+        CallError(MagicMock(), MagicMock(), b"", None),
+        None,
+    ]
+    # Speed up test by makin time.sleep a no-op.
+    monkeypatch.setattr(time, "sleep", lambda *_args: None)
+    region._create_selection(
+        sentinel.source, sentinel.os_name, sentinel.release, sentinel.arches,
+        deadline=time.monotonic() + 60)
+    assert region.origin.BootSourceSelections.create.call_count == 5
+
+
+def test_Region__create_selection_raises_error_on_fifth_failure(monkeypatch):
+    """Test Region._create_selection raises error when the fifth time fails."""
+    region = make_Region()
+    region.origin.BootSourceSelections.create.side_effect = [
+        CallError(MagicMock(), MagicMock(), b"", None),
+        CallError(MagicMock(), MagicMock(), b"", None),
+        CallError(MagicMock(), MagicMock(), b"", None),
+        CallError(MagicMock(), MagicMock(), b"", None),
+        CallError(MagicMock(), MagicMock(), b"", None),
+    ]
+    # Speed up test by makin time.sleep a no-op.
+    monkeypatch.setattr(time, "sleep", lambda *_args: None)
+    with pytest.raises(CallError):
+        region._create_selection(
+            sentinel.source, sentinel.os_name, sentinel.release,
+            sentinel.arches, deadline=time.monotonic() + 60)
+    assert region.origin.BootSourceSelections.create.call_count == 5
+
+
+def test_Region__create_selection_stops_retrying_at_deadline(monkeypatch):
+    """Test Region._create_selection raises the error instead of retrying
+    past the deadline."""
+    region = make_Region()
+    region.origin.BootSourceSelections.create.side_effect = CallError(
+        MagicMock(), MagicMock(), b"", None)
+    sleep = Mock()
+    monkeypatch.setattr(time, "sleep", sleep)
+    with pytest.raises(CallError):
+        region._create_selection(
+            sentinel.source, sentinel.os_name, sentinel.release,
+            sentinel.arches, deadline=time.monotonic())
+    assert region.origin.BootSourceSelections.create.call_count == 1
+    assert sleep.called is False
+
+
+def test_Region__update_selections_bounds_retries_of_reconcile(monkeypatch):
+    """Test Region._update_selections gives every create the same deadline,
+    `SELECTION_RECONCILE_TIMEOUT` after the reconcile started."""
+    monkeypatch.setattr(time, "monotonic", lambda: 1000)
+    region = make_Region()
+    region._force_cache_update = Mock()
+    region._create_selection = Mock()
+    region._update_selections(sentinel.source, {
+        "ubuntu": {
+            "releases": ["trusty", "xenial"],
+            "arches": ["amd64"],
+        }
+    }, False)
+    assert [
+        1000 + region_module.SELECTION_RECONCILE_TIMEOUT] * 2 == [
+        kwargs["deadline"]
+        for _, kwargs in region._create_selection.call_args_list]
+
+
+def test_Region__create_selection_raises_error_on_failure_no_retry():
+    """Test Region._create_selection doesn't retry without a deadline."""
+    region = make_Region()
+    region.origin.BootSourceSelections.create.side_effect = CallError(
+        MagicMock(), MagicMock(), b"", None)
+    with pytest.raises(CallError):
+        region._create_selection(
+            sentinel.source, sentinel.os_name, sentinel.release,
+            sentinel.arches)
+    assert region.origin.BootSourceSelections.create.call_count == 1
@@ -5,16 +5,27 @@
 
 import json
 import os
+import threading
 from unittest.mock import MagicMock
 
 import pytest
 from maas.client.viscera.machines import Machine
 
+from ..events import MessageLevel
 from ..report import (
+    REGION_TEMPLATE,
     SERVICE_TEMPLATE,
     OutputHTMLError,
+    collect_data,
     get_html_directory,
+    get_region_filename,
+    index_data,
+    merge_data,
+    read_cached_data,
     render_data,
+    render_region_data,
+    summarize_fleet,
+    write_data,
     write_html
 )
 
@@ -36,35 +47,129 @@ def test_render_data_outputs_angular_service():
     region_one = MagicMock()
     region_one.name = "region_one"
     region_one.url = "http://region_one"
-    region_one.origin.Machines.read.return_value = [
+    region_one.read_machines.return_value = [
         machine_one, machine_two, machine_three, machine_four]
     region_one.count = 4
     region_two = MagicMock()
     region_two.name = "region_two"
     region_two.url = "http://region_two"
-    region_two.origin.Machines.read.return_value = [
+    region_two.read_machines.return_value = [
         machine_one, machine_two, machine_three, machine_four]
     region_two.count = 4
+    statuses = {
+        "data": [1, 2, 1],
+        "labels": ["Allocated", "New", "Ready"],
+    }
+    unknown = {"data": [4], "labels": ["Unknown"]}
+    aggregates = {
+        "status": statuses,
+        "zone": unknown,
+        "pool": unknown,
+        "architecture": unknown,
+        "power_state": unknown,
+    }
     output = {
         region_one.name: {
             "url": region_one.url,
-            "statuses": {
-                "data": [1, 2, 1],
-                "labels": ["Allocated", "New", "Ready"],
-            },
+            "statuses": statuses,
+            "aggregates": aggregates,
             "machine_count": region_one.count,
         },
         region_two.name: {
             "url": region_two.url,
-            "statuses": {
-                "data": [1, 2, 1],
+            "statuses": statuses,
+            "aggregates": aggregates,
+            "machine_count": region_two.count,
+        },
+    }
+    fleet = {
+        "region_count": 2,
+        "stale_count": 0,
+        "machine_count": 8,
+        "aggregates": {
+            "status": {
+                "data": [2, 4, 2],
                 "labels": ["Allocated", "New", "Ready"],
             },
-            "machine_count": region_two.count,
+            "zone": {"data": [8], "labels": ["Unknown"]},
+            "pool": {"data": [8], "labels": ["Unknown"]},
+            "architecture": {"data": [8], "labels": ["Unknown"]},
+            "power_state": {"data": [8], "labels": ["Unknown"]},
         },
     }
-    output_js = SERVICE_TEMPLATE % json.dumps(output)
+    index = {
+        name: {
+            "url": info["url"],
+            "machine_count": info["machine_count"],
+            "file": get_region_filename(name),
+        }
+        for name, info in output.items()
+    }
+    output_js = SERVICE_TEMPLATE % (json.dumps(index), json.dumps(fleet))
     assert render_data([region_one, region_two]) == output_js
+    assert collect_data([region_one, region_two]) == output
+
+
+def test_collect_data_aggregates_every_dimension():
+    """collect_data aggregates the machines by every dimension."""
+    region = MagicMock()
+    region.name = "region"
+    region.url = "http://region"
+    region.read_machines.return_value = [
+        Machine({
+            "status_name": "Ready",
+            "zone": {"name": "zone1"},
+            "pool": {"name": "default"},
+            "architecture": "amd64/generic",
+            "power_state": "off",
+        }),
+        Machine({
+            "status_name": "Deployed",
+            "zone": {"name": "zone2"},
+            "pool": {"name": "default"},
+            "architecture": "arm64/generic",
+            "power_state": "on",
+        }),
+    ]
+    aggregates = collect_data([region])["region"]["aggregates"]
+    assert aggregates == {
+        "status": {"data": [1, 1], "labels": ["Deployed", "Ready"]},
+        "zone": {"data": [1, 1], "labels": ["zone1", "zone2"]},
+        "pool": {"data": [2], "labels": ["default"]},
+        "architecture": {
+            "data": [1, 1],
+            "labels": ["amd64/generic", "arm64/generic"],
+        },
+        "power_state": {"data": [1, 1], "labels": ["off", "on"]},
+    }
+
+
+def test_summarize_fleet_uses_statuses_of_older_data():
+    """summarize_fleet uses `statuses` when a region has no aggregates."""
+    data = {
+        "region_one": {
+            "statuses": {"data": [1, 2], "labels": ["New", "Ready"]},
+            "machine_count": 3,
+        },
+        "region_two": {
+            "statuses": {"data": [1], "labels": ["Ready"]},
+            "aggregates": {
+                "status": {"data": [1], "labels": ["Ready"]},
+                "zone": {"data": [1], "labels": ["default"]},
+            },
+            "machine_count": 1,
+        },
+        "region_three": {"machine_count": 0},
+    }
+    assert summarize_fleet(data) == {
+        "region_count": 3,
+        "stale_count": 0,
+        "machine_count": 4,
+        "aggregates": {
+            "status": {"data": [1, 3], "labels": ["New", "Ready"]},
+            "zone": {"data": [1], "labels": ["default"]},
+        },
+    }
 
 
 def test_get_html_directory_returns_path_to_html():
@@ -105,9 +210,187 @@ def test_write_html_outputs_html_and_data_js(tmpdir):
     assert output.join("data.js").check() is True
 
 
+def test_write_html_writes_data_file_for_each_region(tmpdir):
+    """write_html writes a data file for each region in the index."""
+    output = tmpdir.join("output")
+    data = {
+        "region_one": {"url": "http://region_one", "machine_count": 1},
+        "region_two": {"url": "http://region_two", "machine_count": 2},
+    }
+    write_html(str(output), [], data=data)
+    for name, info in data.items():
+        region_file = output.join(get_region_filename(name))
+        assert region_file.read() == render_region_data(name, info)
+
+
+def test_write_html_removes_data_of_old_regions(tmpdir):
+    """write_html removes the data file of regions no longer reported."""
+    output = tmpdir.join("output")
+    write_html(str(output), [], data={"old": {"machine_count": 0}})
+    write_html(str(output), [], data={"new": {"machine_count": 0}})
+    assert output.join(get_region_filename("old")).check() is False
+    assert output.join(get_region_filename("new")).check() is True
+
+
+def test_index_data_keeps_only_summary_fields():
+    """index_data keeps the summary fields and the region's data file."""
+    data = {
+        "region": {
+            "url": "http://region",
+            "statuses": {"data": [1], "labels": ["New"]},
+            "aggregates": {},
+            "machine_count": 1,
+            "stale": True,
+            "stale_age": 10,
+        },
+    }
+    assert index_data(data) == {
+        "region": {
+            "url": "http://region",
+            "machine_count": 1,
+            "stale": True,
+            "stale_age": 10,
+            "file": get_region_filename("region"),
+        },
+    }
+
+
+def test_render_region_data_calls_page_callback():
+    """render_region_data passes the region's data to the page."""
+    info = {"url": "http://region", "machine_count": 0}
+    assert render_region_data("region", info) == REGION_TEMPLATE % (
+        '"region"', json.dumps(info))
+
+
+def test_get_region_filename_is_safe_for_any_name():
+    """get_region_filename returns a plain filename for any region name."""
+    filename = get_region_filename("../region one/")
+    assert filename.startswith("regions/")
+    assert "/" not in filename[len("regions/"):]
+    assert filename != get_region_filename("region one")
+
+
 def test_write_html_works_when_overwritting(tmpdir):
     """write_html works when overwriting."""
     output = tmpdir.join("output")
     write_html(str(output), [])
     # Test is that no exception is raised.
     write_html(str(output), [])
+
+
+def test_render_data_renders_passed_data():
+    """render_data renders the passed data without reading regions."""
+    region = MagicMock()
+    data = {"region": {"url": "http://region", "machine_count": 0}}
+    fleet = {
+        "region_count": 1,
+        "stale_count": 0,
+        "machine_count": 0,
+        "aggregates": {},
+    }
+    assert render_data([region], data=data) == (
+        SERVICE_TEMPLATE % (
+            json.dumps({
+                "region": {
+                    "url": "http://region",
+                    "machine_count": 0,
+                    "file": get_region_filename("region"),
+                },
+            }),
+            json.dumps(fleet)))
+    assert region.read_machines.called is False
+
+
+def test_write_data_and_merge_data_combine_shards(tmpdir):
+    """write_data output from each shard is combined by merge_data."""
+    region_one = MagicMock()
+    region_one.name = "region_one"
+    region_one.url = "http://region_one"
+    region_one.read_machines.return_value = [
+        Machine({"status_name": "New"})]
+    region_two = MagicMock()
+    region_two.name = "region_two"
+    region_two.url = "http://region_two"
+    region_two.read_machines.return_value = []
+    shard_one = tmpdir.join("shard1.json")
+    shard_two = tmpdir.join("shard2.json")
+    write_data(str(shard_one), collect_data([region_one]))
+    write_data(str(shard_two), collect_data([region_two]))
+    assert merge_data([str(shard_one), str(shard_two)]) == collect_data(
+        [region_one, region_two])
+
+
+def test_merge_data_raises_error_on_duplicate_region(tmpdir):
+    """merge_data raises `OutputHTMLError` when a region is in two shards."""
+    shard_one = tmpdir.join("shard1.json")
+    shard_two = tmpdir.join("shard2.json")
+    shard_one.write(json.dumps({"region": {}}))
+    shard_two.write(json.dumps({"region": {}}))
+    with pytest.raises(OutputHTMLError) as exc:
+        merge_data([str(shard_one), str(shard_two)])
+    assert str(exc.value) == (
+        "Region 'region' exists in more than one report data: %s" % (
+            str(shard_two)))
+
+
+def test_merge_data_raises_error_on_invalid_file(tmpdir):
+    """merge_data raises `OutputHTMLError` when data cannot be read."""
+    shard = tmpdir.join("shard.json")
+    shard.write("invalid")
+    with pytest.raises(OutputHTMLError) as exc:
+        merge_data([str(shard)])
+    assert str(exc.value) == "Failed to read report data: %s" % str(shard)
+
+
+def make_report_region(name, machines):
+    """Make a region for the report with `machines`."""
+    region = MagicMock()
+    region.name = name
+    region.url = "http://%s" % name
+    region.read_machines.return_value = machines
+    return region
+
+
+def test_collect_data_caches_collected_data(tmpdir):
+    """collect_data caches the data of each collected region."""
+    region = make_report_region("region", [Machine({"status_name": "New"})])
+    data = collect_data([region], cache_dir=str(tmpdir))
+    cached, _ = read_cached_data(str(tmpdir), "region")
+    assert cached == data["region"]
+    assert "stale" not in data["region"]
+
+
+def test_collect_data_uses_cache_when_region_times_out(tmpdir):
+    """collect_data uses the cached data of a region that times out."""
+    region = make_report_region("region", [Machine({"status_name": "New"})])
+    collected = collect_data([region], cache_dir=str(tmpdir))["region"]
+    blocked = threading.Event()
+    region.read_machines.side_effect = lambda: blocked.wait(5)
+    try:
+        data = collect_data([region], timeout=0.1, cache_dir=str(tmpdir))
+    finally:
+        blocked.set()
+    assert data["region"] == dict(collected, stale=True, stale_age=0)
+    assert region.message.call_args[1] == {"level": MessageLevel.WARN}
+    assert region.message.call_args[0][0].startswith(
+        "report data timed out; using cached data from")
+
+
+def test_collect_data_marks_failed_region_without_cache_stale(tmpdir):
+    """collect_data reports a failed region without a cache as stale."""
+    healthy = make_report_region("healthy", [Machine({"status_name": "New"})])
+    failed = make_report_region("failed", [])
+    failed.read_machines.side_effect = ValueError("down")
+    data = collect_data([healthy, failed], cache_dir=str(tmpdir))
+    assert data["healthy"]["machine_count"] == 1
+    assert data["failed"] == {
+        "url": "http://failed",
+        "statuses": {"data": [], "labels": []},
+        "aggregates": {},
+        "machine_count": 0,
+        "stale": True,
+        "stale_age": None,
+    }
+    failed.message.assert_called_once_with(
+        "report data failed: down; no cached data", level=MessageLevel.WARN)
+    assert summarize_fleet(data)["stale_count"] == 1
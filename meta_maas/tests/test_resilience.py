@@ -0,0 +1,351 @@
+# Copyright 2016 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for `resilience.py`."""
+
+import threading
+import time
+from types import SimpleNamespace
+from unittest.mock import MagicMock, Mock, sentinel
+
+import pytest
+from maas.client.bones import CallError
+
+from .. import resilience as resilience_module
+from ..resilience import (
+    AdaptiveLimiter,
+    CircuitBreaker,
+    CircuitOpenError,
+    RegionCalls,
+    hedged_call,
+    is_overload,
+    is_region_failure
+)
+
+
+def make_CallError(status):
+    """Make a `CallError` with `status`."""
+    response = MagicMock()
+    response.status = status
+    return CallError(MagicMock(), response, b"", None)
+
+
+def fake_time(monkeypatch):
+    """Replace `time.monotonic` in the resilience module with a clock.
+
+    Returns the clock; its `now` is the time returned.
+    """
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(
+        resilience_module.time, "monotonic", lambda: clock.now)
+    return clock
+
+
+def test_is_region_failure_only_for_degraded_region():
+    """is_region_failure is True for errors of a degraded region."""
+    assert is_region_failure(make_CallError(503)) is True
+    assert is_region_failure(ConnectionRefusedError()) is True
+    assert is_region_failure(TimeoutError()) is True
+    assert is_region_failure(make_CallError(400)) is False
+    assert is_region_failure(ValueError()) is False
+
+
+def test_is_overload_for_timeouts_and_unavailable():
+    """is_overload is True when the region needs fewer calls in flight."""
+    assert is_overload(make_CallError(503)) is True
+    assert is_overload(make_CallError(429)) is True
+    assert is_overload(TimeoutError()) is True
+    assert is_overload(make_CallError(500)) is False
+    assert is_overload(ConnectionRefusedError()) is False
+
+
+def test_CircuitBreaker_opens_after_failure_threshold():
+    """CircuitBreaker fails fast once the failure threshold is reached."""
+    breaker = CircuitBreaker(failure_threshold=2)
+    func = Mock(side_effect=ConnectionRefusedError())
+    for _ in range(2):
+        with pytest.raises(ConnectionRefusedError):
+            breaker.call(func)
+    with pytest.raises(CircuitOpenError):
+        breaker.call(func)
+    assert func.call_count == 2
+    assert breaker.is_open is True
+
+
+def test_CircuitBreaker_ignores_client_errors():
+    """CircuitBreaker doesn't count errors of a bad request."""
+    breaker = CircuitBreaker(failure_threshold=1)
+    with pytest.raises(CallError):
+        breaker.call(Mock(side_effect=make_CallError(400)))
+    assert breaker.is_open is False
+
+
+def test_CircuitBreaker_forgets_failures_outside_window(monkeypatch):
+    """CircuitBreaker only counts the failures within the window."""
+    clock = fake_time(monkeypatch)
+    breaker = CircuitBreaker(failure_threshold=2, window=10)
+    func = Mock(side_effect=ConnectionRefusedError())
+    with pytest.raises(ConnectionRefusedError):
+        breaker.call(func)
+    clock.now += 11
+    with pytest.raises(ConnectionRefusedError):
+        breaker.call(func)
+    assert breaker.is_open is False
+
+
+def test_CircuitBreaker_counts_slow_calls(monkeypatch):
+    """CircuitBreaker counts calls slower than `slow_call` as failures."""
+    clock = fake_time(monkeypatch)
+    breaker = CircuitBreaker(failure_threshold=1, slow_call=5)
+
+    def slow():
+        clock.now += 6
+        return "result"
+
+    assert breaker.call(slow) == "result"
+    assert breaker.is_open is True
+
+
+def test_CircuitBreaker_doesnt_time_untimed_calls(monkeypatch):
+    """CircuitBreaker doesn't count slow calls that are not timed."""
+    clock = fake_time(monkeypatch)
+    breaker = CircuitBreaker(failure_threshold=1, slow_call=5)
+
+    def upload(data, *, title):
+        clock.now += 6
+        return data, title
+
+    assert breaker.call(upload, "data", title="t", timed=False) == (
+        "data", "t")
+    assert breaker.is_open is False
+
+
+def test_CircuitBreaker_closes_after_successful_trial(monkeypatch):
+    """CircuitBreaker lets a trial call through after the reset timeout."""
+    clock = fake_time(monkeypatch)
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    with pytest.raises(ConnectionRefusedError):
+        breaker.call(Mock(side_effect=ConnectionRefusedError()))
+    clock.now += 31
+    assert breaker.call(Mock(return_value="ok")) == "ok"
+    assert breaker.is_open is False
+
+
+def test_CircuitBreaker_reopens_after_failed_trial(monkeypatch):
+    """CircuitBreaker opens again when the trial call fails."""
+    clock = fake_time(monkeypatch)
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    func = Mock(side_effect=ConnectionRefusedError())
+    for _ in range(3):
+        with pytest.raises(ConnectionRefusedError):
+            breaker.call(func)
+    clock.now += 31
+    with pytest.raises(ConnectionRefusedError):
+        breaker.call(func)
+    with pytest.raises(CircuitOpenError):
+        breaker.call(func)
+    assert func.call_count == 4
+
+
+def test_hedged_call_returns_fast_result_without_hedging():
+    """hedged_call doesn't send the read again when it's fast."""
+    func = Mock(return_value="result")
+    assert hedged_call(func, "arg", delay=5) == "result"
+    assert func.call_count == 1
+
+
+def test_hedged_call_uses_second_call_when_first_is_slow():
+    """hedged_call returns the result of the second call when it's first."""
+    release = threading.Event()
+    calls = []
+
+    def read():
+        calls.append(None)
+        if len(calls) == 1:
+            release.wait(5)
+            return "slow"
+        return "fast"
+
+    try:
+        assert hedged_call(read, delay=0.05) == "fast"
+    finally:
+        release.set()
+    assert len(calls) == 2
+
+
+def test_hedged_call_doesnt_hedge_without_room_in_limiter():
+    """hedged_call only sends the read again when the limiter allows it."""
+    func = Mock(side_effect=lambda: time.sleep(0.05) or "result")
+    limiter = AdaptiveLimiter(initial=1)
+    started = limiter.acquire()
+    assert hedged_call(func, delay=0.01, limiter=limiter) == "result"
+    limiter.release(started)
+    assert func.call_count == 1
+
+
+def test_hedged_call_releases_second_call_in_limiter():
+    """The second call of hedged_call is in flight in the limiter."""
+    release = threading.Event()
+    calls = []
+
+    def read():
+        calls.append(None)
+        if len(calls) == 1:
+            release.wait(5)
+            return "slow"
+        return "fast"
+
+    limiter = AdaptiveLimiter(initial=2, max_limit=2)
+    try:
+        assert hedged_call(read, delay=0.05, limiter=limiter) == "fast"
+    finally:
+        release.set()
+    assert limiter.get_metrics()["calls"] == 1
+    assert limiter.get_metrics()["in_flight"] == 0
+
+
+def test_hedged_call_raises_first_error_when_both_fail():
+    """hedged_call raises the error of the call that failed first."""
+    release = threading.Event()
+    errors = [ValueError("first"), ValueError("second")]
+
+    def read():
+        error = errors.pop(0)
+        if str(error) == "first":
+            release.wait(5)
+        raise error
+
+    def release_later():
+        release.wait(0.2)
+        release.set()
+
+    threading.Thread(target=release_later).start()
+    with pytest.raises(ValueError) as exc:
+        hedged_call(read, delay=0.05)
+    assert str(exc.value) == "second"
+
+
+def test_hedged_call_doesnt_hedge_fast_failures():
+    """hedged_call raises without hedging when the read fails fast."""
+    func = Mock(side_effect=ValueError("failed"))
+    with pytest.raises(ValueError):
+        hedged_call(func, delay=5)
+    assert func.call_count == 1
+
+
+def call_limited(limiter, clock, latency, exc=None, *, timed=True):
+    """Make a call through `limiter` that takes `latency` seconds."""
+    with limiter.limited(timed=timed):
+        clock.now += latency
+        if exc is not None:
+            raise exc
+
+
+def test_AdaptiveLimiter_increases_limit_additively(monkeypatch):
+    """AdaptiveLimiter adds one call per round of healthy calls."""
+    clock = fake_time(monkeypatch)
+    limiter = AdaptiveLimiter(max_limit=3)
+    call_limited(limiter, clock, 1)
+    assert limiter.limit == 2
+    call_limited(limiter, clock, 1)
+    call_limited(limiter, clock, 1)
+    assert limiter.limit == pytest.approx(2.9)
+    call_limited(limiter, clock, 1)
+    assert limiter.limit == 3
+
+
+def test_AdaptiveLimiter_backs_off_on_overload(monkeypatch):
+    """AdaptiveLimiter halves the limit when the region is overloaded."""
+    clock = fake_time(monkeypatch)
+    limiter = AdaptiveLimiter(initial=8, max_limit=8)
+    with pytest.raises(CallError):
+        call_limited(limiter, clock, 1, make_CallError(503))
+    assert limiter.limit == 4
+    clock.now += 1
+    with pytest.raises(TimeoutError):
+        call_limited(limiter, clock, 1, TimeoutError())
+    assert limiter.limit == 2
+    with pytest.raises(CallError):
+        call_limited(limiter, clock, 1, make_CallError(400))
+    assert limiter.limit == 2
+    assert limiter.get_metrics() == {
+        "concurrency_limit": 2, "in_flight": 0, "calls": 3, "backoffs": 2}
+
+
+def test_AdaptiveLimiter_backs_off_on_slow_call(monkeypatch):
+    """AdaptiveLimiter backs off when a call is much slower than average,
+    unless the call isn't timed."""
+    clock = fake_time(monkeypatch)
+    limiter = AdaptiveLimiter(initial=4, max_limit=4, tolerance=2)
+    call_limited(limiter, clock, 1)
+    call_limited(limiter, clock, 10, timed=False)
+    assert limiter.limit == 4
+    call_limited(limiter, clock, 3)
+    assert limiter.limit == 2
+
+
+def test_AdaptiveLimiter_recovers_from_lasting_latency_increase(
+        monkeypatch):
+    """AdaptiveLimiter's average follows a lasting increase of latency, so
+    the limit grows again once the region is steady."""
+    clock = fake_time(monkeypatch)
+    limiter = AdaptiveLimiter(initial=8, max_limit=8)
+    for _ in range(30):
+        call_limited(limiter, clock, 0.05)
+    for _ in range(200):
+        call_limited(limiter, clock, 0.2)
+    assert limiter.latency == pytest.approx(0.2)
+    assert limiter.limit == 8
+    assert limiter.backoffs < 10
+
+
+def test_AdaptiveLimiter_backs_off_once_for_calls_in_flight(monkeypatch):
+    """The calls in flight when the limit decreased don't decrease it
+    again."""
+    clock = fake_time(monkeypatch)
+    limiter = AdaptiveLimiter(initial=8, max_limit=8)
+    first, second = limiter.acquire(), limiter.acquire()
+    clock.now += 1
+    limiter.release(first, healthy=False, overloaded=True)
+    limiter.release(second, healthy=False, overloaded=True)
+    assert limiter.limit == 4
+
+
+def test_AdaptiveLimiter_waits_for_call_in_flight():
+    """AdaptiveLimiter doesn't let more calls than the limit in flight."""
+    limiter = AdaptiveLimiter(initial=1)
+    started = limiter.acquire()
+    acquired = threading.Event()
+
+    def acquire():
+        """Acquire in another thread."""
+        limiter.release(limiter.acquire())
+        acquired.set()
+
+    thread = threading.Thread(target=acquire)
+    thread.start()
+    assert acquired.wait(0.1) is False
+    limiter.release(started)
+    assert acquired.wait(5) is True
+    thread.join()
+
+
+def test_RegionCalls_call_goes_through_limiter_and_breaker():
+    """RegionCalls.call counts the call in the limiter and the breaker."""
+    calls = RegionCalls(breaker=CircuitBreaker(failure_threshold=1))
+    with pytest.raises(ConnectionRefusedError):
+        calls.call(Mock(side_effect=ConnectionRefusedError()))
+    with pytest.raises(CircuitOpenError):
+        calls.call(Mock())
+    assert calls.get_metrics()["calls"] == 2
+    assert calls.get_metrics()["circuit_open"] is True
+
+
+def test_RegionCalls_read_hedges_after_delay(monkeypatch):
+    """RegionCalls.read hedges the read when `hedge_after` is set."""
+    hedged = Mock(return_value=sentinel.result)
+    monkeypatch.setattr(resilience_module, "hedged_call", hedged)
+    calls = RegionCalls(hedge_after=5)
+    assert calls.read(Mock(), 1) is sentinel.result
+    assert hedged.call_args[0][1:] == (1,)
+    assert hedged.call_args[1] == {"delay": 5, "limiter": calls.limiter}
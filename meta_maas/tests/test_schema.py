@@ -0,0 +1,159 @@
+# Copyright 2016 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for `schema.py`."""
+
+import copy
+
+import jsonschema
+import pytest
+import yaml
+
+from ..config import SAMPLE_CONFIG, SCHEMA
+from ..schema import SchemaError, ValidationError, compile_schema, format_path
+
+
+def make_config():
+    """Return a valid configuration."""
+    return yaml.safe_load(SAMPLE_CONFIG.replace("{{APIKEY}}", "apikey"))
+
+
+def test_format_path_formats_json_pointer():
+    """format_path escapes `~` and `/` in keys."""
+    assert format_path(()) == "/"
+    assert format_path(("users", "a/b~c", 0)) == "/users/a~1b~0c/0"
+
+
+def test_compile_schema_returns_document_when_valid():
+    """The validator returns the valid document."""
+    config = make_config()
+    assert compile_schema(SCHEMA)(config) is config
+
+
+@pytest.mark.parametrize("change,path,message", [
+    (lambda config: config.pop("regions"),
+     (), "'regions' is a required property"),
+    (lambda config: config.update(extra=True),
+     (), "additional property 'extra' is not allowed"),
+    (lambda config: config["regions"]["region1"].pop("apikey"),
+     ("regions", "region1"), "'apikey' is a required property"),
+    (lambda config: config["regions"].update({"bad name": {}}),
+     ("regions",), "additional property 'bad name' is not allowed"),
+    (lambda config: config["users"]["user1"].update(is_admin="yes"),
+     ("users", "user1", "is_admin"), "must be of type 'boolean'"),
+    (lambda config: config["images"]["source"]["selections"]["ubuntu"][
+        "arches"].append("amd64"),
+     ("images", "source", "selections", "ubuntu", "arches"),
+     "has non-unique items"),
+    (lambda config: config["images"]["source"]["selections"]["ubuntu"][
+        "releases"].append(16),
+     ("images", "source", "selections", "ubuntu", "releases", 3),
+     "must be of type 'string'"),
+    (lambda config: config["images"]["source"]["selections"]["ubuntu"][
+        "releases"].clear(),
+     ("images", "source", "selections", "ubuntu", "releases"),
+     "must have at least 1 items"),
+    (lambda config: config["images"]["custom"]["custom-raw"].update(
+        filetype="zip"),
+     ("images", "custom", "custom-raw", "filetype"),
+     "'zip' is not one of ['tgz', 'ddtgz', 'raw']"),
+])
+def test_compile_schema_raises_ValidationError_with_path(
+        change, path, message):
+    """The validator raises `ValidationError` with the exact path."""
+    config = make_config()
+    change(config)
+    with pytest.raises(ValidationError) as exc:
+        compile_schema(SCHEMA)(config)
+    assert exc.value.path == path
+    assert exc.value.message == message
+    assert str(exc.value) == "%s: %s" % (format_path(path), message)
+
+
+def test_compile_schema_rejects_keys_that_are_not_strings():
+    """Keys matched with patterns must be strings."""
+    config = make_config()
+    config["users"][1] = {"email": "one@localhost", "password": "pass"}
+    with pytest.raises(ValidationError) as exc:
+        compile_schema(SCHEMA)(config)
+    assert exc.value.path == ("users",)
+
+
+def test_compile_schema_matches_properties_and_patterns():
+    """A property is validated by its name and every matching pattern."""
+    validate = compile_schema({
+        "type": "object",
+        "properties": {"count": {"type": "integer"}},
+        "patternProperties": {"^c": {"type": "number"}},
+        "additionalProperties": {"type": "string"},
+    })
+    validate({"count": 1, "cost": 1.5, "name": "name"})
+    with pytest.raises(ValidationError) as exc:
+        validate({"count": True})
+    assert exc.value.path == ("count",)
+    with pytest.raises(ValidationError) as exc:
+        validate({"name": 1})
+    assert exc.value.path == ("name",)
+
+
+def test_compile_schema_supports_list_of_types():
+    """The keywords of a type only apply to values of that type."""
+    validate = compile_schema({
+        "type": ["object", "string"],
+        "required": ["name"],
+        "pattern": "^/",
+    })
+    validate({"name": "name"})
+    validate("/path")
+    with pytest.raises(ValidationError) as exc:
+        validate(1)
+    assert exc.value.message == "must be of type 'object' or 'string'"
+    with pytest.raises(ValidationError):
+        validate("path")
+    with pytest.raises(ValidationError):
+        validate({})
+
+
+def test_compile_schema_agrees_with_jsonschema():
+    """The validator accepts exactly the documents jsonschema accepts."""
+    documents = [make_config(), {}, [], {"regions": {}}]
+    changes = [
+        ("regions", "region1", "url"),
+        ("users", "admin1", "is_admin"),
+        ("users", "user1", "email"),
+        ("images", "source", "selections", "ubuntu", "arches"),
+        ("images", "custom", "custom-ddtgz", "filetype"),
+    ]
+    for path in changes:
+        for value in [None, 1, True, "value", [], ["amd64", "amd64"], {}]:
+            config = make_config()
+            parent = config
+            for key in path[:-1]:
+                parent = parent[key]
+            parent[path[-1]] = value
+            documents.append(config)
+            config = copy.deepcopy(config)
+            del parent[path[-1]]
+            documents.append(config)
+    validate = compile_schema(SCHEMA)
+    for document in documents:
+        try:
+            jsonschema.validate(document, SCHEMA)
+        except jsonschema.ValidationError as expected:
+            with pytest.raises(ValidationError) as exc:
+                validate(document)
+            assert exc.value.path == tuple(expected.absolute_path)
+        else:
+            validate(document)
+
+
+def test_compile_schema_raises_SchemaError_for_unsupported_keyword():
+    """Keywords that are not supported are not silently ignored."""
+    with pytest.raises(SchemaError):
+        compile_schema({"type": "object", "minProperties": 1})
+
+
+def test_compile_schema_raises_SchemaError_for_keyword_without_type():
+    """Keywords of a type must be given with the type."""
+    with pytest.raises(SchemaError):
+        compile_schema({"required": ["name"]})
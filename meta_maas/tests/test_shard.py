@@ -0,0 +1,53 @@
+# Copyright 2016 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for `shard.py`."""
+
+import pytest
+
+from ..shard import HashRing, ShardError, parse_shard, select_shard
+
+
+def test_parse_shard_returns_index_and_count():
+    """parse_shard returns the index and count."""
+    assert parse_shard("2/5") == (2, 5)
+
+
+@pytest.mark.parametrize("value", ["", "1", "a/b", "0/3", "4/3", "1/0"])
+def test_parse_shard_raises_ShardError_on_invalid(value):
+    """parse_shard raises `ShardError` on an invalid shard."""
+    with pytest.raises(ShardError):
+        parse_shard(value)
+
+
+def test_select_shard_returns_all_when_None():
+    """select_shard returns every name when shard is None."""
+    assert select_shard(["b", "a"], None) == ["b", "a"]
+
+
+def test_select_shard_partitions_names():
+    """select_shard places every name in exactly one shard."""
+    names = ["region%d" % i for i in range(200)]
+    shards = [select_shard(names, (i, 4)) for i in range(1, 5)]
+    assert sorted(sum(shards, [])) == sorted(names)
+    # Consistent hashing should not leave any shard empty.
+    assert all(shards)
+
+
+def test_select_shard_is_deterministic():
+    """select_shard returns the same names on every call."""
+    names = ["region%d" % i for i in range(50)]
+    assert select_shard(names, (2, 3)) == select_shard(names, (2, 3))
+
+
+def test_HashRing_moves_few_keys_when_shard_added():
+    """Adding a shard only moves the keys that now belong to it."""
+    names = ["region%d" % i for i in range(500)]
+    ring_four, ring_five = HashRing(4), HashRing(5)
+    moved = [
+        name
+        for name in names
+        if ring_four.get_shard(name) != ring_five.get_shard(name)
+    ]
+    assert all(ring_five.get_shard(name) == 5 for name in moved)
+    assert len(moved) < len(names) / 2
@@ -0,0 +1,46 @@
+# Copyright 2016 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for `state.py`."""
+
+import pytest
+
+from ..state import get_cache_dir, write_atomically
+
+
+def test_get_cache_dir_uses_xdg_cache_home(tmpdir, monkeypatch):
+    """get_cache_dir creates the directory under $XDG_CACHE_HOME."""
+    monkeypatch.delenv("SNAP_USER_COMMON", raising=False)
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmpdir))
+    assert get_cache_dir("images") == str(tmpdir.join("meta-maas", "images"))
+    assert tmpdir.join("meta-maas", "images").check(dir=True)
+
+
+def test_get_cache_dir_uses_snap_user_common(tmpdir, monkeypatch):
+    """get_cache_dir uses $SNAP_USER_COMMON when running in a snap."""
+    monkeypatch.setenv("SNAP_USER_COMMON", str(tmpdir))
+    assert get_cache_dir() == str(tmpdir.join("meta-maas"))
+
+
+def test_write_atomically_replaces_file_once_written(tmpdir):
+    """write_atomically only replaces the file once the body completes."""
+    path = tmpdir.join("state.json")
+    path.write("old")
+    with write_atomically(str(path)) as stream:
+        stream.write("new")
+        assert path.read() == "old"
+    assert path.read() == "new"
+    assert tmpdir.listdir() == [path]
+
+
+def test_write_atomically_removes_partial_file_on_error(tmpdir):
+    """write_atomically keeps the file and removes the partial file when
+    the body fails."""
+    path = tmpdir.join("state.json")
+    path.write("old")
+    with pytest.raises(ValueError):
+        with write_atomically(str(path)) as stream:
+            stream.write("new")
+            raise ValueError()
+    assert path.read() == "old"
+    assert tmpdir.listdir() == [path]
@@ -0,0 +1,114 @@
+# Copyright 2016 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for `users.py`."""
+
+import json
+
+import pytest
+
+from ..users import UserSourceError, describe_users, iter_batches, iter_users
+
+
+def test_iter_users_handles_None_and_mapping():
+    """iter_users yields the users of a mapping."""
+    assert list(iter_users(None)) == []
+    assert list(iter_users({"admin": {"password": "pass"}})) == [
+        ("admin", {"password": "pass"})]
+
+
+def test_iter_users_reads_csv(tmpdir):
+    """iter_users reads a CSV file, leaving out empty cells."""
+    path = tmpdir.join("users.csv")
+    path.write(
+        "username,email,password,is_admin\n"
+        "admin,admin@localhost,pass1,Yes\n"
+        "user,user@localhost,pass2,\n")
+    assert list(iter_users(str(path))) == [
+        ("admin", {
+            "email": "admin@localhost", "password": "pass1",
+            "is_admin": True,
+        }),
+        ("user", {"email": "user@localhost", "password": "pass2"}),
+    ]
+
+
+def test_iter_users_reads_ndjson(tmpdir):
+    """iter_users reads an NDJSON file, skipping blank lines."""
+    path = tmpdir.join("users.ndjson")
+    path.write("\n".join([
+        json.dumps({
+            "username": "admin", "email": "admin@localhost",
+            "password": "pass", "is_admin": True,
+        }),
+        "",
+    ]))
+    assert list(iter_users(str(path))) == [
+        ("admin", {
+            "email": "admin@localhost", "password": "pass",
+            "is_admin": True,
+        }),
+    ]
+
+
+def test_iter_users_reads_file_as_stream(tmpdir):
+    """iter_users validates each record as it's read."""
+    path = tmpdir.join("users.ndjson")
+    path.write("\n".join([
+        json.dumps({
+            "username": "admin", "email": "admin@localhost",
+            "password": "pass",
+        }),
+        json.dumps({"username": "bad name"}),
+    ]))
+    users = iter_users(str(path))
+    assert next(users)[0] == "admin"
+    with pytest.raises(UserSourceError) as exc:
+        next(users)
+    assert str(exc.value) == (
+        "Invalid user in %s, record 2: /: 'email' is a required property" % (
+            path))
+
+
+def test_iter_users_raises_UserSourceError_with_path_of_value(tmpdir):
+    """An invalid value is reported with its record and path."""
+    path = tmpdir.join("users.csv")
+    path.write(
+        "username,email,password,is_admin\n"
+        "admin,admin@localhost,pass,maybe\n")
+    with pytest.raises(UserSourceError) as exc:
+        list(iter_users(str(path)))
+    assert str(exc.value) == (
+        "Invalid user in %s, record 1: /is_admin: must be of type "
+        "'boolean'" % path)
+
+
+@pytest.mark.parametrize("filename,content", [
+    ("users.csv", "username,email,password\nadmin,a@localhost,pass,extra\n"),
+    ("users.ndjson", "{\"username\": \n"),
+    ("missing.csv", None),
+])
+def test_iter_users_raises_UserSourceError_when_unreadable(
+        tmpdir, filename, content):
+    """iter_users raises `UserSourceError` when the file can't be read."""
+    path = tmpdir.join(filename)
+    if content is not None:
+        path.write(content)
+    with pytest.raises(UserSourceError):
+        list(iter_users(str(path)))
+
+
+def test_iter_batches_yields_bounded_batches():
+    """iter_batches yields lists of up to `size` items."""
+    assert list(iter_batches(iter(range(5)), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(iter_batches([], 2)) == []
+
+
+def test_describe_users_uses_checksum_of_file(tmpdir):
+    """describe_users changes when the users file changes."""
+    path = tmpdir.join("users.csv")
+    path.write("username,email,password\n")
+    before = describe_users(str(path))
+    path.write("username,email,password\nadmin,admin@localhost,pass\n")
+    assert describe_users(str(path)) != before
+    assert describe_users({"admin": {}}) == {"admin": {}}
@@ -0,0 +1,154 @@
+# Copyright 2016 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Read the users from the configuration or from a CSV or NDJSON file."""
+
+import csv
+import functools
+import itertools
+import json
+
+from .journal import get_file_checksum
+from .schema import ValidationError, compile_schema
+
+
+# Usernames that can be created on a region.
+USERNAME_PATTERN = r"^\w+$"
+
+USER_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "email": {
+            "type": "string",
+        },
+        "password": {
+            "type": "string",
+        },
+        "is_admin": {
+            "type": "boolean",
+        },
+    },
+    "additionalProperties": False,
+    "required": ["email", "password"],
+}
+
+# Schema of a record in a users file, which also holds the username.
+RECORD_SCHEMA = dict(
+    USER_SCHEMA,
+    properties=dict(
+        USER_SCHEMA["properties"],
+        username={"type": "string", "pattern": USERNAME_PATTERN}),
+    required=["username"] + USER_SCHEMA["required"])
+
+# Values of `is_admin` in a CSV file.
+CSV_BOOLEANS = {
+    "true": True, "yes": True, "1": True,
+    "false": False, "no": False, "0": False,
+}
+
+# Number of users compared with a region at a time.
+BATCH_SIZE = 1000
+
+
+class UserSourceError(Exception):
+    """Raised when the users file cannot be read."""
+
+
+@functools.lru_cache()
+def get_record_validator():
+    """Return the function that validates a record of a users file."""
+    return compile_schema(RECORD_SCHEMA)
+
+
+def read_csv_records(stream):
+    """Yield the users in the CSV `stream` as records.
+
+    The first row names the columns. Empty cells are left out of the record.
+    """
+    reader = csv.DictReader(stream)
+    for row in reader:
+        if None in row:
+            raise csv.Error(
+                "line %d has more cells than there are columns" % (
+                    reader.line_num))
+        record = {
+            column: value
+            for column, value in row.items()
+            if value not in (None, "")
+        }
+        is_admin = record.get("is_admin")
+        if is_admin is not None:
+            record["is_admin"] = CSV_BOOLEANS.get(
+                is_admin.strip().lower(), is_admin)
+        yield record
+
+
+def read_ndjson_records(stream):
+    """Yield the users in the NDJSON `stream` as records.
+
+    Blank lines are skipped.
+    """
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+
+def iter_file_users(path):
+    """Yield `(username, data)` for each user in the file at `path`.
+
+    The file is CSV when its name ends with `.csv` and NDJSON otherwise. It's
+    read as a stream and each record is validated as it's read, so the users
+    never have to fit in memory.
+    """
+    read_records = (
+        read_csv_records if path.lower().endswith(".csv")
+        else read_ndjson_records)
+    validate = get_record_validator()
+    try:
+        with open(path, "r", newline="") as stream:
+            for number, record in enumerate(read_records(stream), 1):
+                try:
+                    validate(record)
+                except ValidationError as exc:
+                    raise UserSourceError(
+                        "Invalid user in %s, record %d: %s" % (
+                            path, number, exc)) from exc
+                data = dict(record)
+                yield data.pop("username"), data
+    except (OSError, ValueError, csv.Error) as exc:
+        raise UserSourceError(
+            "Unable to read users from %s: %s" % (path, exc)) from exc
+
+
+def iter_users(users):
+    """Yield `(username, data)` for each of the `users`.
+
+    :param users: Mapping of the users from the configuration, the path of
+        a users file or None when there are no users.
+    """
+    if users is None:
+        return iter(())
+    if isinstance(users, str):
+        return iter_file_users(users)
+    return iter(users.items())
+
+
+def iter_batches(iterable, size=BATCH_SIZE):
+    """Yield lists of up to `size` items from `iterable`."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def describe_users(users):
+    """Return a value that changes when the `users` change.
+
+    A users file is described by its checksum so it doesn't have to be read
+    into memory to be compared.
+    """
+    if isinstance(users, str):
+        return {"path": users, "sha256": get_file_checksum(users)}
+    return users